@@ -1,7 +1,7 @@
 import os
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from chat_memory import ConversationMemory
 
 # ==============================================================================
 # 🦸 Demo LLM - Phase A : Étape 2 : Conversation en Terminal
@@ -9,6 +9,10 @@ from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 # Ce programme permet d'avoir une conversation interactive avec le LLM.
 # ASPECT CLÉ : Contrairement à l'étape 1, nous conservons la liste des messages
 # échangés pour que le LLM ait le "contexte" de la discussion en cours.
+# ASPECT CLÉ 2 : Mémoire bornée. On n'envoie pas TOUTE la liste : message système
+# + résumé des tours anciens + les derniers tours mot pour mot (budget de jetons).
+# La taille du prompt reste à peu près constante, quelle que soit la durée du chat.
+# La mémoire (ConversationMemory) vit dans chat_memory.py, partagée avec A03.
 # ==============================================================================
 
 def main():
@@ -31,11 +35,13 @@ def main():
         temperature=0.7
     )
 
-    # ASPECT CLÉ : Initialisation de la mémoire de session (liste de messages)
+    # ASPECT CLÉ : Initialisation de la mémoire de session
     # On commence par un message système pour définir le comportement de l'IA.
-    messages = [
-        SystemMessage(content="Tu es un assistant expert de l'univers Marvel. Tu réponds de manière précise et enthousiaste. Tu fais des réponses courtes et concises.")
-    ]
+    memory = ConversationMemory(
+        llm,
+        "Tu es un assistant expert de l'univers Marvel. Tu réponds de manière précise et enthousiaste. Tu fais des réponses courtes et concises.",
+        model_name
+    )
 
     print("--- Demo LLM - Étape 2 : Mode Chat Interactif ---")
     print("(Tapez 'exit' ou 'quitter' pour arrêter la conversation)")
@@ -51,22 +57,22 @@ def main():
         if not user_input.strip():
             continue
 
-        # 2. Ajout du message utilisateur à l'historique de la session
-        # ASPECT CLÉ : On accumule les messages dans la liste 'messages'
-        messages.append(HumanMessage(content=user_input))
+        # 2. Construction des messages du tour à partir de la mémoire
+        # ASPECT CLÉ : Système + résumé + derniers tours + nouvelle question (taille bornée)
+        messages = memory.build_messages(user_input)
         
-        print(f"\n[Attente de la réponse du modèle '{model_name}'...]")
+        print(f"\n[Mémoire] {memory.stats(messages)}")
+        print(f"[Attente de la réponse du modèle '{model_name}'...]")
         
         try:
-            # 3. Appel du modèle avec toute la continuité des messages
-            # ASPECT CLÉ : On passe LA LISTE COMPLÈTE au LLM
+            # 3. Appel du modèle avec la continuité de la conversation
             response = llm.invoke(messages)
             
             # 4. Affichage et mémorisation de la réponse de l'IA
             print("\nAI : " + response.content)
             
-            # ASPECT CLÉ : Il faut aussi mémoriser la réponse de l'AI pour le prochain tour
-            messages.append(AIMessage(content=response.content))
+            # ASPECT CLÉ : Il faut aussi mémoriser le tour (question + réponse) pour le prochain
+            memory.add_turn(user_input, response.content)
             
         except Exception as e:
             print(f"\nUne erreur est survenue : {e}")
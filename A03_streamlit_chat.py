@@ -3,12 +3,16 @@ import streamlit as st
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from chat_memory import ConversationMemory
 
 # ==============================================================================
 # Demo LLM - Phase A : Étape 3 : Interface Graphique (Streamlit)
 # ==============================================================================
 # Ce programme offre une interface web professionnelle pour la conversation.
 # ASPECT CLÉ : Séparation stricte entre le "Core LLM" et l'interface "Streamlit".
+# ASPECT CLÉ 2 : Mémoire bornée (comme A02) : système + résumé glissant + derniers
+# tours. L'écran affiche toute la conversation, le LLM n'en reçoit qu'un prompt borné.
+# Même classe que A02, importée de chat_memory.py.
 # ==============================================================================
 # python -m streamlit run 03_streamlit_chat.py
 
@@ -41,10 +45,14 @@ def add_message_to_history(history, role, text):
         history.append(AIMessage(content=text))
     return history
 
-def get_llm_response_stream(llm, message_history):
+def create_memory(llm):
+    """Mémoire bornée de la session, initialisée avec le message système."""
+    return ConversationMemory(llm, get_session_starter_messages()[0].content, os.getenv("LLM_MODEL"))
+
+def get_llm_response_stream(llm, memory, prompt):
     """Déclenche l'appel au LLM et retourne le flux de streaming (générateur)."""
-    # ASPECT CLÉ : C'est ici que la continuité se fait en envoyant l'historique complet.
-    return llm.stream(message_history)
+    # ASPECT CLÉ : La continuité passe par la mémoire (résumé + derniers tours), pas l'historique complet.
+    return llm.stream(memory.build_messages(prompt))
 
 
 # ------------------------------------------------------------------------------
@@ -69,7 +77,19 @@ def render_sidebar():
         if st.button("🗑️ Nouvelle Conversation", use_container_width=True):
             # Réinitialisation via le Core LLM
             st.session_state.messages = get_session_starter_messages()
+            st.session_state.pop("memory", None)
             st.rerun()
+        memory_box = st.empty()
+    return memory_box
+
+def render_memory_stats(memory_box, memory):
+    """Taille du prompt envoyé au prochain tour : elle reste stable au fil de la conversation."""
+    with memory_box.container():
+        st.caption("🧠 Mémoire de conversation :")
+        st.caption(memory.stats(memory.build_messages("")))
+        if memory.summary:
+            with st.expander("Résumé des tours anciens"):
+                st.write(memory.summary)
 
 def render_chat_history():
     """Affiche les messages stockés en ignorant les messages système."""
@@ -81,14 +101,14 @@ def render_chat_history():
             with st.chat_message("assistant"):
                 st.markdown(msg.content)
 
-def handle_user_interaction(llm):
+def handle_user_interaction(llm, memory):
     """Gère la saisie utilisateur et la réponse streamée de l'IA."""
     if prompt := st.chat_input("Posez votre question sur les super-héros..."):
         # UI : Affichage utilisateur
         with st.chat_message("user"):
             st.markdown(prompt)
         
-        # Core : Mise à jour historique
+        # Core : Mise à jour historique (affichage)
         st.session_state.messages = add_message_to_history(st.session_state.messages, "user", prompt)
 
         # UI & Core : Réponse en streaming
@@ -98,7 +118,7 @@ def handle_user_interaction(llm):
             
             try:
                 # Appel au générateur du Core LLM
-                for chunk in get_llm_response_stream(llm, st.session_state.messages):
+                for chunk in get_llm_response_stream(llm, memory, prompt):
                     full_response += chunk.content
                     placeholder.markdown(full_response + "▌")
                 
@@ -106,6 +126,7 @@ def handle_user_interaction(llm):
                 
                 # Core : Mémorisation de la réponse AI
                 st.session_state.messages = add_message_to_history(st.session_state.messages, "assistant", full_response)
+                memory.add_turn(prompt, full_response)
                 
             except Exception as e:
                 st.error(f"Erreur LLM : {e}")
@@ -113,18 +134,21 @@ def handle_user_interaction(llm):
 def main():
     # 1. Configuration Initiale
     configure_page()
-    render_sidebar()
+    memory_box = render_sidebar()
     
-    # 2. Initialisation du State (Core LLM)
+    # 2. Initialisation du LLM (Core LLM)
+    llm_client = init_llm()
+
+    # 3. Initialisation du State (Core LLM)
     if "messages" not in st.session_state:
         st.session_state.messages = get_session_starter_messages()
-    
-    # 3. Initialisation du LLM (Core LLM)
-    llm_client = init_llm()
+    if "memory" not in st.session_state:
+        st.session_state.memory = create_memory(llm_client)
 
     # 4. Rendu de l'interface
     render_chat_history()
-    handle_user_interaction(llm_client)
+    handle_user_interaction(llm_client, st.session_state.memory)
+    render_memory_stats(memory_box, st.session_state.memory)
 
 if __name__ == "__main__":
     main()
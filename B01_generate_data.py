@@ -1,8 +1,12 @@
 import os
 import json
+import time
+import random
+import asyncio
+import argparse
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
 # ==============================================================================
 # Demo LLM - Phase B : Étape 1 : Génération de Données (Préparation RAG)
@@ -11,7 +15,16 @@ from langchain_core.messages import HumanMessage, SystemMessage
 # ASPECT CLÉ : Chaque fichier est généré de manière autonome et incrémentale.
 # Le but est de créer une base de connaissances textuelle qui sera utilisée
 # lors de l'étape du RAG (Retrieval Augmented Generation).
+# ASPECT CLÉ 2 : Génération concurrente (asyncio + sémaphore) : N appels LLM en
+# vol au maximum, chacun avec un délai maximal et des reprises avec backoff.
+# Chaque fiche est écrite atomiquement dès qu'elle est prête : un run interrompu
+# reprend sans régénérer les fiches terminées.
+# ASPECT CLÉ 3 : Les tokens sont écrits au fil de l'eau dans un fichier .partial.
+# Après une coupure, on demande au modèle de CONTINUER le texte déjà reçu au lieu
+# de tout recommencer. Métriques par fiche : temps jusqu'au premier token (TTFT),
+# tokens/s et octets/s.
 # ==============================================================================
+# python B01_generate_data.py --concurrency 8 --timeout 120 --deadline 600 --retries 3
 
 # ------------------------------------------------------------------------------
 # SECTION 1 : LOGIQUE COEUR LLM (Interaction spécifique pour la génération)
@@ -27,9 +40,9 @@ def init_llm():
         temperature=0.7
     )
 
-def generate_entity_content(llm, entity_name, entity_type):
+def build_messages(entity_name, entity_type):
     """
-    Demande au LLM de générer un contenu très détaillé.
+    Prompt de génération d'une fiche.
     ASPECT CLÉ : On utilise un prompt très directif pour obtenir un texte long et structuré.
     """
     if entity_type == "hero":
@@ -55,14 +68,79 @@ def generate_entity_content(llm, entity_name, entity_type):
         Sois très exhaustif sur l'intrigue.
         N'utilise pas de style Markdown complexe, juste des titres de sections clairs."""
 
-    print(f"   [LLM] Génération en cours pour : {entity_name}...")
-    messages = [
+    return [
         SystemMessage(content="Tu es un historien expert de l'univers Cinématographique Marvel (MCU)."),
         HumanMessage(content=prompt)
     ]
-    
-    response = llm.invoke(messages)
-    return response.content
+
+def continuation_messages(entity_name, entity_type, partial):
+    """Reprise : le début déjà reçu est rendu au modèle, qui doit poursuivre sans répéter."""
+    return build_messages(entity_name, entity_type) + [
+        AIMessage(content=partial),
+        HumanMessage(content="Ta réponse a été interrompue. Continue EXACTEMENT là où le texte s'arrête, "
+                             "sans rien répéter ni ajouter d'introduction.")
+    ]
+
+async def generate_entity_content(llm, entity_name, entity_type, filepath, timeout=120.0, retries=3, deadline=600.0):
+    """
+    Génère une fiche en streaming vers `filepath + ".partial"` (vidé sur disque à chaque token),
+    puis la renomme en `filepath` une fois complète. Renvoie les métriques de génération.
+    ASPECT CLÉ : `timeout` = silence maximal entre deux tokens, `deadline` = durée maximale
+    d'un essai (un flux lent mais jamais silencieux est aussi coupé). Après une erreur, reprise
+    avec backoff exponentiel (+ gigue) à partir du contenu partiel (y compris d'un run précédent).
+    """
+    partial_path = filepath + ".partial"
+    partial = ""
+    if os.path.exists(partial_path):
+        with open(partial_path, "r", encoding="utf-8") as f:
+            partial = f.read()
+        print(f"   [LLM] ♻️ {entity_name} : reprise d'un fichier partiel ({len(partial)} caractères)")
+    metrics = {"entity": entity_name, "ttft_s": None, "tokens": 0, "bytes": 0, "attempts": 0}
+    start = time.perf_counter()
+
+    for attempt in range(retries + 1):
+        metrics["attempts"] += 1
+        messages = continuation_messages(entity_name, entity_type, partial) if partial else build_messages(entity_name, entity_type)
+        attempt_end = asyncio.get_running_loop().time() + deadline
+        try:
+            with open(partial_path, "a", encoding="utf-8") as f:
+                stream = llm.astream(messages).__aiter__()
+                try:
+                    while True:
+                        remaining = attempt_end - asyncio.get_running_loop().time()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError("durée maximale de l'essai dépassée")
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), min(timeout, remaining))
+                        except StopAsyncIteration:
+                            break
+                        if not chunk.content:
+                            continue
+                        if metrics["ttft_s"] is None:
+                            metrics["ttft_s"] = time.perf_counter() - start
+                        f.write(chunk.content)
+                        f.flush()
+                        partial += chunk.content
+                        metrics["tokens"] += 1
+                        metrics["bytes"] += len(chunk.content.encode("utf-8"))
+                finally:
+                    # Ferme la requête HTTP en cours (sinon la connexion reste ouverte après un timeout)
+                    await stream.aclose()
+            break
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = 2 ** attempt + random.random()
+            print(f"   [LLM] ⚠️ {entity_name} : {type(e).__name__} après {len(partial)} caractères "
+                  f"(essai {attempt + 1}/{retries + 1}), reprise dans {delay:.1f} s")
+            await asyncio.sleep(delay)
+
+    os.replace(partial_path, filepath)
+    elapsed = time.perf_counter() - start
+    metrics["total_s"] = elapsed
+    metrics["tokens_per_s"] = metrics["tokens"] / elapsed if elapsed else 0.0
+    metrics["bytes_per_s"] = metrics["bytes"] / elapsed if elapsed else 0.0
+    return metrics
 
 # ------------------------------------------------------------------------------
 # SECTION 2 : GESTION DES FICHIERS ET PROCESSUS
@@ -81,8 +159,48 @@ def ensure_data_dir():
         print(f"[Info] Dossier créé : {target_dir}")
     return target_dir
 
+def clean_filename(entity, entity_type):
+    """ASPECT CLÉ : Assainissement du nom de fichier pour Windows (retrait des : et autres caractères invalides)."""
+    clean_name = entity.replace(':', '').replace('(', '').replace(')', '').replace(' ', '_').lower()
+    return f"{entity_type}_{clean_name}.txt"
+
+async def generate_all(llm, tasks, target_dir, concurrency, timeout, retries, deadline):
+    """
+    Génère toutes les fiches manquantes, au plus `concurrency` appels LLM simultanés.
+    Renvoie (métriques des fiches créées, échecs).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = {"done": [], "failed": []}
+    start = time.perf_counter()
+
+    async def worker(entity, entity_type):
+        filename = clean_filename(entity, entity_type)
+        async with semaphore:
+            print(f"   [LLM] Génération en cours pour : {entity}...")
+            try:
+                metrics = await generate_entity_content(llm, entity, entity_type, os.path.join(target_dir, filename), timeout, retries, deadline)
+            except Exception as e:
+                progress["failed"].append(entity)
+                print(f" [!] Erreur pour {entity} : {e} (le fichier .partial sera repris au prochain run)")
+                return
+        progress["done"].append(metrics)
+        print(f" [+] Fiche créée : {filename} ({len(progress['done']) + len(progress['failed'])}/{len(tasks)}, "
+              f"{time.perf_counter() - start:.0f} s)")
+
+    await asyncio.gather(*(worker(entity, entity_type) for entity, entity_type in tasks))
+    return progress["done"], progress["failed"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Générateur de fiches Marvel par LLM (concurrent et reprenable)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Appels LLM simultanés (1 = séquentiel)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Silence maximal entre deux tokens (secondes)")
+    parser.add_argument("--deadline", type=float, default=600.0, help="Durée maximale d'un essai de génération (secondes)")
+    parser.add_argument("--retries", type=int, default=3, help="Nouvelles tentatives après un échec ou un délai dépassé")
+    return parser.parse_args()
+
 def main():
     print("--- Demo LLM - Étape 4 : Générateur de Base de Connaissances ---")
+    args = parse_args()
     
     # 1. Initialisations
     try:
@@ -93,43 +211,27 @@ def main():
         print(f"Erreur d'initialisation : {e}")
         return
 
-    # 2. Traitement des héros
-    print("\n--- Traitement des Héros ---")
-    for hero in config.get("heroes", []):
-        # ASPECT CLÉ : Assainissement du nom de fichier pour Windows (retrait des : et autres caractères invalides)
-        clean_name = hero.replace(':', '').replace('(', '').replace(')', '').replace(' ', '_').lower()
-        filename = f"hero_{clean_name}.txt"
-        filepath = os.path.join(target_dir, filename)
-        
-        if os.path.exists(filepath):
-            print(f" [OK] La fiche pour '{hero}' existe déjà. Skipping.")
-        else:
-            try:
-                content = generate_entity_content(llm, hero, "hero")
-                with open(filepath, "w", encoding="utf-8") as f:
-                    f.write(content)
-                print(f" [+] Fiche créée : {filename}")
-            except Exception as e:
-                print(f" [!] Erreur pour {hero} : {e}")
-
-    # 3. Traitement des films
-    print("\n--- Traitement des Films/Arcs ---")
-    for movie in config.get("movies", []):
-        # ASPECT CLÉ : Assainissement du nom de fichier pour Windows
-        clean_name = movie.replace(':', '').replace('(', '').replace(')', '').replace(' ', '_').lower()
-        filename = f"movie_{clean_name}.txt"
-        filepath = os.path.join(target_dir, filename)
-        
-        if os.path.exists(filepath):
-            print(f" [OK] La fiche pour '{movie}' existe déjà. Skipping.")
-        else:
-            try:
-                content = generate_entity_content(llm, movie, "movie")
-                with open(filepath, "w", encoding="utf-8") as f:
-                    f.write(content)
-                print(f" [+] Fiche créée : {filename}")
-            except Exception as e:
-                print(f" [!] Erreur pour {movie} : {e}")
+    # 2. Fiches à générer : celles déjà présentes sur disque sont terminées (reprise)
+    tasks = []
+    for entity_type, key in (("hero", "heroes"), ("movie", "movies")):
+        for entity in config.get(key, []):
+            if os.path.exists(os.path.join(target_dir, clean_filename(entity, entity_type))):
+                print(f" [OK] La fiche pour '{entity}' existe déjà. Skipping.")
+            else:
+                tasks.append((entity, entity_type))
+
+    # 3. Génération concurrente
+    print(f"\n--- Génération de {len(tasks)} fiche(s), {args.concurrency} en parallèle ---")
+    start = time.perf_counter()
+    created, failed = asyncio.run(generate_all(llm, tasks, target_dir, args.concurrency, args.timeout, args.retries, args.deadline))
+    if created:
+        print(f"\n{'Fiche':<32}{'TTFT (s)':>10}{'Tokens':>8}{'Tokens/s':>10}{'Ko/s':>8}{'Essais':>8}")
+        for m in created:
+            ttft = f"{m['ttft_s']:.2f}" if m["ttft_s"] is not None else "-"
+            print(f"{m['entity'][:31]:<32}{ttft:>10}{m['tokens']:>8}{m['tokens_per_s']:>10.1f}{m['bytes_per_s'] / 1024:>8.2f}{m['attempts']:>8}")
+    print(f"\n[Info] ⏱️ {len(created)} fiche(s) créée(s) en {time.perf_counter() - start:.1f} s")
+    if failed:
+        print(f"[Info] ❌ Échec pour : {', '.join(failed)}. Relancez le script pour les reprendre.")
 
     print("\n--- Terminé ! Vos fichiers sources sont prêts dans data/source_files/ ---")
 
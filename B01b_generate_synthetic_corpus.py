@@ -0,0 +1,241 @@
+import os
+import re
+import json
+import time
+import random
+import argparse
+import unicodedata
+import multiprocessing
+
+# ==============================================================================
+# Demo LLM - Phase B : Étape 1b : Corpus Synthétique pour les Tests de Charge
+# ==============================================================================
+# ASPECT CLÉ : B01 a besoin d'un LLM et ne produit qu'une quinzaine de fiches.
+# Ce générateur est HORS LIGNE et DÉTERMINISTE : la fiche n°i ne dépend que de
+# (graine, i). On peut donc produire 10 000 à 1 000 000 de fiches héros / films /
+# vilains, en parallèle, reprendre une génération interrompue, et retrouver
+# exactement le même corpus d'une machine à l'autre.
+# Les entités de data_config.json servent de base ; chaque fiche est une "variante
+# multivers" (Terre-N) pour garantir des noms uniques. La longueur des fiches suit
+# une loi log-normale calée sur les vraies fiches de data/source_files.
+# Un jeu de questions "or" est écrit à côté, pour B02g (recall / MRR à l'échelle).
+# ==============================================================================
+# python B01b_generate_synthetic_corpus.py --count 10000 --workers 8
+# python B02a_create_vector_db.py --source-dir data/synthetic/source_files --index-dir data/synthetic/faiss_index --tracking-file data/synthetic/processed_files.json
+# python B02g_benchmark_regression.py --source-dir data/synthetic/source_files --gold-set data/synthetic/retrieval_gold_set.json
+
+OUTPUT_DIR = os.path.join("data", "synthetic")
+CONFIG_FILE = "data_config.json"
+
+# Longueur des fiches (caractères) : médiane et dispersion log-normale par type
+LENGTHS = {
+    "hero": (9000, 0.35),
+    "movie": (14000, 0.25),
+    "vilain": (4000, 0.6),
+}
+MIN_LENGTH, MAX_LENGTH = 800, 60000
+
+SECTIONS = {
+    "hero": ["IDENTITÉ ET ORIGINES", "CAPACITÉS, ARMES ET ÉQUIPEMENTS TECHNIQUES", "PARCOURS DANS LE MCU",
+             "RELATIONS CLÉS ET ALLIANCES", "IMPORTANCE STRATÉGIQUE DANS LA CHRONOLOGIE"],
+    "movie": ["SYNOPSIS DÉTAILLÉ", "ÉVÉNEMENTS CLÉS ET POINTS DE BASCULE", "PERSONNAGES CENTRAUX ET LEURS ENJEUX",
+              "CONSÉQUENCES ET IMPACT SUR LA SUITE DU MCU", "THÉMATIQUES ET SECRETS DE PRODUCTION"],
+    "vilain": ["IDENTITÉ ET ORIGINES", "MOTIVATIONS ET IDÉOLOGIE", "POUVOIRS ET ARMES", "AFFRONTEMENTS MAJEURS"],
+}
+
+# Vocabulaire des gabarits (complété par les entités de data_config.json)
+VOCABULARY = {
+    "hero_cores": ["Faucon", "Comète", "Sentinelle", "Vortex", "Titan", "Spectre", "Aurore", "Orage", "Phénix",
+                   "Cobalt", "Nova", "Éclipse", "Givre", "Onyx", "Zéphyr", "Rune", "Boussole", "Vigie"],
+    "hero_prefixes": ["Captain", "Iron", "Docteur", "Black", "Silver", "Scarlet", "Ultra", "Mighty", "Lady", "Agent"],
+    "movie_patterns": ["{franchise} : L'Ère de {core}", "{franchise} : La Chute de {core}", "{franchise} : Le Retour de {core}",
+                       "{franchise} : Le Crépuscule de {core}", "{franchise} : Opération {core}"],
+    "franchises": ["Avengers", "Thor", "Captain America", "Les Gardiens de la Galaxie", "Iron Man", "Doctor Strange"],
+    "villains": ["Thanos", "Venom", "Ultron", "Hela", "Ronan", "Malekith", "Kang", "Le Crâne Rouge", "Loki", "Dormammu"],
+    "places": ["Asgard", "le Wakanda", "la Sokovie", "New York", "Xandar", "Sakaar", "Knowhere", "Titan", "Vormir",
+               "Kamar-Taj", "le Royaume Quantique", "Jotunheim", "Midgard", "la Tour Avengers", "le Triskelion"],
+    "artifacts": ["le Tesseract", "l'Éther", "la Pierre du Temps", "Mjolnir", "Stormbreaker", "le Gantelet de l'Infini",
+                  "le bouclier en vibranium", "le Sceptre de Loki", "l'Œil d'Agamotto", "le Réacteur Arc", "l'Orbe"],
+    "organizations": ["le S.H.I.E.L.D.", "HYDRA", "les Avengers", "l'Ordre Noir", "les Ravageurs", "la TVA",
+                      "l'armée Chitauri", "les Einherjar", "les Maîtres des Arts Mystiques"],
+    "powers": ["une force surhumaine", "la maîtrise de la foudre", "la téléportation", "une régénération accélérée",
+               "la manipulation de l'énergie cosmique", "une intelligence tactique hors norme", "le vol supersonique",
+               "la manipulation du temps", "une agilité surhumaine", "la projection astrale"],
+    "events": ["la Bataille de New York", "le Snap", "les Accords de Sokovie", "la chute d'Asgard", "l'invasion Chitauri",
+               "la Bataille du Wakanda", "la crise du Multivers", "l'effondrement du S.H.I.E.L.D.", "le Blip"],
+}
+
+SENTENCES = [
+    "{name} apparaît pour la première fois en {year}, lorsque {event} bouleverse l'équilibre de {place}.",
+    "Au fil des années, {name} développe {power}, ce qui en fait un atout majeur pour {org}.",
+    "La relation entre {name} et {other} reste ambiguë : alliés face à {event}, rivaux lorsqu'il s'agit de {artifact}.",
+    "Les archives de {org} décrivent {name} comme une figure centrale des opérations menées à {place}.",
+    "C'est à {place} que {name} découvre l'existence de {artifact}, un objet dont la puissance dépasse l'entendement.",
+    "Lors de {event}, {name} affronte {other} dans un combat qui laisse {place} en ruines.",
+    "Selon plusieurs témoins, {name} aurait utilisé {artifact} pour protéger les survivants de {place}.",
+    "En {year}, {org} confie à {name} une mission de reconnaissance autour de {artifact}.",
+    "Les analystes considèrent que {power} est la clé de la survie de {name} face à {other}.",
+    "Après {event}, {name} se retire un temps à {place} avant de rejoindre de nouveau {org}.",
+    "Le destin de {name} reste lié à {artifact}, dont la garde lui a été confiée après {event}.",
+    "Les scénaristes ont longtemps hésité sur le rôle de {name}, avant d'en faire le pivot de l'intrigue autour de {place}.",
+]
+
+# ------------------------------------------------------------------------------
+# SECTION 1 : GÉNÉRATION DÉTERMINISTE D'UNE FICHE
+# ------------------------------------------------------------------------------
+
+def slugify(name):
+    """Même assainissement que B01 (Windows), sans accents : 'Thor (Terre-12)' -> 'thor_terre-12'."""
+    name = unicodedata.normalize("NFKD", name.lower())
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = re.sub(r"[:()'’,]", "", name).replace(" ", "_")
+    return re.sub(r"_+", "_", name).strip("_")
+
+def load_vocabulary(config_file):
+    """Vocabulaire de base enrichi des héros / films / vilains de data_config.json (s'il existe)."""
+    vocabulary = {key: list(values) for key, values in VOCABULARY.items()}
+    if os.path.exists(config_file):
+        with open(config_file, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        vocabulary["known_heroes"] = config.get("heroes", [])
+        vocabulary["known_movies"] = config.get("movies", [])
+        vocabulary["villains"] = sorted(set(vocabulary["villains"]) | set(config.get("villains", [])))
+    return vocabulary
+
+def entity_name(rng, vocabulary, entity_type, i):
+    """Nom unique de la fiche n°i : une entité connue ou inventée, dans sa variante Terre-i."""
+    if entity_type == "hero":
+        known = vocabulary.get("known_heroes", [])
+        if known and rng.random() < 0.3:
+            base = rng.choice(known)
+        else:
+            base = f"{rng.choice(vocabulary['hero_prefixes'])} {rng.choice(vocabulary['hero_cores'])}"
+    elif entity_type == "movie":
+        known = vocabulary.get("known_movies", [])
+        if known and rng.random() < 0.3:
+            base = rng.choice(known)
+        else:
+            base = rng.choice(vocabulary["movie_patterns"]).format(
+                franchise=rng.choice(vocabulary["franchises"]), core=rng.choice(vocabulary["hero_cores"]))
+    else:
+        base = rng.choice(vocabulary["villains"])
+    return f"{base} (Terre-{i})"
+
+def target_length(rng, entity_type):
+    median, sigma = LENGTHS[entity_type]
+    return int(min(MAX_LENGTH, max(MIN_LENGTH, rng.lognormvariate(0, sigma) * median)))
+
+def generate_document(seed, i, mix, vocabulary):
+    """
+    Fiche n°i : (type, nom, nom de fichier, texte). Le générateur aléatoire est initialisé
+    avec (graine, i) : même résultat quel que soit le worker ou l'ordre de génération.
+    """
+    rng = random.Random(f"{seed}:{i}")
+    entity_type = rng.choices(list(mix), weights=list(mix.values()))[0]
+    name = entity_name(rng, vocabulary, entity_type, i)
+    others = vocabulary["villains"] if entity_type != "vilain" else vocabulary.get("known_heroes") or vocabulary["hero_cores"]
+    length = target_length(rng, entity_type)
+    sections = SECTIONS[entity_type]
+
+    parts = []
+    per_section = length / len(sections)
+    for section in sections:
+        parts.append(section)
+        section_size = 0
+        while section_size < per_section:
+            paragraph = " ".join(
+                rng.choice(SENTENCES).format(
+                    name=name, other=rng.choice(others), year=rng.randint(2008, 2030),
+                    place=rng.choice(vocabulary["places"]), artifact=rng.choice(vocabulary["artifacts"]),
+                    org=rng.choice(vocabulary["organizations"]), power=rng.choice(vocabulary["powers"]),
+                    event=rng.choice(vocabulary["events"]))
+                for _ in range(rng.randint(3, 6)))
+            if section_size and section_size + len(paragraph) > per_section:
+                break
+            parts.append(paragraph)
+            section_size += len(paragraph)
+    return entity_type, name, f"{entity_type}_{slugify(name)}.txt", "\n\n".join(parts)
+
+def write_range(task):
+    """Travail d'un worker : écrit les fiches [start, stop) absentes du disque. Renvoie (écrites, octets)."""
+    seed, start, stop, mix, vocabulary, target_dir = task
+    written, total_bytes = 0, 0
+    for i in range(start, stop):
+        _, _, filename, text = generate_document(seed, i, mix, vocabulary)
+        path = os.path.join(target_dir, filename)
+        if os.path.exists(path):
+            continue
+        data = text.encode("utf-8")
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        written += 1
+        total_bytes += len(data)
+    return written, total_bytes
+
+def build_gold_set(seed, count, mix, vocabulary, size):
+    """Questions de référence pour B02g : une question par fiche tirée au hasard, fiche attendue connue."""
+    rng = random.Random(f"{seed}:gold")
+    gold_set = []
+    for i in sorted(rng.sample(range(count), min(size, count))):
+        entity_type, name, filename, _ = generate_document(seed, i, mix, vocabulary)
+        question = f"Que se passe-t-il dans {name} ?" if entity_type == "movie" else f"Qui est {name} ?"
+        gold_set.append({"question": question, "expected_sources": [filename]})
+    return gold_set
+
+# ------------------------------------------------------------------------------
+# SECTION 2 : EXÉCUTION (Terminal)
+# ------------------------------------------------------------------------------
+
+def parse_mix(value):
+    """'hero:0.45,movie:0.35,vilain:0.2' -> {'hero': 0.45, ...}"""
+    mix = {}
+    for part in value.split(","):
+        entity_type, _, weight = part.partition(":")
+        if entity_type not in LENGTHS:
+            raise argparse.ArgumentTypeError(f"Type inconnu : {entity_type} (attendu : {', '.join(LENGTHS)})")
+        mix[entity_type] = float(weight)
+    return mix
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Générateur hors ligne de corpus Marvel synthétique (tests de charge)")
+    parser.add_argument("--count", type=int, default=10000, help="Nombre de fiches (10 000 à 1 000 000)")
+    parser.add_argument("--seed", type=int, default=42, help="Graine : même graine = même corpus")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("hero:0.45,movie:0.35,vilain:0.2"),
+                        help="Répartition des types de fiches")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Entités de base (format data_config.json)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Dossier de sortie (source_files/ + jeu de questions)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Processus d'écriture")
+    parser.add_argument("--gold-size", type=int, default=200, help="Nombre de questions de référence pour B02g")
+    return parser.parse_args()
+
+def main():
+    print("--- Demo LLM - B01b : Générateur de corpus synthétique ---")
+    args = parse_args()
+    vocabulary = load_vocabulary(args.config)
+    target_dir = os.path.join(args.output_dir, "source_files")
+    os.makedirs(target_dir, exist_ok=True)
+
+    print(f"[Info] {args.count} fiches (graine {args.seed}) -> {target_dir} | {args.workers} worker(s)")
+    step = max(1, min(5000, args.count // (args.workers * 4) or 1))
+    tasks = [(args.seed, start, min(start + step, args.count), args.mix, vocabulary, target_dir)
+             for start in range(0, args.count, step)]
+    start_time = time.perf_counter()
+    written, total_bytes = 0, 0
+    with multiprocessing.Pool(args.workers) as pool:
+        for done, (count, size) in enumerate(pool.imap_unordered(write_range, tasks), start=1):
+            written += count
+            total_bytes += size
+            if done % max(1, len(tasks) // 10) == 0 or done == len(tasks):
+                print(f"   [{done}/{len(tasks)}] {written} fiche(s) écrite(s), {total_bytes / (1024 * 1024):.1f} Mo")
+    elapsed = time.perf_counter() - start_time
+    print(f"[Info] ✅ {written} nouvelle(s) fiche(s) en {elapsed:.1f} s "
+          f"({written / elapsed if elapsed else 0:.0f} fiches/s), {args.count - written} déjà présente(s)")
+
+    gold_path = os.path.join(args.output_dir, "retrieval_gold_set.json")
+    with open(gold_path, "w", encoding="utf-8") as f:
+        json.dump(build_gold_set(args.seed, args.count, args.mix, vocabulary, args.gold_size), f, indent=2, ensure_ascii=False)
+    print(f"[Info] 🎯 Questions de référence : {gold_path}")
+
+if __name__ == "__main__":
+    main()
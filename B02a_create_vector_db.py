@@ -1,10 +1,21 @@
 import os
 import json
+import math
+import time
+import shutil
+import sqlite3
+import argparse
+import multiprocessing
+import faiss
+import numpy as np
+import psutil
 from datetime import datetime
-from langchain_community.document_loaders import TextLoader
+from filelock import FileLock, Timeout
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from rag_common import BM25Index, CachedEmbeddings, IngestionJournal, NearDuplicateIndex, compute_hash, entity_from_filename, tag_duplicate_sources
 
 # ==============================================================================
 # Demo LLM - Phase B : Étape 2a : Création de la Base Vectorielle (Indexation)
@@ -12,76 +23,704 @@ from langchain_community.vectorstores import FAISS
 # ==============================================================================
 # Aspect Clé : Utilisation de FastEmbed (ONNX) à la place de PyTorch pour 
 # éviter les erreurs de DLL sur Windows. C'est plus léger et rapide.
+# ASPECT CLÉ 2 : Indexation incrémentale par empreinte (hash) de contenu. Un
+# fichier modifié ne ré-embedde que ses chunks réellement changés, et les
+# vecteurs des chunks disparus sont supprimés de l'index.
+# ASPECT CLÉ 3 : Cache d'embeddings sur disque (matrice float32 mappée en mémoire
+# + index empreinte -> ligne). Un texte déjà vectorisé n'est jamais recalculé.
+# Classe rag_common.CachedEmbeddings, la même pour l'ingestion de B02c.
+# ASPECT CLÉ 4 : Pipeline en flux pour les gros corpus : découpage parallèle,
+# embedding par lots sur plusieurs processus, ajout à FAISS lot par lot.
+# ASPECT CLÉ 5 : Format "mmap" sans pickle : index FAISS brut ouvert en mémoire
+# mappée + docstore SQLite lu à la demande + petit manifeste JSON.
+# ASPECT CLÉ 6 : Type d'index au choix : "flat" (exact), "hnsw" (graphe) ou
+# "ivfpq" (partitions + quantification). Les lecteurs (B02b/B02c/B03) n'ont rien
+# à changer : faiss.read_index reconnaît le type tout seul. Sans --index-type ni
+# --format, une exécution conserve le type et le format de la version publiée.
+# ASPECT CLÉ 7 : Index lexical BM25 (index inversé SQLite) tenu à jour en même
+# temps que FAISS, pour la recherche hybride de B02b/B02c.
+# ASPECT CLÉ 8 : Chaque chunk porte son type d'entité (hero / movie / vilain) et
+# son entité (ex : "thor"), d'après le nom du fichier. Option --shards : un
+# sous-index par type, pour ne parcourir que les héros, les films ou les vilains.
+# ASPECT CLÉ 9 : Journal d'ingestion SQLite en écriture anticipée. Chaque lot est
+# journalisé avant l'embedding, puis validé quand un point de reprise de l'index
+# est écrit. Après un crash, l'exécution reprend au dernier lot validé. Le journal
+# (rag_common.IngestionJournal) est le même objet pour B02a et l'ingestion de B02c.
+# ASPECT CLÉ 10 : Chaque publication écrit une version complète (index, docstore, BM25,
+# shards) dans son propre dossier versions/<id>, puis bascule le pointeur published.json
+# en un seul renommage atomique. Les lecteurs (B02b, B02c, B02e, B03) suivent ce pointeur :
+# ils voient l'ancienne ou la nouvelle version, jamais un mélange des deux.
+# ASPECT CLÉ 11 : Quasi-doublons écartés AVANT l'embedding (MinHash + LSH) : un passage
+# répété d'une fiche à l'autre n'est indexé qu'une fois, son représentant garde la
+# liste des autres sources (métadonnée also_in). Filtre partagé avec B02c (rag_common).
+# ASPECT CLÉ 12 : Un seul écrivain à la fois : B02a, l'ingestion de B02c et les passes
+# de B02h prennent le même verrou inter-processus (fichier <index>.lock). Option --files :
+# passe ciblée (B02h) qui ne relit que les fichiers signalés au lieu de tout le corpus.
 # ==============================================================================
+# python B02a_create_vector_db.py --workers 8 --batch-size 512
+# python B02a_create_vector_db.py --format mmap
+# python B02a_create_vector_db.py --index-type hnsw
+# python B02a_create_vector_db.py --shards
+# python B02a_create_vector_db.py --checkpoint-every 20
+# python B02a_create_vector_db.py --no-dedup
+# python B02a_create_vector_db.py --files hero_thor.txt movie_avengers_2012.txt
 
 # Dossiers de travail
 SOURCE_DIR = os.path.join("data", "source_files")
 INDEX_DIR = os.path.join("data", "faiss_index")
 TRACKING_FILE = os.path.join("data", "processed_files.json")
+JOURNAL_FILE = "ingestion_journal.sqlite"  # à côté du fichier de suivi
+DEDUP_FILE = "near_duplicates.sqlite"       # idem
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+MANIFEST_FILE = "manifest.json"
+BM25_FILE = "bm25.sqlite"
+PUBLISHED_FILE = "published.json"
+SHARDS_DIR = "shards"
+VERSIONS_DIR = "versions"
+# Fichiers de l'ancien format "à plat" (index directement à la racine de INDEX_DIR)
+LEGACY_ENTRIES = ("index.faiss", "index.pkl", "docstore.sqlite", MANIFEST_FILE, BM25_FILE, SHARDS_DIR)
 
-def load_processed_files():
-    """Charge la liste des fichiers déjà intégrés dans la DB."""
-    if os.path.exists(TRACKING_FILE):
-        with open(TRACKING_FILE, "r", encoding="utf-8") as f:
+def load_processed_files(tracking_file=TRACKING_FILE):
+    """Charge l'état des fichiers déjà intégrés dans la DB."""
+    if os.path.exists(tracking_file):
+        with open(tracking_file, "r", encoding="utf-8") as f:
             return json.load(f)
     return {}
 
-def save_processed_files(processed_files):
-    """Sauvegarde la liste mise à jour des fichiers traités."""
-    with open(TRACKING_FILE, "w", encoding="utf-8") as f:
+def save_processed_files(processed_files, tracking_file=TRACKING_FILE):
+    """Sauvegarde l'état mis à jour des fichiers traités."""
+    with open(tracking_file, "w", encoding="utf-8") as f:
         json.dump(processed_files, f, indent=2, ensure_ascii=False)
 
+def detect_index_format(index_dir):
+    """'mmap' si un manifeste est présent, 'pickle' pour le format LangChain (index.pkl), sinon None."""
+    if os.path.exists(os.path.join(index_dir, MANIFEST_FILE)):
+        return "mmap"
+    if os.path.exists(os.path.join(index_dir, "index.pkl")):
+        return "pickle"
+    return None
+
+def load_vector_store(index_dir, embeddings):
+    """Charge l'index en mémoire (modifiable) quel que soit son format sur disque."""
+    if detect_index_format(index_dir) != "mmap":
+        return FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+    index = faiss.read_index(os.path.join(index_dir, "index.faiss"))
+    conn = sqlite3.connect(os.path.join(index_dir, "docstore.sqlite"))
+    docs, index_to_docstore_id = {}, {}
+    for row, doc_id, content, metadata in conn.execute("SELECT row, id, page_content, metadata FROM docs ORDER BY row"):
+        docs[doc_id] = Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+        index_to_docstore_id[row] = doc_id
+    conn.close()
+    return FAISS(embeddings, index, InMemoryDocstore(docs), index_to_docstore_id)
+
+def detect_index_type(index_dir):
+    """Type de l'index FAISS présent sur disque : 'flat', 'hnsw', 'ivfpq' ou None."""
+    index_path = os.path.join(index_dir, "index.faiss")
+    if not os.path.exists(index_path):
+        return None
+    return detect_type_of(faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY))
+
+def to_flat_index(vector_db, embeddings):
+    """
+    Les mises à jour incrémentales (ajout ET suppression d'IDs) se font sur un index
+    plat exact. Un index HNSW/IVF-PQ chargé depuis le disque est donc reconstruit en
+    plat à partir des vecteurs exacts du cache (aucun appel au modèle).
+    """
+    if isinstance(vector_db.index, faiss.IndexFlat):
+        return vector_db
+    print("[Info] Index approximatif détecté : reconstruction d'un index plat de travail depuis le cache...")
+    texts = [vector_db.docstore.search(vector_db.index_to_docstore_id[i]).page_content for i in range(vector_db.index.ntotal)]
+    flat_index = faiss.IndexFlatL2(vector_db.index.d)
+    if texts:
+        flat_index.add(np.asarray(embeddings.embed_documents(texts), dtype=np.float32))
+    vector_db.index = flat_index
+    return vector_db
+
+def detect_type_of(index):
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivfpq"
+    return "flat"
+
+def build_index(flat_index, index_type):
+    """
+    Construit l'index de recherche final à partir de l'index plat de travail.
+    - flat  : recherche exacte, coût linéaire par requête
+    - hnsw  : graphe de voisinage (M=32), quasi exact et très rapide, plus de RAM
+    - ivfpq : k-means en nlist partitions + vecteurs compressés (Product Quantization),
+              quantifieurs entraînés sur le corpus, index très compact
+    """
+    if index_type == "flat":
+        return flat_index
+    n, d = flat_index.ntotal, flat_index.d
+    vectors = flat_index.reconstruct_n(0, n)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, 32)
+        index.hnsw.efConstruction = 200
+        index.hnsw.efSearch = 64  # sauvegardé avec l'index : les lecteurs en héritent
+        index.add(vectors)
+        return index
+
+    # IVF-PQ : il faut au moins 256 vecteurs pour entraîner les codebooks PQ (8 bits)
+    if n < 256:
+        print(f"[Attention] {n} vecteurs seulement : trop peu pour entraîner IVF-PQ, index plat conservé.")
+        return flat_index
+    nlist = max(1, min(4096, int(4 * math.sqrt(n))))
+    pq_m = next(m for m in (48, 32, 24, 16, 8, 4, 2, 1) if d % m == 0)
+    quantizer = faiss.IndexFlatL2(d)
+    index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, 8)
+    print(f"[Info] Entraînement IVF-PQ (nlist={nlist}, m={pq_m}) sur {n} vecteurs...")
+    index.train(vectors)
+    index.add(vectors)
+    index.nprobe = min(nlist, 16)  # sauvegardé avec l'index : les lecteurs en héritent
+    return index
+
+def save_mmap_store(vector_db, index_dir):
+    """
+    ASPECT CLÉ : Format sans pickle, en 3 parties (dans un dossier de version pas encore publié) :
+    - index.faiss     : index FAISS brut, ouvert par les lecteurs en mémoire mappée
+    - docstore.sqlite : une ligne par vecteur (row FAISS -> id, texte, métadonnées JSON)
+    - manifest.json   : description de l'index (sa présence signale le format mmap)
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    faiss.write_index(vector_db.index, os.path.join(index_dir, "index.faiss"))
+
+    conn = sqlite3.connect(os.path.join(index_dir, "docstore.sqlite"))
+    conn.execute("CREATE TABLE docs (row INTEGER PRIMARY KEY, id TEXT UNIQUE, page_content TEXT, metadata TEXT)")
+    rows = []
+    for row, doc_id in vector_db.index_to_docstore_id.items():
+        doc = vector_db.docstore.search(doc_id)
+        rows.append((row, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)))
+    conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    manifest = {
+        "format": "faiss-mmap-v1",
+        "embedding_model": EMBEDDING_MODEL,
+        "dim": vector_db.index.d,
+        "index_type": detect_type_of(vector_db.index),
+        "ntotal": vector_db.index.ntotal,
+        "index_file": "index.faiss",
+        "docstore_file": "docstore.sqlite",
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    with open(os.path.join(index_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+def tag_entity_metadata(vector_db):
+    """Complète les chunks indexés avant l'ajout des métadonnées d'entité (d'après leur source)."""
+    for doc_id in vector_db.index_to_docstore_id.values():
+        doc = vector_db.docstore.search(doc_id)
+        if "entity_type" not in doc.metadata:
+            doc.metadata["entity_type"], doc.metadata["entity"] = entity_from_filename(doc.metadata.get("source", doc_id.split("::")[0]))
+
+def save_shards(vector_db, index_dir, index_format, index_type):
+    """
+    ASPECT CLÉ : Un sous-index FAISS par type d'entité (shards/hero, shards/movie, ...),
+    même format et même type que l'index principal. Reconstruits à partir de l'index
+    plat de travail à chaque sauvegarde : aucun embedding recalculé.
+    """
+    shards_root = os.path.join(index_dir, SHARDS_DIR)
+    vectors = vector_db.index.reconstruct_n(0, vector_db.index.ntotal)
+    groups = {}
+    for row, doc_id in vector_db.index_to_docstore_id.items():
+        doc = vector_db.docstore.search(doc_id)
+        groups.setdefault(doc.metadata.get("entity_type", "autre"), []).append((row, doc_id, doc))
+    for entity_type, members in groups.items():
+        index = faiss.IndexFlatL2(vector_db.index.d)
+        index.add(vectors[[row for row, _, _ in members]])
+        docstore = InMemoryDocstore({doc_id: doc for _, doc_id, doc in members})
+        shard = FAISS(vector_db.embedding_function, index, docstore, {i: doc_id for i, (_, doc_id, _) in enumerate(members)})
+        save_vector_store(shard, os.path.join(shards_root, entity_type), index_format, index_type)
+        print(f"   - Shard '{entity_type}' : {len(members)} chunks")
+
+def save_vector_store(vector_db, index_dir, index_format, index_type="flat"):
+    """Sauvegarde dans le format et le type d'index demandés (dossier de version neuf)."""
+    vector_db.index = build_index(vector_db.index, index_type)
+    if index_format == "mmap":
+        save_mmap_store(vector_db, index_dir)
+    else:
+        vector_db.save_local(index_dir)
+
+def make_chunk_id(filename, chunk_hash):
+    """
+    ASPECT CLÉ : Identifiant FAISS stable = fichier + empreinte du contenu du chunk.
+    Un chunk inchangé garde donc le même ID d'une exécution à l'autre.
+    """
+    return f"{filename}::{chunk_hash[:16]}"
+
+def read_published_marker(index_dir):
+    """Contenu du pointeur published.json (None si rien n'a encore été publié)."""
+    path = os.path.join(index_dir, PUBLISHED_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def published_dir(index_dir):
+    """Dossier de la version publiée ; index à plat antérieur au versionnement : la racine elle-même."""
+    marker = read_published_marker(index_dir)
+    if marker and marker.get("path"):
+        return os.path.join(index_dir, marker["path"])
+    return index_dir
+
+def new_version_dir(index_dir):
+    """Dossier neuf versions/<id> : invisible des lecteurs tant que le pointeur ne le désigne pas."""
+    version = str(time.time_ns())
+    path = os.path.join(index_dir, VERSIONS_DIR, version)
+    os.makedirs(path)
+    return version, path
+
+def publish_version(index_dir, version, ntotal, index_type):
+    """
+    ASPECT CLÉ : Publication = UN seul renommage atomique du pointeur published.json, APRÈS
+    l'écriture complète du dossier de version (index, docstore, BM25, shards).
+    index_type est le type DEMANDÉ (un IVF-PQ trop petit est enregistré plat sur disque).
+    """
+    marker = {"version": version, "path": f"{VERSIONS_DIR}/{version}", "ntotal": ntotal,
+              "index_type": index_type, "published_at": IngestionJournal.now()}
+    path = os.path.join(index_dir, PUBLISHED_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(marker, f, indent=2)
+    for _ in range(50):
+        try:
+            os.replace(path + ".tmp", path)
+            return
+        except PermissionError:
+            # Windows : remplacement refusé pendant qu'un lecteur lit le pointeur (quelques ms)
+            time.sleep(0.1)
+    os.replace(path + ".tmp", path)
+
+def remove_quietly(path):
+    """Suppression d'un fichier ou dossier ; s'il est encore ouvert (Windows), on réessaiera plus tard."""
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    except OSError:
+        pass
+
+def prune_versions(index_dir, keep):
+    """
+    Retire les versions qui ne sont ni la version publiée ni la précédente (encore lue par
+    les lecteurs qui n'ont pas rechargé), ainsi que les fichiers de l'ancien format à plat.
+    """
+    versions_root = os.path.join(index_dir, VERSIONS_DIR)
+    for name in os.listdir(versions_root):
+        if name not in keep:
+            remove_quietly(os.path.join(versions_root, name))
+    for name in LEGACY_ENTRIES:
+        remove_quietly(os.path.join(index_dir, name))
+
+def read_checkpoint(checkpoint_dir):
+    """Dernier lot contenu dans le point de reprise (0 si absent). Termine un échange de dossiers interrompu."""
+    old_dir = checkpoint_dir + ".old"
+    if not os.path.exists(checkpoint_dir) and os.path.exists(old_dir):
+        os.rename(old_dir, checkpoint_dir)
+    path = os.path.join(checkpoint_dir, "checkpoint.json")
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["batch"]
+
+def save_checkpoint(vector_db, checkpoint_dir, batch_id):
+    """
+    ASPECT CLÉ : Le point de reprise (index plat de travail) est écrit dans un dossier
+    temporaire puis échangé par renommage : sur disque, il est toujours complet.
+    """
+    tmp_dir, old_dir = checkpoint_dir + ".tmp", checkpoint_dir + ".old"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    vector_db.save_local(tmp_dir)
+    with open(os.path.join(tmp_dir, "checkpoint.json"), "w", encoding="utf-8") as f:
+        json.dump({"batch": batch_id, "ntotal": vector_db.index.ntotal, "saved_at": IngestionJournal.now()}, f)
+    if os.path.exists(checkpoint_dir):
+        os.rename(checkpoint_dir, old_dir)
+    os.rename(tmp_dir, checkpoint_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def get_text_splitter():
+    """Découpeur partagé par le processus principal et les workers."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+def split_file(source_dir, filename, raw_bytes, text_splitter):
+    """Découpe un fichier, puis tagge chaque chunk avec son empreinte et son ID."""
+    # Équivalent de TextLoader, mais à partir des octets déjà lus pour le calcul d'empreinte
+    entity_type, entity = entity_from_filename(filename)
+    doc = Document(page_content=raw_bytes.decode("utf-8"), metadata={
+        "source": os.path.join(source_dir, filename),
+        "entity_type": entity_type,
+        "entity": entity
+    })
+    chunks = {}
+    for chunk in text_splitter.split_documents([doc]):
+        chunk_hash = compute_hash(chunk.page_content)
+        chunk.metadata["chunk_hash"] = chunk_hash
+        # Deux chunks identiques dans un même fichier n'ont pas besoin d'être indexés deux fois
+        chunks[make_chunk_id(filename, chunk_hash)] = chunk
+    return chunks
+
+def load_and_split(task):
+    """
+    Travail d'un worker : lecture, empreinte et découpage d'UN fichier.
+    ASPECT CLÉ : Un fichier dont l'empreinte n'a pas changé n'est même pas découpé.
+    """
+    source_dir, filename, known_hash = task
+    with open(os.path.join(source_dir, filename), "rb") as f:
+        raw_bytes = f.read()
+    file_hash = compute_hash(raw_bytes)
+    if file_hash == known_hash:
+        return filename, file_hash, None
+    return filename, file_hash, split_file(source_dir, filename, raw_bytes, get_text_splitter())
+
+def get_peak_rss_mb(peak_mb):
+    """Mémoire résidente du processus principal + workers (en Mo), maximum observé."""
+    process = psutil.Process()
+    rss = process.memory_info().rss + sum(c.memory_info().rss for c in process.children(recursive=True))
+    return max(peak_mb, rss / (1024 * 1024))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Indexation FAISS incrémentale et par lots (FastEmbed)")
+    parser.add_argument("--source-dir", default=SOURCE_DIR, help="Dossier des fichiers .txt à indexer")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="Dossier de l'index FAISS")
+    parser.add_argument("--tracking-file", default=TRACKING_FILE, help="Fichier de suivi des empreintes")
+    parser.add_argument("--journal", default=None,
+                        help=f"Journal d'ingestion SQLite (défaut : {JOURNAL_FILE} à côté du fichier de suivi)")
+    parser.add_argument("--dedup", action=argparse.BooleanOptionalAction, default=True,
+                        help="Écarter les chunks quasi-dupliqués avant l'embedding (MinHash + LSH)")
+    parser.add_argument("--checkpoint-every", type=int, default=10,
+                        help="Point de reprise de l'index tous les N lots (0 = aucun, reprise depuis l'index publié)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Nombre de chunks embeddés puis ajoutés à FAISS par lot")
+    parser.add_argument("--workers", type=int, default=1, help="Processus pour le découpage et l'embedding (1 = séquentiel)")
+    parser.add_argument("--index-type", choices=["flat", "hnsw", "ivfpq"], default=None,
+                        help="Type d'index FAISS : exact (flat) ou approximatif (hnsw, ivfpq) "
+                             "(par défaut : conserve le type actuel, flat pour un nouvel index)")
+    parser.add_argument("--format", choices=["pickle", "mmap"], default=None,
+                        help="Format de sauvegarde : 'pickle' (LangChain save_local) ou 'mmap' (FAISS brut + SQLite) "
+                             "(par défaut : conserve le format actuel, pickle pour un nouvel index)")
+    parser.add_argument("--shards", action=argparse.BooleanOptionalAction, default=None,
+                        help="Un sous-index par type d'entité (par défaut : conserve l'état actuel)")
+    parser.add_argument("--files", nargs="+", default=None,
+                        help="Passe ciblée : seuls ces fichiers (noms dans --source-dir) sont relus, ajoutés ou retirés")
+    return parser.parse_args()
+
 def main():
     print("--- Demo LLM - Étape 5A : Vectorisation avec FastEmbed ---")
-    
-    # 1. Préparation
-    processed_files = load_processed_files()
-    all_files = [f for f in os.listdir(SOURCE_DIR) if f.endswith(".txt")]
-    new_files = [f for f in all_files if f not in processed_files]
-    
-    if not new_files:
-        print("[Info] Aucun nouveau fichier à traiter. La base est à jour.")
-        return
+    args = parse_args()
+    # Un seul écrivain à la fois sur l'index, le journal et le suivi (B02a, B02c, B02h)
+    lock = FileLock(args.index_dir.rstrip("/\\") + ".lock")
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        print("[Info] Une autre ingestion est en cours (B02a, B02c ou B02h) : attente de sa fin...")
+        lock.acquire()
+    try:
+        update_index(args)
+    finally:
+        lock.release()
 
-    print(f"[Info] {len(new_files)} nouveau(x) fichier(s) détecté(s).")
+def update_index(args):
+    """Une exécution d'ingestion complète (appelée sous le verrou d'écriture)."""
+    # 1. Préparation : état publié (journal) et éventuelle exécution interrompue à reprendre
+    journal_path = args.journal or os.path.join(os.path.dirname(args.tracking_file), JOURNAL_FILE)
+    journal = IngestionJournal(journal_path)
+    journal.import_tracking(load_processed_files(args.tracking_file))
+    processed_files = journal.published_files()
+    checkpoint_dir = args.index_dir.rstrip("/\\") + ".checkpoint"
+    checkpoint_batch = read_checkpoint(checkpoint_dir)
+    resumed = journal.resume(checkpoint_batch)
+    if resumed is None and checkpoint_batch:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)  # reste d'une exécution déjà publiée
+        checkpoint_batch = 0
+    # Les mises à jour partent de la version publiée (versions/<id>, ou racine à plat historique)
+    current_dir = published_dir(args.index_dir)
+    index_exists = detect_index_format(current_dir) is not None
+
+    if resumed is not None:
+        run_id, rebuild, resumed_files = resumed
+        rebuild = rebuild or not index_exists
+        print(f"[Reprise] Exécution interrompue : {len(resumed_files)} fichier(s) validé(s) jusqu'au lot {checkpoint_batch}, "
+              f"les lots suivants sont rejoués.")
+    else:
+        # Sans suivi exploitable, on ne connaît pas les IDs des chunks déjà indexés : on reconstruit tout.
+        # (cas de l'ancien format nom -> date, d'un suivi perdu ou d'un index absent)
+        rebuild = not processed_files or not index_exists
+        if rebuild and (processed_files or index_exists):
+            print("[Info] Suivi au format historique, suivi absent ou index absent : reconstruction complète.")
+        run_id, resumed_files = journal.start_run(rebuild), {}
+    if rebuild:
+        processed_files = {}
+    bm25_path = os.path.join(current_dir, BM25_FILE)
+    bm25_missing = not rebuild and not os.path.exists(bm25_path)
+    shards_existed = os.path.exists(os.path.join(current_dir, SHARDS_DIR))
+    use_shards = args.shards if args.shards is not None else shards_existed
+    # Format et type : conservés sauf demande explicite (une simple relance ne convertit rien)
+    # (type demandé lors de la dernière publication, pas le type effectif : un IVF-PQ de moins
+    # de 256 vecteurs est enregistré plat et ne doit pas être republié à chaque exécution)
+    format_existed = detect_index_format(current_dir)
+    type_existed = (read_published_marker(args.index_dir) or {}).get("index_type") or detect_index_type(current_dir)
+    index_format = args.format or format_existed or "pickle"
+    index_type = args.index_type or type_existed or "flat"
+    dedup_path = os.path.join(os.path.dirname(journal_path), DEDUP_FILE)
+    dedup_existed = os.path.exists(dedup_path)
+    dedup = NearDuplicateIndex(dedup_path) if args.dedup else None
+    dedup_missing = dedup is not None and not rebuild and not dedup_existed
+    if dedup is not None and rebuild and resumed is None:
+        dedup.clear()
+
+    # Fichiers déjà validés dans le point de reprise : leurs chunks sont dans l'index de travail,
+    # il ne reste qu'à reporter leurs suppressions / ajouts lors de la publication.
+    ids_to_delete, added_ids = [], []
+    for filename, entry in resumed_files.items():
+        old_ids = set(processed_files.get(filename, {}).get("chunks", []))
+        ids_to_delete.extend(old_ids - set(entry["chunks"]))
+        added_ids.extend(c for c in entry["chunks"] if c not in old_ids)
+    processed_files.update(resumed_files)
+
+    if args.files is not None and not rebuild and resumed is None:
+        # Passe ciblée : pas de parcours du dossier, seuls les fichiers signalés sont relus
+        targeted = sorted({os.path.basename(f) for f in args.files if f.endswith(".txt")})
+        all_files = [f for f in targeted if os.path.exists(os.path.join(args.source_dir, f))]
+        removed_files = [f for f in targeted if f in processed_files and f not in set(all_files)]
+    else:
+        all_files = sorted(f for f in os.listdir(args.source_dir) if f.endswith(".txt"))
+        removed_files = [f for f in processed_files if f not in set(all_files)]
+    print(f"[Info] {len(all_files)} fichier(s) source | lots de {args.batch_size} chunks | {args.workers} worker(s)")
 
     # 2. Initialisation du modèle d'embeddings (FastEmbed)
     # ASPECT CLÉ : FastEmbed utilise ONNX Runtime, beaucoup plus stable sur Windows.
     # Il téléchargera le modèle all-MiniLM-L6-v2 par défaut si non spécifié.
-    print(f"[Info] Initialisation de FastEmbed (Modèle : all-MiniLM-L6-v2)...")
-    embeddings = FastEmbedEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-    # 3. Chargement et Découpage des nouveaux documents
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        separators=["\n\n", "\n", " ", ""]
+    # Avec plusieurs workers, FastEmbed répartit chaque lot sur autant de processus.
+    # Le modèle n'est chargé qu'au premier texte absent du cache.
+    print(f"[Info] Initialisation de FastEmbed (Modèle : all-MiniLM-L6-v2) avec cache disque...")
+    embeddings = CachedEmbeddings(
+        EMBEDDING_MODEL,
+        batch_size=args.batch_size,
+        parallel=args.workers if args.workers > 1 else None
     )
-    
-    new_documents = []
-    for filename in new_files:
-        print(f"   - Chargement et découpage de : {filename}")
-        loader = TextLoader(os.path.join(SOURCE_DIR, filename), encoding="utf-8")
-        docs = loader.load()
-        chunks = text_splitter.split_documents(docs)
-        new_documents.extend(chunks)
-        
-        # Marquer comme traité
-        processed_files[filename] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    # 4. Création ou Mise à jour de l'index FAISS
-    if os.path.exists(INDEX_DIR):
-        print("[Info] Mise à jour de l'index FAISS existant...")
-        vector_db = FAISS.load_local(INDEX_DIR, embeddings, allow_dangerous_deserialization=True)
-        vector_db.add_documents(new_documents)
+    vector_db = None
+
+    def open_existing_index():
+        """L'index existant (ou le point de reprise) n'est chargé qu'au premier besoin (rien à faire = rien à charger)."""
+        if checkpoint_batch:
+            print(f"[Reprise] Chargement du point de reprise (lot {checkpoint_batch})...")
+            vector_db = FAISS.load_local(checkpoint_dir, embeddings, allow_dangerous_deserialization=True)
+        else:
+            print("[Info] Chargement de l'index FAISS existant...")
+            vector_db = to_flat_index(load_vector_store(current_dir, embeddings), embeddings)
+        if dedup_missing:
+            print("[Dédup] Index antérieur à la déduplication : ses chunks deviennent les représentants...")
+            dedup.register_existing(vector_db)
+        return vector_db
+
+    def reintegrate_chunks(vector_db, chunk_ids):
+        """Re-découpe les fichiers concernés et embedde les chunks demandés (après un nouveau passage du filtre)."""
+        nonlocal embedded_count
+        wanted = {}
+        for chunk_id in chunk_ids:
+            wanted.setdefault(chunk_id.split("::")[0], set()).add(chunk_id)
+        docs, ids = [], []
+        for filename, file_chunk_ids in wanted.items():
+            path = os.path.join(args.source_dir, filename)
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                raw_bytes = f.read()
+            for chunk_id, chunk in split_file(args.source_dir, filename, raw_bytes, get_text_splitter()).items():
+                if chunk_id in file_chunk_ids:
+                    docs.append(chunk)
+                    ids.append(chunk_id)
+        if dedup is not None:
+            docs, ids = dedup.filter(docs, ids)
+        for start in range(0, len(docs), args.batch_size):
+            vector_db.add_documents(docs[start:start + args.batch_size], ids=ids[start:start + args.batch_size])
+        embedded_count += len(docs)
+        added_ids.extend(ids)
+        print(f"[Dédup] {len(ids)} chunk(s) réintégré(s) (représentant supprimé ou déduplication désactivée)")
+        return vector_db
+
+    # 3. Pipeline en flux : découpage parallèle -> lots de chunks -> embedding -> ajout FAISS
+    # ASPECT CLÉ : La mémoire reste bornée, seuls une fenêtre de fichiers et un lot
+    # de chunks sont en mémoire à un instant donné (hors index FAISS lui-même).
+    tasks = [(args.source_dir, f, processed_files.get(f, {}).get("hash")) for f in all_files]
+    window = max(1, args.workers) * 32
+    pool = multiprocessing.Pool(args.workers) if args.workers > 1 else None
+    pending_docs, pending_ids, pending_files = [], [], {}
+    changed_count, embedded_count, batch_count, peak_rss_mb = len(resumed_files), 0, 0, 0.0
+    has_base_index = not rebuild or checkpoint_batch > 0
+    start_time = time.perf_counter()
+
+    def flush_batch(vector_db):
+        """Journalisation du lot, embedding puis ajout immédiat dans FAISS ; point de reprise tous les N lots."""
+        nonlocal embedded_count, batch_count, peak_rss_mb, pending_docs, pending_ids, pending_files, checkpoint_batch
+        batch_id = journal.begin_batch(run_id, pending_files, len(pending_docs))
+        if vector_db is None and has_base_index:
+            vector_db = open_existing_index()
+        if resumed is not None and vector_db is not None:
+            # Rejeu après un crash : un chunk déjà présent dans l'index n'est pas ajouté deux fois
+            known_ids = set(vector_db.index_to_docstore_id.values())
+            # ... mais il est reporté dans BM25 : le crash a pu survenir avant bm25.commit()
+            # (ajout idempotent, INSERT OR REPLACE)
+            added_ids.extend(chunk_id for chunk_id in pending_ids if chunk_id in known_ids)
+            kept = [(doc, chunk_id) for doc, chunk_id in zip(pending_docs, pending_ids) if chunk_id not in known_ids]
+            pending_docs, pending_ids = [doc for doc, _ in kept], [chunk_id for _, chunk_id in kept]
+        if dedup is not None:
+            pending_docs, pending_ids = dedup.filter(pending_docs, pending_ids)
+        if vector_db is None and pending_docs:
+            vector_db = FAISS.from_documents(pending_docs, embeddings, ids=pending_ids)
+        elif pending_docs:
+            vector_db.add_documents(pending_docs, ids=pending_ids)
+        embedded_count += len(pending_docs)
+        added_ids.extend(pending_ids)
+        batch_count += 1
+        peak_rss_mb = get_peak_rss_mb(peak_rss_mb)
+        rate = embedded_count / (time.perf_counter() - start_time)
+        print(f"   [Lot {batch_count}] +{len(pending_docs)} chunks | total {embedded_count} | "
+              f"{rate:.1f} chunks/s | RSS pic {peak_rss_mb:.0f} Mo")
+        if vector_db is not None and args.checkpoint_every and batch_count % args.checkpoint_every == 0:
+            # Point de reprise écrit AVANT la validation des lots dans le journal
+            if dedup is not None:
+                dedup.commit()
+            save_checkpoint(vector_db, checkpoint_dir, batch_id)
+            journal.commit_batches(run_id, batch_id)
+            checkpoint_batch = batch_id
+            print(f"   [Journal] Point de reprise : lots validés jusqu'au n°{batch_id}")
+        pending_docs, pending_ids, pending_files = [], [], {}
+        return vector_db
+
+    try:
+        for i in range(0, len(tasks), window):
+            results = pool.map(load_and_split, tasks[i:i + window]) if pool else map(load_and_split, tasks[i:i + window])
+            for filename, file_hash, chunks in results:
+                if chunks is None:
+                    continue
+                print(f"   - Fichier nouveau ou modifié : {filename}")
+                changed_count += 1
+                old_ids = set(processed_files.get(filename, {}).get("chunks", []))
+                
+                # Seuls les chunks réellement nouveaux sont ré-embeddés
+                for chunk_id, chunk in chunks.items():
+                    if chunk_id not in old_ids:
+                        pending_ids.append(chunk_id)
+                        pending_docs.append(chunk)
+                ids_to_delete.extend(old_ids - set(chunks))
+                
+                # Marquer comme traité (journalisé avec le lot qui porte ses chunks)
+                processed_files[filename] = pending_files[filename] = {
+                    "hash": file_hash,
+                    "chunks": list(chunks),
+                    "indexed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }
+                if len(pending_docs) >= args.batch_size:
+                    vector_db = flush_batch(vector_db)
+        if pending_docs:
+            vector_db = flush_batch(vector_db)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    for filename in removed_files:
+        print(f"   - Fichier supprimé, retrait de ses vecteurs : {filename}")
+        ids_to_delete.extend(processed_files.pop(filename).get("chunks", []))
+
+    # Un changement de format ou de type d'index suffit à justifier une sauvegarde (conversion)
+    format_changed = not rebuild and (format_existed != index_format or type_existed != index_type
+                                      or use_shards != shards_existed)
+    dedup_changed = dedup_missing or (dedup is None and dedup_existed) or (dedup is not None and bool(dedup.cross_scope()))
+    if not changed_count and not removed_files and not format_changed and not bm25_missing and not dedup_changed:
+        journal.publish(run_id, processed_files)
+        print("[Info] Aucun fichier nouveau, modifié ou supprimé. La base est à jour.")
+        return
+    if vector_db is None and has_base_index:
+        vector_db = open_existing_index()
+    if vector_db is None:
+        journal.publish(run_id, processed_files)
+        print("[Info] Aucun document à indexer.")
+        return
+
+    # 4. Suppression des vecteurs des chunks disparus
+    print(f"[Info] {changed_count} fichier(s) nouveau(x) ou modifié(s), {len(removed_files)} supprimé(s).")
+    print(f"[Info] Chunks embeddés : {embedded_count} | Chunks supprimés : {len(ids_to_delete)}")
+    if ids_to_delete:
+        # Après une reprise, un ID peut déjà être absent de l'index : on ne supprime que les présents
+        ids_to_delete = list(dict.fromkeys(ids_to_delete))
+        deleted, live_ids = set(ids_to_delete), set(vector_db.index_to_docstore_id.values())
+        added_ids = [i for i in added_ids if i not in deleted]
+        live_deletes = [i for i in ids_to_delete if i in live_ids]
+        if live_deletes:
+            vector_db.delete(live_deletes)
+
+    # 4b. Quasi-doublons : un chunk écarté dont le représentant a disparu est réintégré
+    orphans = []
+    if dedup is not None:
+        dedup.forget(ids_to_delete)
+        orphans = dedup.orphans(set(vector_db.index_to_docstore_id.values()))
+        print(f"[Dédup] {dedup.dropped}/{dedup.checked} chunk(s) quasi-dupliqué(s) écarté(s) avant embedding")
+    elif dedup_existed:
+        # --no-dedup : tous les chunks écartés jusqu'ici sont indexés
+        previous = NearDuplicateIndex(dedup_path)
+        orphans = previous.all_duplicates()
+        previous.close()
+    if orphans:
+        vector_db = reintegrate_chunks(vector_db, orphans)
+
+    # 5. Sauvegarde dans un dossier de version neuf (les shards sont extraits de l'index plat,
+    # avant sa conversion) : la version publiée n'est jamais modifiée en place
+    tag_entity_metadata(vector_db)
+    if dedup is not None or dedup_existed:
+        tag_duplicate_sources(vector_db, dedup.sources() if dedup is not None else {})
+    version, version_dir = new_version_dir(args.index_dir)
+    if use_shards:
+        print(f"[Info] Construction des shards par type d'entité dans : {os.path.join(version_dir, SHARDS_DIR)}")
+        save_shards(vector_db, version_dir, index_format, index_type)
+    print(f"[Info] Sauvegarde de l'index dans : {version_dir} (format {index_format}, type {index_type})")
+    save_vector_store(vector_db, version_dir, index_format, index_type)
+
+    # 6. Index lexical BM25 : mêmes chunks, mêmes IDs, même mise à jour incrémentale
+    # (sur une copie de celui de la version publiée)
+    new_bm25_path = os.path.join(version_dir, BM25_FILE)
+    if not rebuild and not bm25_missing:
+        shutil.copyfile(bm25_path, new_bm25_path)
+    bm25 = BM25Index(new_bm25_path)
+    if rebuild or bm25_missing:
+        print("[Info] Construction complète de l'index lexical BM25...")
+        bm25.clear()
+        all_ids = list(vector_db.index_to_docstore_id.values())
+        bm25.add_documents([vector_db.docstore.search(i) for i in all_ids], all_ids)
     else:
-        print("[Info] Création d'un nouvel index FAISS...")
-        vector_db = FAISS.from_documents(new_documents, embeddings)
+        # Les chunks écartés comme quasi-doublons ne sont ni dans FAISS ni dans BM25
+        live_ids = set(vector_db.index_to_docstore_id.values())
+        added_ids = [i for i in added_ids if i in live_ids]
+        bm25.delete(ids_to_delete)
+        bm25.add_documents([vector_db.docstore.search(i) for i in added_ids], added_ids)
+    bm25.commit()
+    bm25.close()
+    if dedup is not None:
+        dedup.close()
 
-    # 5. Sauvegarde
-    print(f"[Info] Sauvegarde de l'index dans : {INDEX_DIR}")
-    vector_db.save_local(INDEX_DIR)
-    save_processed_files(processed_files)
+    # 7. Publication : bascule du pointeur (lecteurs), journal (transaction unique),
+    # export processed_files.json, point de reprise et anciennes versions retirés
+    previous = read_published_marker(args.index_dir)
+    publish_version(args.index_dir, version, vector_db.index.ntotal, index_type)
+    journal.publish(run_id, processed_files)
+    journal.close()
+    save_processed_files(processed_files, args.tracking_file)
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    prune_versions(args.index_dir, keep={version, previous.get("version") if previous else None})
+    if dedup is None and dedup_existed:
+        os.remove(dedup_path)
+    elapsed = time.perf_counter() - start_time
+    print(f"[Cache] Embeddings : {embeddings.report()}")
+    print(f"[Perf] {embedded_count} chunks en {elapsed:.1f} s ({embedded_count / elapsed:.1f} chunks/s) | "
+          f"RSS pic {get_peak_rss_mb(peak_rss_mb):.0f} Mo")
     
     print("\n--- Terminé ! Base vectorielle générée avec succès. ---")
 
@@ -1,34 +1,155 @@
 import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_core.messages import HumanMessage, SystemMessage
+from rag_common import RERANK_BUDGET_MS, RERANK_MODEL, BM25Index, CrossEncoderReranker, QueryEmbeddingCache, SemanticAnswerCache, load_mmap_vector_db, pack_context
 
 # ==============================================================================
 # Demo LLM - Étape 5B : Question Réponse RAG (Version FastEmbed)
 # ==============================================================================
 # Aspect Clé : Utilisation de FastEmbed pour la recherche sémantique.
+# ASPECT CLÉ 2 : Recherche hybride : FAISS (sens) + BM25 (mots exacts comme
+# "Tesseract" ou "Sokovie"), lancées en parallèle puis fusionnées par rang (RRF).
+# ASPECT CLÉ 3 : Filtres par type d'entité / entité ("type:hero", "entity:thor").
+# Si B02a a construit des shards, seul le shard du type demandé est parcouru.
+# ASPECT CLÉ 4 : Caches : LRU des embeddings de questions ("Qui est Thor ?" et
+# "qui est thor" ne sont embeddées qu'une fois) et cache sémantique des réponses.
+# ASPECT CLÉ 5 (--rerank) : 20 candidats notés par un cross-encoder ONNX local,
+# seuls les 3 meilleurs vont dans le prompt, dans un budget de latence par question.
+# ASPECT CLÉ 6 : Contexte assemblé : chunks voisins fusionnés (recouvrement de 200
+# caractères retiré), puis tronqué à un budget de tokens mesuré avec tiktoken
+# (rag_common.pack_context, commun à B02b et B02c).
 # ==============================================================================
 
+INDEX_DIR = os.path.join("data", "faiss_index")
+BM25_FILE = "bm25.sqlite"
+SHARDS_DIR = "shards"
+PUBLISHED_FILE = "published.json"
+# Avec un filtre de métadonnées, FAISS examine ce nombre de voisins avant filtrage
+FILTER_FETCH_K = 200
+# Reranking : candidats récupérés (modèle et budget par défaut : rag_common)
+RERANK_FETCH_K = 20
+
+# Un thread dédié à la recherche vectorielle pendant que BM25 tourne sur l'appelant
+SEARCH_POOL = ThreadPoolExecutor(max_workers=2)
+
 # ------------------------------------------------------------------------------
 # SECTION 1 : LOGIQUE COEUR RAG
 # ------------------------------------------------------------------------------
 
+def read_published_marker(index_dir=INDEX_DIR):
+    """Pointeur published.json écrit par B02a / B02c en dernier (None si rien n'a été publié)."""
+    path = os.path.join(index_dir, PUBLISHED_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def get_index_version(index_dir=INDEX_DIR):
+    """Version publiée de l'index (clé du cache de réponses)."""
+    marker = read_published_marker(index_dir)
+    return marker["version"] if marker else None
+
+def published_dir(index_dir=INDEX_DIR):
+    """Dossier de la version publiée (versions/<id>) ; index à plat antérieur au versionnement : la racine."""
+    marker = read_published_marker(index_dir)
+    if marker and marker.get("path"):
+        return os.path.join(index_dir, marker["path"])
+    return index_dir
+
+def hybrid_search(vector_db, bm25_index, query, k=3, candidates=10, rrf_k=60, shards=None, filters=None):
+    """
+    ASPECT CLÉ : Reciprocal Rank Fusion. Chaque document reçoit 1 / (rrf_k + rang)
+    dans chaque classement où il apparaît ; on additionne et on garde les k meilleurs.
+    Pas de calibration de scores : seuls les rangs comptent.
+    """
+    if bm25_index is None:
+        return vector_search(vector_db, shards, query, k, filters)
+    vector_future = SEARCH_POOL.submit(vector_search, vector_db, shards, query, candidates, filters)
+    lexical_docs = bm25_index.search(query, candidates, filters)
+    vector_docs = vector_future.result()
+
+    scores, docs = {}, {}
+    for ranking in (vector_docs, lexical_docs):
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+def parse_filters(query):
+    """Extrait les préfixes 'type:hero' / 'entity:thor' d'une question du terminal."""
+    filters, words = {}, query.split()
+    while words and words[0].lower().startswith(("type:", "entity:")):
+        key, _, value = words.pop(0).partition(":")
+        filters["entity_type" if key.lower() == "type" else "entity"] = value.lower()
+    return filters, " ".join(words)
+
+def load_shards(index_dir, embeddings):
+    """Shards par type d'entité (B02a --shards), chargés comme l'index principal. {} s'il n'y en a pas."""
+    shards_root = os.path.join(index_dir, SHARDS_DIR)
+    shards = {}
+    if os.path.exists(shards_root):
+        for entity_type in sorted(os.listdir(shards_root)):
+            shard_dir = os.path.join(shards_root, entity_type)
+            if os.path.exists(os.path.join(shard_dir, "manifest.json")):
+                shards[entity_type] = load_mmap_vector_db(shard_dir, embeddings)
+            else:
+                shards[entity_type] = FAISS.load_local(shard_dir, embeddings, allow_dangerous_deserialization=True)
+    return shards
+
+def vector_search(vector_db, shards, query, k=3, filters=None):
+    """
+    ASPECT CLÉ : Recherche vectorielle filtrée.
+    - avec shards : on ne parcourt que le shard du type demandé (tous sans filtre de type),
+      la question n'est embeddée qu'une fois et les résultats sont fusionnés par distance
+    - sans shards : index principal + filtre sur les métadonnées des chunks
+    """
+    filters = filters or {}
+    if not shards:
+        if not filters:
+            return vector_db.similarity_search(query, k=k)
+        return vector_db.similarity_search(query, k=k, filter=filters, fetch_k=FILTER_FETCH_K)
+    if "entity_type" in filters:
+        selected = [shards[filters["entity_type"]]] if filters["entity_type"] in shards else []
+    else:
+        selected = list(shards.values())
+    entity_filter = {"entity": filters["entity"]} if "entity" in filters else None
+    embedding = vector_db.embedding_function.embed_query(query)
+    scored = []
+    for shard in selected:
+        scored.extend(shard.similarity_search_with_score_by_vector(embedding, k=k, filter=entity_filter, fetch_k=FILTER_FETCH_K))
+    return [doc for doc, _ in sorted(scored, key=lambda pair: pair[1])[:k]]
+
 def init_rag_components():
-    """Charge l'index FAISS et initialise le LLM."""
+    """Charge l'index FAISS (+ BM25 et shards s'ils existent) et initialise le LLM."""
     load_dotenv()
     
     # 1. Chargement du modèle d'embeddings FastEmbed
     # Doit être identique à celui utilisé lors de l'indexation (5A)
-    embeddings = FastEmbedEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    # (enveloppé dans le LRU des questions : une question répétée n'est embeddée qu'une fois)
+    embeddings = QueryEmbeddingCache(FastEmbedEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2"))
     
-    # 2. Chargement de l'index FAISS
-    index_dir = os.path.join("data", "faiss_index")
-    if not os.path.exists(index_dir):
+    # 2. Chargement de l'index FAISS (version désignée par published.json)
+    index_dir = published_dir()
+    if not os.path.exists(os.path.join(index_dir, "index.faiss")):
         raise FileNotFoundError(f"Index FAISS introuvable dans {index_dir}.")
     
-    vector_db = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+    if os.path.exists(os.path.join(index_dir, "manifest.json")):
+        vector_db = load_mmap_vector_db(index_dir, embeddings)
+    else:
+        vector_db = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+    
+    # Index lexical (absent si l'index date d'avant BM25 : recherche vectorielle seule)
+    bm25_path = os.path.join(index_dir, BM25_FILE)
+    bm25_index = BM25Index(bm25_path, read_only=True) if os.path.exists(bm25_path) else None
+    shards = load_shards(index_dir, embeddings)
     
     # 3. Initialisation du LLM
     llm = ChatOpenAI(
@@ -38,14 +159,33 @@ def init_rag_components():
         temperature=0
     )
     
-    return llm, vector_db
+    return llm, vector_db, bm25_index, shards
 
-def perform_rag_query(llm, vector_db, query):
-    """Effectue la recherche sémantique et génère la réponse augmentée."""
+def perform_rag_query(llm, vector_db, query, bm25_index=None, shards=None, filters=None, answer_cache=None, reranker=None):
+    """
+    Effectue la recherche hybride (sémantique + lexicale, filtrée) et génère la réponse augmentée.
+    Avec `answer_cache`, une question équivalente déjà traitée (mêmes chunks, même index) est
+    servie depuis le cache, sans appel au LLM.
+    Avec `reranker`, RERANK_FETCH_K candidats sont récupérés puis départagés par le cross-encoder.
+    """
     
-    # Recherche sémantique
-    docs = vector_db.similarity_search(query, k=3)
-    context = "\n\n---\n\n".join([doc.page_content for doc in docs])
+    # Recherche hybride (sur-échantillonnée si reranking)
+    start = time.perf_counter()
+    fetch_k = RERANK_FETCH_K if reranker else 3
+    docs = hybrid_search(vector_db, bm25_index, query, k=fetch_k, candidates=max(10, fetch_k), shards=shards, filters=filters)
+    if reranker is not None:
+        docs = reranker.rerank(query, docs, top_n=3, elapsed_ms=(time.perf_counter() - start) * 1000)
+    if answer_cache is not None:
+        # L'embedding de la question vient du LRU : la recherche vient de le calculer
+        embedding = vector_db.embedding_function.embed_query(query)
+        chunk_ids = [doc.id or doc.page_content for doc in docs]
+        index_version = get_index_version()
+        cached = answer_cache.get(embedding, index_version, chunk_ids, filters)
+        if cached is not None:
+            return cached
+    # Assemblage : chunks voisins fusionnés sans recouvrement, sous budget de tokens
+    context, naive_tokens, packed_tokens = pack_context(docs)
+    print(f"[CONTEXTE] 🧩 {naive_tokens} -> {packed_tokens} tokens ({naive_tokens - packed_tokens} économisé(s))")
     
     # Construction du Prompt System spécifique au RAG
     system_prompt = f"""Tu es un assistant expert Marvel MCU. 
@@ -61,20 +201,38 @@ def perform_rag_query(llm, vector_db, query):
     ]
     
     response = llm.invoke(messages)
+    if answer_cache is not None:
+        answer_cache.put(embedding, index_version, chunk_ids, filters, response.content, docs)
     return response.content, docs
 
 # ------------------------------------------------------------------------------
 # SECTION 2 : INTERFACE TERMINAL
 # ------------------------------------------------------------------------------
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Requêtage RAG Marvel dans le terminal")
+    parser.add_argument("--rerank", action="store_true", help="Reranking des candidats par un cross-encoder ONNX local")
+    parser.add_argument("--rerank-budget-ms", type=float, default=RERANK_BUDGET_MS,
+                        help="Budget de latence par question (recherche + reranking), au-delà le reranking est sauté")
+    return parser.parse_args()
+
 def main():
     print("--- Demo LLM - Phase B : Étape 2b : Requêtage RAG (Terminal) ---")
+    args = parse_args()
     
     try:
-        llm, vector_db = init_rag_components()
+        llm, vector_db, bm25_index, shards = init_rag_components()
+        reranker = CrossEncoderReranker(budget_ms=args.rerank_budget_ms) if args.rerank else None
     except Exception as e:
         print(f"Erreur d'initialisation : {e}")
         return
+    answer_cache = SemanticAnswerCache()
+    if reranker:
+        print(f"[Info] Reranking actif : {RERANK_FETCH_K} candidats, budget {args.rerank_budget_ms:.0f} ms ({RERANK_MODEL})")
+
+    if shards:
+        print(f"[Info] Shards chargés : {', '.join(shards)}")
+    print("[Info] Filtres possibles en début de question : type:hero|movie|vilain entity:thor")
 
     while True:
         query = input("\nVotre question Marvel (exit pour quitter) : ")
@@ -82,13 +240,16 @@ def main():
         if query.lower() in ["exit", "quitter"]:
             break
             
+        filters, query = parse_filters(query)
         if not query.strip():
             continue
 
+        if filters:
+            print(f"[Filtre] {filters}")
         print(f"\n[Recherche et Génération...]")
         
         try:
-            answer, sources = perform_rag_query(llm, vector_db, query)
+            answer, sources = perform_rag_query(llm, vector_db, query, bm25_index, shards, filters, answer_cache, reranker)
             
             # Affichage des sources
             print("\nSOURCES :")
@@ -98,6 +259,12 @@ def main():
             
             print("\nRÉPONSE :")
             print(answer)
+            query_cache = vector_db.embedding_function
+            stats = answer_cache.stats()
+            print(f"\n[CACHE] Embeddings : {query_cache.hits} hit(s) / {query_cache.misses} miss(es) | "
+                  f"Réponses : {stats['hits']} hit(s) / {stats['misses']} miss(es) ({stats['hit_rate']:.0%})")
+            if reranker:
+                print(f"[RERANK] {reranker.reranked} question(s) rerankée(s), {reranker.skipped} hors budget")
             print("-" * 50)
             
         except Exception as e:
@@ -1,8 +1,16 @@
 import os
 import json
+import shutil
+import sqlite3
+import threading
+import time
+import httpx
+import faiss
 import streamlit as st
 from datetime import datetime
+from filelock import FileLock, Timeout
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
 
 # Imports LangChain & RAG
 from langchain_openai import ChatOpenAI
@@ -10,19 +18,75 @@ from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, SystemMessage
+from rag_common import RERANK_BUDGET_MS, RERANK_MODEL, CrossEncoderReranker, QueryEmbeddingCache, SemanticAnswerCache, pack_context
+from rag_common import BM25Index, CachedEmbeddings, IngestionJournal, NearDuplicateIndex, compute_hash, entity_from_filename, load_mmap_vector_db, tag_duplicate_sources
 
 # ==============================================================================
 # Demo LLM - Phase B : Étape 2c : Interface RAG (Streamlit)
 # ==============================================================================
 # ASPECT CLÉ : Cette interface combine le Chat et le RAG. Elle permet également
 # de piloter l'ingestion des données depuis la barre latérale.
+# ASPECT CLÉ 2 : Recherche hybride FAISS + BM25 fusionnée par rang (RRF) ;
+# l'ingestion met à jour les deux index.
+# ASPECT CLÉ 3 : Filtre par type d'entité / entité depuis la barre latérale ; avec
+# les shards de B02a (--shards), seul le sous-index du type choisi est parcouru.
+# ASPECT CLÉ 4 : Deux caches partagés par les sessions : LRU des embeddings de
+# questions (texte normalisé) et cache sémantique des réponses (pas d'appel LLM),
+# ce dernier limité aux premières questions (sans historique) de chaque conversation.
+# ASPECT CLÉ 5 : Reranking optionnel par un cross-encoder ONNX local (barre latérale),
+# borné par un budget de latence par question.
+# ASPECT CLÉ 6 : Contexte assemblé : chunks voisins fusionnés (recouvrement de 200
+# caractères retiré), puis tronqué à un budget de tokens mesuré avec tiktoken
+# (rag_common.pack_context, commun à B02b et B02c).
+# ASPECT CLÉ 7 : L'ingestion partage le journal SQLite de B02a (même classe, importée
+# de rag_common.py) : lot journalisé avant l'embedding, état publié en une transaction
+# après la sauvegarde de l'index.
+# ASPECT CLÉ 8 : Ingestion en arrière-plan (thread) avec barre de progression ; la
+# nouvelle version de l'index remplace l'ancienne d'un bloc dans toutes les sessions.
+# Une version publiée par un autre processus (B02a, surveillance B02h) est reprise
+# de la même façon, sans redémarrage.
+# ASPECT CLÉ 9 : Versions immuables (comme B02a) : l'ingestion écrit index, BM25 et shards
+# dans un dossier versions/<id> neuf, puis bascule le pointeur published.json. Elle
+# prend le même verrou inter-processus que B02a / B02h : un seul écrivain à la fois.
+# ASPECT CLÉ 10 : Si B02a déduplique (data/near_duplicates.sqlite), l'ingestion applique
+# le même filtre MinHash / LSH (rag_common.NearDuplicateIndex), ne supprime que les IDs réellement indexés et réintègre
+# les chunks dont le représentant a disparu.
+# ASPECT CLÉ 11 : Comme B03, si RAG_SERVICE_URL est défini, la recherche passe par le
+# service B02e (index partagé entre processus) ; la recherche locale reste le repli.
 # ==============================================================================
 
 # Configuration des dossiers
 SOURCE_DIR = os.path.join("data", "source_files")
 INDEX_DIR = os.path.join("data", "faiss_index")
 TRACKING_FILE = os.path.join("data", "processed_files.json")
+JOURNAL_FILE = os.path.join("data", "ingestion_journal.sqlite")
+# Quasi-doublons écartés par B02a (absent si B02a tourne avec --no-dedup)
+DEDUP_FILE = os.path.join("data", "near_duplicates.sqlite")
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+MANIFEST_FILE = "manifest.json"
+BM25_FILE = "bm25.sqlite"
+PUBLISHED_FILE = "published.json"
+SHARDS_DIR = "shards"
+VERSIONS_DIR = "versions"
+# Fichiers de l'ancien format "à plat" (index directement à la racine de INDEX_DIR)
+LEGACY_ENTRIES = ("index.faiss", "index.pkl", "docstore.sqlite", MANIFEST_FILE, BM25_FILE, SHARDS_DIR)
+FILTER_FETCH_K = 200
+# Reranking : candidats récupérés (modèle et budget par défaut : rag_common)
+RERANK_FETCH_K = 20
+# Ingestion : chunks embeddés puis ajoutés à FAISS par lot (granularité de la progression)
+INGEST_BATCH_SIZE = 256
+
+# Service RAG partagé (B02e) : si défini, la recherche passe par lui (micro-batching inter-processus)
+load_dotenv()
+RAG_SERVICE_URL = os.getenv("RAG_SERVICE_URL")
+# Délai maximal d'un appel au service (s) : au-delà, repli sur la recherche locale
+RAG_SERVICE_TIMEOUT = 2.0
+
+# Un thread dédié à la recherche vectorielle pendant que BM25 tourne sur l'appelant
+SEARCH_POOL = ThreadPoolExecutor(max_workers=2)
 
 # ------------------------------------------------------------------------------
 # SECTION 1 : LOGIQUE COEUR LLM & RAG
@@ -41,69 +105,520 @@ def get_llm():
 
 def get_embeddings():
     """Initialise le modèle d'embeddings FastEmbed."""
-    return FastEmbedEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    return FastEmbedEmbeddings(model_name=EMBEDDING_MODEL)
+
+def read_published_marker():
+    """Pointeur published.json écrit par B02a / l'ingestion (None si rien n'a encore été publié)."""
+    path = os.path.join(INDEX_DIR, PUBLISHED_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def get_published_version():
+    """Identifiant de la version publiée, None si absent."""
+    marker = read_published_marker()
+    return marker["version"] if marker else None
 
-def load_vector_db():
-    """Charge l'index FAISS s'il existe."""
-    embeddings = get_embeddings()
-    if os.path.exists(INDEX_DIR):
-        return FAISS.load_local(INDEX_DIR, embeddings, allow_dangerous_deserialization=True)
+def published_dir():
+    """Dossier de la version publiée (versions/<id>) ; index à plat antérieur au versionnement : INDEX_DIR."""
+    marker = read_published_marker()
+    if marker and marker.get("path"):
+        return os.path.join(INDEX_DIR, marker["path"])
+    return INDEX_DIR
+
+def new_version_dir():
+    """Dossier neuf versions/<id>, invisible des lecteurs tant que le pointeur ne le désigne pas."""
+    version = str(time.time_ns())
+    path = os.path.join(INDEX_DIR, VERSIONS_DIR, version)
+    os.makedirs(path)
+    return version, path
+
+def publish_version(version, ntotal):
+    """
+    Bascule du pointeur (même format que B02a) : un seul renommage atomique, en dernier.
+    Le type d'index demandé à B02a est reporté (l'ingestion ne met à jour que des index plats).
+    """
+    previous = read_published_marker() or {}
+    marker = {"version": version, "path": f"{VERSIONS_DIR}/{version}", "ntotal": ntotal,
+              "index_type": previous.get("index_type", "flat"),
+              "published_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    path = os.path.join(INDEX_DIR, PUBLISHED_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(marker, f, indent=2)
+    for _ in range(50):
+        try:
+            os.replace(path + ".tmp", path)
+            return
+        except PermissionError:
+            # Windows : remplacement refusé pendant qu'un lecteur lit le pointeur (quelques ms)
+            time.sleep(0.1)
+    os.replace(path + ".tmp", path)
+
+def remove_quietly(path):
+    """Suppression d'un fichier ou dossier ; s'il est encore ouvert (Windows), on réessaiera plus tard."""
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    except OSError:
+        pass
+
+def prune_versions(keep):
+    """Retire les versions autres que la publiée et la précédente, et les fichiers de l'ancien format à plat."""
+    versions_root = os.path.join(INDEX_DIR, VERSIONS_DIR)
+    for name in os.listdir(versions_root):
+        if name not in keep:
+            remove_quietly(os.path.join(versions_root, name))
+    for name in LEGACY_ENTRIES:
+        remove_quietly(os.path.join(INDEX_DIR, name))
+
+def load_vector_db(index_dir):
+    """Charge l'index FAISS s'il existe (embeddings des questions via le cache LRU partagé)."""
+    embeddings = get_query_embeddings()
+    if os.path.exists(os.path.join(index_dir, MANIFEST_FILE)):
+        return load_mmap_vector_db(index_dir, embeddings)
+    if os.path.exists(os.path.join(index_dir, "index.faiss")):
+        return FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
     return None
 
-def ingest_new_files():
+def load_vector_db_for_update(embeddings, index_dir):
+    """Charge l'index en mémoire (modifiable), quel que soit son format sur disque (cf. B02a)."""
+    if not os.path.exists(os.path.join(index_dir, MANIFEST_FILE)):
+        return FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+    index = faiss.read_index(os.path.join(index_dir, "index.faiss"))
+    conn = sqlite3.connect(os.path.join(index_dir, "docstore.sqlite"))
+    docs, index_to_docstore_id = {}, {}
+    for row, doc_id, content, metadata in conn.execute("SELECT row, id, page_content, metadata FROM docs ORDER BY row"):
+        docs[doc_id] = Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+        index_to_docstore_id[row] = doc_id
+    conn.close()
+    return FAISS(embeddings, index, InMemoryDocstore(docs), index_to_docstore_id)
+
+def save_vector_db(db, index_dir, mmap):
+    """Écrit l'index dans un dossier de version neuf : LangChain (pickle) ou mmap (FAISS brut + SQLite + manifeste)."""
+    if not mmap:
+        db.save_local(index_dir)
+        return
+    os.makedirs(index_dir, exist_ok=True)
+    faiss.write_index(db.index, os.path.join(index_dir, "index.faiss"))
+    conn = sqlite3.connect(os.path.join(index_dir, "docstore.sqlite"))
+    conn.execute("CREATE TABLE docs (row INTEGER PRIMARY KEY, id TEXT UNIQUE, page_content TEXT, metadata TEXT)")
+    conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", [
+        (row, doc_id, db.docstore.search(doc_id).page_content, json.dumps(db.docstore.search(doc_id).metadata, ensure_ascii=False))
+        for row, doc_id in db.index_to_docstore_id.items()
+    ])
+    conn.commit()
+    conn.close()
+    manifest = {"format": "faiss-mmap-v1", "embedding_model": EMBEDDING_MODEL, "dim": db.index.d, "index_type": "flat",
+                "ntotal": db.index.ntotal, "index_file": "index.faiss", "docstore_file": "docstore.sqlite",
+                "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    with open(os.path.join(index_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+def load_shards(index_dir):
+    """Shards par type d'entité créés par B02a --shards ({} s'il n'y en a pas)."""
+    shards_root = os.path.join(index_dir, SHARDS_DIR)
+    if not os.path.exists(shards_root):
+        return {}
+    embeddings = get_query_embeddings()
+    shards = {}
+    for entity_type in sorted(os.listdir(shards_root)):
+        shard_dir = os.path.join(shards_root, entity_type)
+        if os.path.exists(os.path.join(shard_dir, MANIFEST_FILE)):
+            shards[entity_type] = load_mmap_vector_db(shard_dir, embeddings)
+        else:
+            shards[entity_type] = FAISS.load_local(shard_dir, embeddings, allow_dangerous_deserialization=True)
+    return shards
+
+def save_shards(db, current_dir, version_dir, mmap):
+    """Si B02a a créé des shards, ils sont reconstruits depuis l'index plat mis à jour (sans ré-embedding)."""
+    if not os.path.exists(os.path.join(current_dir, SHARDS_DIR)):
+        return
+    shards_root = os.path.join(version_dir, SHARDS_DIR)
+    vectors = db.index.reconstruct_n(0, db.index.ntotal)
+    groups = {}
+    for row, doc_id in db.index_to_docstore_id.items():
+        doc = db.docstore.search(doc_id)
+        if "entity_type" not in doc.metadata:
+            doc.metadata["entity_type"], doc.metadata["entity"] = entity_from_filename(doc.metadata.get("source", doc_id.split("::")[0]))
+        groups.setdefault(doc.metadata["entity_type"], []).append((row, doc_id, doc))
+    for entity_type, members in groups.items():
+        index = faiss.IndexFlatL2(db.index.d)
+        index.add(vectors[[row for row, _, _ in members]])
+        docstore = InMemoryDocstore({doc_id: doc for _, doc_id, doc in members})
+        shard = FAISS(db.embedding_function, index, docstore, {i: doc_id for i, (_, doc_id, _) in enumerate(members)})
+        save_vector_db(shard, os.path.join(shards_root, entity_type), mmap)
+
+def vector_search(vector_db, shards, query, k=3, filters=None):
+    """
+    Recherche vectorielle filtrée : shard du type demandé si disponible (fusion par distance
+    entre shards sans filtre de type), sinon index principal + filtre de métadonnées.
+    """
+    filters = filters or {}
+    if not shards:
+        if not filters:
+            return vector_db.similarity_search(query, k=k)
+        return vector_db.similarity_search(query, k=k, filter=filters, fetch_k=FILTER_FETCH_K)
+    if "entity_type" in filters:
+        selected = [shards[filters["entity_type"]]] if filters["entity_type"] in shards else []
+    else:
+        selected = list(shards.values())
+    entity_filter = {"entity": filters["entity"]} if "entity" in filters else None
+    embedding = vector_db.embedding_function.embed_query(query)
+    scored = []
+    for shard in selected:
+        scored.extend(shard.similarity_search_with_score_by_vector(embedding, k=k, filter=entity_filter, fetch_k=FILTER_FETCH_K))
+    return [doc for doc, _ in sorted(scored, key=lambda pair: pair[1])[:k]]
+
+@st.cache_resource(show_spinner=False)
+def get_query_embeddings():
+    """Modèle FastEmbed + LRU des questions, une seule instance partagée par toutes les sessions."""
+    return QueryEmbeddingCache(get_embeddings())
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache():
+    """Cache sémantique des réponses, partagé par toutes les sessions."""
+    return SemanticAnswerCache()
+
+def load_bm25_index(index_dir):
+    """Index lexical s'il existe (sinon la recherche reste purement vectorielle)."""
+    path = os.path.join(index_dir, BM25_FILE)
+    return BM25Index(path, read_only=True) if os.path.exists(path) else None
+
+@st.cache_resource(show_spinner="Chargement du cross-encoder...")
+def get_reranker():
+    """Cross-encoder ONNX, chargé une fois et partagé par toutes les sessions."""
+    return CrossEncoderReranker()
+
+def hybrid_search(vector_db, bm25_index, query, k=3, candidates=10, rrf_k=60, shards=None, filters=None):
+    """
+    ASPECT CLÉ : FAISS et BM25 en parallèle, puis Reciprocal Rank Fusion :
+    score = somme des 1 / (rrf_k + rang) sur les deux classements.
+    """
+    if bm25_index is None:
+        return vector_search(vector_db, shards, query, k, filters)
+    vector_future = SEARCH_POOL.submit(vector_search, vector_db, shards, query, candidates, filters)
+    lexical_docs = bm25_index.search(query, candidates, filters)
+    vector_docs = vector_future.result()
+
+    scores, docs = {}, {}
+    for ranking in (vector_docs, lexical_docs):
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+def search_rag_service(query, k=3, filters=None):
+    """Recherche déléguée au service B02e (comme B03). Renvoie None si le service est injoignable."""
+    try:
+        response = httpx.post(f"{RAG_SERVICE_URL}/search", json={"query": query, "k": k, "filters": filters},
+                              timeout=RAG_SERVICE_TIMEOUT)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"[RECHERCHE] ⚠️ Service RAG injoignable ({e}), recherche locale.")
+        return None
+    return [Document(id=d["id"], page_content=d["page_content"], metadata=d["metadata"]) for d in response.json()["documents"]]
+
+def split_source_file(filename, text_splitter):
+    """Chunks d'un fichier source, indexés par leur ID stable '<fichier>::<empreinte>' (comme B02a)."""
+    loader = TextLoader(os.path.join(SOURCE_DIR, filename), encoding="utf-8")
+    chunks = {}
+    for chunk in text_splitter.split_documents(loader.load()):
+        chunk.metadata["chunk_hash"] = compute_hash(chunk.page_content)
+        chunk.metadata["entity_type"], chunk.metadata["entity"] = entity_from_filename(filename)
+        chunks[f"{filename}::{chunk.metadata['chunk_hash'][:16]}"] = chunk
+    return chunks
+
+def ingest_new_files(progress=None):
     """
-    Logique d'ingestion incrémentale (issue de 05a).
-    Retourne le nombre de nouveaux fichiers traités.
+    Logique d'ingestion incrémentale par empreinte (issue de B02a).
+    progress(fraction, texte) est appelé à chaque étape (barre de progression de l'interface).
+    Retourne le nombre de fichiers nouveaux, modifiés ou supprimés traités.
     """
+    report = progress or (lambda fraction, text: None)
+    lock = FileLock(INDEX_DIR.rstrip("/\\") + ".lock")
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        report(0.0, "Une autre ingestion est en cours (B02a / B02h) : attente de sa fin...")
+        lock.acquire()
+    try:
+        return update_index(report)
+    finally:
+        lock.release()
+
+def update_index(report):
+    """Une ingestion complète (appelée sous le verrou d'écriture partagé avec B02a)."""
     if not os.path.exists(SOURCE_DIR):
         return 0, "Dossier source introuvable."
+    if os.path.exists(INDEX_DIR.rstrip("/\\") + ".checkpoint"):
+        # Seul B02a sait repartir de son point de reprise
+        return 0, "Ingestion B02a interrompue : relancez B02a_create_vector_db.py pour la reprendre."
     
-    # 1. Tracking
-    processed_files = {}
+    # 1. Tracking : journal d'ingestion (migré depuis processed_files.json au premier passage).
+    # Une ingestion interrompue est rejouée depuis l'état publié (format historique : reconstruction complète).
+    journal = IngestionJournal(JOURNAL_FILE)
     if os.path.exists(TRACKING_FILE):
         with open(TRACKING_FILE, "r", encoding="utf-8") as f:
-            processed_files = json.load(f)
+            journal.import_tracking(json.load(f))
+    # Même journal (rag_common) et même sémantique que B02a, sans point de reprise : tous les lots
+    # de l'exécution interrompue sont abandonnés puis rejoués
+    interrupted = journal.resume(0)
+    processed_files = journal.published_files()
+    # Les mises à jour partent de la version publiée ; la nouvelle est écrite à côté
+    current_dir = published_dir()
+    index_exists = os.path.exists(os.path.join(current_dir, "index.faiss"))
+    mmap = os.path.exists(os.path.join(current_dir, MANIFEST_FILE))
+    rebuild = not processed_files or not index_exists or (interrupted is not None and interrupted[1])
+    if rebuild:
+        processed_files = {}
+    elif not isinstance(faiss.read_index(os.path.join(current_dir, "index.faiss"), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY), faiss.IndexFlat):
+        # Les index approximatifs (HNSW, IVF-PQ) sont reconstruits par B02a, qui seul sait les ré-entraîner.
+        journal.close()
+        return 0, "Index approximatif (HNSW / IVF-PQ) : mettez-le à jour avec B02a_create_vector_db.py --index-type ..."
             
-    all_files = [f for f in os.listdir(SOURCE_DIR) if f.endswith(".txt")]
-    new_files = [f for f in all_files if f not in processed_files]
+    file_hashes = {}
+    for filename in sorted(f for f in os.listdir(SOURCE_DIR) if f.endswith(".txt")):
+        with open(os.path.join(SOURCE_DIR, filename), "rb") as f:
+            file_hashes[filename] = compute_hash(f.read())
+    changed_files = [f for f, h in file_hashes.items() if processed_files.get(f, {}).get("hash") != h]
+    removed_files = [f for f in processed_files if f not in file_hashes]
+    bm25_path = os.path.join(current_dir, BM25_FILE)
+    # Index antérieur à BM25 : une nouvelle version est publiée avec l'index lexical complet
+    bm25_missing = not rebuild and not os.path.exists(bm25_path)
+    
+    # Quasi-doublons : même table que B02a, les chunks écartés ne sont ni dans FAISS ni dans BM25
+    dedup = NearDuplicateIndex(DEDUP_FILE) if os.path.exists(DEDUP_FILE) else None
+    if dedup is not None and rebuild:
+        dedup.clear()
+    dedup_changed = dedup is not None and bool(dedup.cross_scope())
     
-    if not new_files:
+    report(0.05, f"{len(changed_files)} fichier(s) nouveau(x) ou modifié(s), {len(removed_files)} supprimé(s)")
+    if not changed_files and not removed_files and not bm25_missing and not dedup_changed:
+        if dedup is not None:
+            dedup.close()
+        if interrupted is not None:
+            journal.publish(interrupted[0], processed_files)
+        journal.close()
         return 0, "Tous les fichiers sont déjà à jour."
+    run_id = interrupted[0] if interrupted is not None else journal.start_run(rebuild)
 
-    # 2. Processing
-    embeddings = get_embeddings()
+    # 2. Processing : seuls les chunks dont l'empreinte est nouvelle sont embeddés,
+    # et parmi eux seuls ceux absents du cache disque passent par FastEmbed.
+    embeddings = CachedEmbeddings(EMBEDDING_MODEL)
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
     
-    new_docs = []
-    for filename in new_files:
-        loader = TextLoader(os.path.join(SOURCE_DIR, filename), encoding="utf-8")
-        new_docs.extend(text_splitter.split_documents(loader.load()))
-        processed_files[filename] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    new_docs, new_ids, ids_to_delete = [], [], []
+    for i, filename in enumerate(changed_files):
+        report(0.05 + 0.15 * i / len(changed_files), f"Découpage : {filename}")
+        chunks = split_source_file(filename, text_splitter)
+        old_ids = set(processed_files.get(filename, {}).get("chunks", []))
+        for chunk_id, chunk in chunks.items():
+            if chunk_id not in old_ids:
+                new_ids.append(chunk_id)
+                new_docs.append(chunk)
+        ids_to_delete.extend(old_ids - set(chunks))
+        processed_files[filename] = {
+            "hash": file_hashes[filename],
+            "chunks": list(chunks),
+            "indexed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+    for filename in removed_files:
+        ids_to_delete.extend(processed_files.pop(filename).get("chunks", []))
+    journal.begin_batch(run_id, {f: processed_files[f] for f in changed_files}, len(new_docs))
+    if dedup is not None:
+        new_docs, new_ids = dedup.filter(new_docs, new_ids)
 
     # 3. FAISS
-    if os.path.exists(INDEX_DIR):
-        db = FAISS.load_local(INDEX_DIR, embeddings, allow_dangerous_deserialization=True)
-        db.add_documents(new_docs)
-    else:
-        db = FAISS.from_documents(new_docs, embeddings)
+    db = None
+    if not rebuild:
+        report(0.2, "Chargement de l'index pour mise à jour...")
+        db = load_vector_db_for_update(embeddings, current_dir)
+        live_ids = set(db.index_to_docstore_id.values())
+        if interrupted is not None:
+            # Rejeu : l'index a pu être sauvegardé avant le crash, on n'applique que ce qui manque
+            kept = [(doc, chunk_id) for doc, chunk_id in zip(new_docs, new_ids) if chunk_id not in live_ids]
+            new_docs, new_ids = [doc for doc, _ in kept], [chunk_id for _, chunk_id in kept]
+        # Le suivi garde aussi les chunks écartés comme quasi-doublons : seuls les présents sont supprimés
+        # (FAISS.delete refuse un ID inconnu)
+        db_deletes = [i for i in ids_to_delete if i in live_ids]
+        if db_deletes:
+            db.delete(db_deletes)
+        if dedup is not None:
+            # Un chunk écarté dont le représentant a disparu est réintégré (re-découpage de son fichier)
+            dedup.forget(ids_to_delete)
+            orphans = {}
+            for chunk_id in dedup.orphans(set(db.index_to_docstore_id.values()) | set(new_ids)):
+                orphans.setdefault(chunk_id.split("::")[0], set()).add(chunk_id)
+            orphan_docs, orphan_ids = [], []
+            for filename, file_chunk_ids in orphans.items():
+                if os.path.exists(os.path.join(SOURCE_DIR, filename)):
+                    for chunk_id, chunk in split_source_file(filename, text_splitter).items():
+                        if chunk_id in file_chunk_ids:
+                            orphan_docs.append(chunk)
+                            orphan_ids.append(chunk_id)
+            orphan_docs, orphan_ids = dedup.filter(orphan_docs, orphan_ids)
+            new_docs, new_ids = new_docs + orphan_docs, new_ids + orphan_ids
+    for start in range(0, len(new_docs), INGEST_BATCH_SIZE):
+        report(0.2 + 0.6 * start / len(new_docs), f"Embedding : {start}/{len(new_docs)} chunks")
+        batch_docs, batch_ids = new_docs[start:start + INGEST_BATCH_SIZE], new_ids[start:start + INGEST_BATCH_SIZE]
+        if db is None:
+            db = FAISS.from_documents(batch_docs, embeddings, ids=batch_ids)
+        else:
+            db.add_documents(batch_docs, ids=batch_ids)
+    if db is None:
+        if dedup is not None:
+            dedup.close()
+        journal.publish(run_id, processed_files)
+        journal.close()
+        return 0, "Aucun document à indexer."
+    
+    report(0.8, "Sauvegarde de l'index...")
+    if dedup is not None:
+        tag_duplicate_sources(db, dedup.sources())
+        dedup.close()
+    version, version_dir = new_version_dir()
+    save_shards(db, current_dir, version_dir, mmap)
+    save_vector_db(db, version_dir, mmap)
     
-    db.save_local(INDEX_DIR)
+    # 4. BM25 : mêmes chunks, mêmes IDs que FAISS (mise à jour d'une copie de la version publiée)
+    report(0.9, "Mise à jour de l'index lexical BM25...")
+    new_bm25_path = os.path.join(version_dir, BM25_FILE)
+    if not rebuild and not bm25_missing:
+        shutil.copyfile(bm25_path, new_bm25_path)
+    bm25 = BM25Index(new_bm25_path)
+    if rebuild or bm25_missing:
+        all_ids = list(db.index_to_docstore_id.values())
+        bm25.clear()
+        bm25.add_documents([db.docstore.search(i) for i in all_ids], all_ids)
+    else:
+        bm25.delete(ids_to_delete)
+        bm25.add_documents(new_docs, new_ids)
+    bm25.commit()
+    bm25.close()
+
+    # 5. Publication : bascule du pointeur (lecteurs), journal (transaction unique), export processed_files.json
+    previous = get_published_version()
+    publish_version(version, db.index.ntotal)
+    journal.publish(run_id, processed_files)
+    journal.close()
     with open(TRACKING_FILE, "w", encoding="utf-8") as f:
         json.dump(processed_files, f, indent=2, ensure_ascii=False)
+    prune_versions(keep={version, previous})
         
-    return len(new_files), "Succès"
+    print(f"[CACHE] 💾 Embeddings : {embeddings.hits} hit(s) / {embeddings.misses} miss(es)")
+    return len(changed_files) + len(removed_files), f"Succès (cache embeddings : {embeddings.hits} hit(s) / {embeddings.misses} miss(es))"
 
-def get_rag_response_stream(llm, vector_db, messages):
+class LiveIndex:
+    """
+    ASPECT CLÉ : Index "vivant" partagé par toutes les sessions (st.cache_resource).
+    - resources : FAISS + BM25 + shards de la version courante, remplacés d'un bloc sous verrou
+    - une seule ingestion à la fois, dans un thread d'arrière-plan qui publie sa progression
+    Une question en cours garde sa référence à l'ancienne version, libérée dès qu'elle se termine :
+    les deux versions ne coexistent en mémoire que le temps du chargement de la nouvelle.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.published = get_published_version()
+        self.resources = self.load()
+        self.job = None
+        self.progress = (0.0, "")
+        self.result = None  # (nombre de fichiers, message) de la dernière ingestion
+
+    @staticmethod
+    def load():
+        """Pointeur lu une seule fois : FAISS, BM25 et shards viennent de la même version."""
+        index_dir = published_dir()
+        return {"vector_db": load_vector_db(index_dir), "bm25_index": load_bm25_index(index_dir), "shards": load_shards(index_dir)}
+
+    def current(self):
+        with self.lock:
+            return self.version, self.resources
+
+    def swap(self):
+        """La nouvelle version est chargée hors verrou : les questions ne sont jamais bloquées."""
+        published = get_published_version()
+        resources = self.load()
+        with self.lock:
+            self.resources = resources
+            self.published = published
+            self.version += 1
+
+    def refresh(self):
+        """Version publiée par un autre processus (B02a, surveillance B02h) : remplacement à chaud."""
+        if not self.running() and get_published_version() != self.published:
+            self.swap()
+
+    def running(self):
+        return self.job is not None and self.job.is_alive()
+
+    def start_ingestion(self):
+        with self.lock:
+            if self.running():
+                return False
+            self.progress, self.result = (0.0, "Analyse des nouveaux fichiers..."), None
+            self.job = threading.Thread(target=self.run_ingestion, name="ingestion", daemon=True)
+            self.job.start()
+        return True
+
+    def report(self, fraction, text):
+        self.progress = (fraction, text)
+
+    def run_ingestion(self):
+        disk_version = get_published_version()
+        try:
+            count, msg = ingest_new_files(progress=self.report)
+            if get_published_version() != disk_version:
+                self.report(0.95, "Publication de la nouvelle version...")
+                self.swap()
+        except Exception as e:
+            count, msg = 0, f"Échec de l'ingestion : {e}"
+        self.result = (count, msg)
+        self.report(1.0, msg)
+
+@st.cache_resource(show_spinner="Chargement de l'index...")
+def get_live_index():
+    """Index courant et ingestion en cours, partagés par toutes les sessions."""
+    return LiveIndex()
+
+def record_answer(stream, answer_cache, embedding, index_version, chunk_ids, filters, sources):
+    """Relaie le flux du LLM puis enregistre la réponse complète dans le cache sémantique."""
+    answer = ""
+    for chunk in stream:
+        answer += chunk.content
+        yield chunk
+    answer_cache.put(embedding, index_version, chunk_ids, filters, answer, sources)
+
+def get_rag_response_stream(llm, vector_db, messages, bm25_index=None, shards=None, filters=None, answer_cache=None,
+                            reranker=None, rerank_budget_ms=None):
     """
     Similaire à 05b, mais adapté pour le streaming de conversation.
     ASPECT CLÉ : On utilise le dernier message pour chercher dans la base,
     mais on garde l'historique pour la qualité de la réponse.
+    Avec `answer_cache`, une question équivalente déjà traitée (mêmes chunks, même index)
+    est servie depuis le cache, sans appel au LLM. Seulement en début de conversation : le
+    cache est partagé par les sessions, mais la réponse dépend aussi de l'historique.
+    Avec `reranker`, RERANK_FETCH_K candidats sont départagés par le cross-encoder.
+    Si RAG_SERVICE_URL est défini, la recherche est confiée au service B02e (index local en repli).
     """
     user_query = messages[-1].content
     
-    # Recherche sémantique
-    relevant_docs = vector_db.similarity_search(user_query, k=3)
-    context = "\n\n---\n\n".join([d.page_content for d in relevant_docs])
+    # Recherche hybride (sémantique + lexicale), sur-échantillonnée si reranking
+    start = time.perf_counter()
+    fetch_k = RERANK_FETCH_K if reranker else 3
+    relevant_docs = search_rag_service(user_query, fetch_k, filters) if RAG_SERVICE_URL else None
+    if relevant_docs is None:
+        relevant_docs = hybrid_search(vector_db, bm25_index, user_query, k=fetch_k, candidates=max(10, fetch_k), shards=shards, filters=filters)
+    if reranker is not None:
+        relevant_docs = reranker.rerank(user_query, relevant_docs, top_n=3,
+                                        elapsed_ms=(time.perf_counter() - start) * 1000, budget_ms=rerank_budget_ms)
+    # Assemblage : chunks voisins fusionnés sans recouvrement, sous budget de tokens
+    context, naive_tokens, packed_tokens = pack_context(relevant_docs)
+    print(f"[CONTEXTE] 🧩 {naive_tokens} -> {packed_tokens} tokens ({naive_tokens - packed_tokens} économisé(s))")
     
     # On reconstruit le prompt système avec le contexte frais
     sys_message = SystemMessage(content=f"""Tu es un assistant expert Marvel MCU. 
@@ -117,7 +632,54 @@ def get_rag_response_stream(llm, vector_db, messages):
     # pour cet appel spécifique (ou on le rajoute)
     rag_messages = [sys_message] + [m for m in messages if not isinstance(m, SystemMessage)]
     
-    return llm.stream(rag_messages), relevant_docs
+    # Question de suite ("et son frère ?") : réponse propre à l'historique, ni lue ni écrite dans le cache
+    if answer_cache is None or len(rag_messages) > 2:
+        return llm.stream(rag_messages), relevant_docs
+    # L'embedding de la question vient du LRU : la recherche vient de le calculer
+    embedding = vector_db.embedding_function.embed_query(user_query)
+    chunk_ids = [d.id or d.page_content for d in relevant_docs]
+    index_version = get_published_version()
+    cached = answer_cache.get(embedding, index_version, chunk_ids, filters)
+    if cached is not None:
+        answer, sources = cached
+        return iter([AIMessageChunk(content=answer)]), sources
+    stream = record_answer(llm.stream(rag_messages), answer_cache, embedding, index_version, chunk_ids, filters, relevant_docs)
+    return stream, relevant_docs
+
+def render_cache_stats(container, rerank=False):
+    """Taux de succès des deux couches de cache (et du reranking s'il est actif) dans la barre latérale."""
+    query_cache = get_query_embeddings()
+    answer_stats = get_answer_cache().stats()
+    query_total = query_cache.hits + query_cache.misses
+    query_rate = query_cache.hits / query_total if query_total else 0.0
+    with container.container():
+        st.caption("⚡ Caches :")
+        st.markdown(f"**Embeddings de questions** : {query_rate:.0%} ({query_cache.hits} hit(s) / {query_cache.misses} miss(es), "
+                    f"{len(query_cache.entries)} en mémoire)")
+        st.markdown(f"**Réponses (sémantique)** : {answer_stats['hit_rate']:.0%} ({answer_stats['hits']} hit(s) / "
+                    f"{answer_stats['misses']} miss(es), {answer_stats['size']} en cache, {answer_stats['evictions']} évincée(s))")
+        if rerank:
+            reranker = get_reranker()
+            cost = f", {reranker.ms_per_candidate:.1f} ms/candidat" if reranker.ms_per_candidate else ""
+            st.markdown(f"**Reranking** : {reranker.reranked} question(s) rerankée(s), {reranker.skipped} hors budget{cost}")
+
+def render_ingestion_status():
+    """Progression de l'ingestion d'arrière-plan (fragment rafraîchi chaque seconde pendant l'ingestion)."""
+    live = get_live_index()
+    if live.running():
+        st.session_state.ingestion_watch = True
+        fraction, text = live.progress
+        st.progress(fraction, text=text)
+        return
+    if st.session_state.pop("ingestion_watch", False):
+        st.rerun()  # Ingestion terminée : réexécution complète (bouton réactivé, liste des documents à jour)
+    if live.result is not None:
+        count, msg = live.result
+        if count > 0:
+            st.success(f"{count} fiche(s) ajoutée(s), modifiée(s) ou retirée(s) !")
+            st.caption(msg)
+        else:
+            st.info(msg)
 
 # ------------------------------------------------------------------------------
 # SECTION 2 : INTERFACE UTILISATEUR (Streamlit)
@@ -129,19 +691,36 @@ def main():
     # --- SIDEBAR : Pilotage des données ---
     with st.sidebar:
         st.title("⚙️ Pilotage RAG")
-        if st.button("🔄 Mettre à jour la Vector DB", use_container_width=True):
-            with st.spinner("Analyse des nouveaux fichiers..."):
-                count, msg = ingest_new_files()
-                if count > 0:
-                    st.success(f"{count} fiches ajoutées !")
-                else:
-                    st.info(msg)
+        live = get_live_index()
+        if st.button("🔄 Mettre à jour la Vector DB", use_container_width=True, disabled=live.running()):
+            live.start_ingestion()
+        st.fragment(render_ingestion_status, run_every=1 if live.running() else None)()
+        if RAG_SERVICE_URL:
+            st.caption(f"🌐 Recherche confiée au service RAG ({RAG_SERVICE_URL})")
         
+        st.divider()
+        st.caption("🎯 Filtre de recherche :")
+        type_choice = st.selectbox("Type d'entité", ["Tous", "hero", "movie", "vilain"])
+        entity_choice = st.text_input("Entité (ex : thor, iron_man)", "").strip().lower()
+        filters = {}
+        if type_choice != "Tous":
+            filters["entity_type"] = type_choice
+        if entity_choice:
+            filters["entity"] = entity_choice.replace(" ", "_")
+
+        st.divider()
+        rerank = st.checkbox("🏅 Reranking cross-encoder (ONNX local)", value=False,
+                             help=f"{RERANK_FETCH_K} candidats notés par {RERANK_MODEL}, les 3 meilleurs vont dans le prompt.")
+        rerank_budget_ms = st.slider("Budget de latence (ms)", 20, 1000, RERANK_BUDGET_MS, step=10, disabled=not rerank)
+
         st.divider()
         if st.button("🗑️ Effacer la conversation", use_container_width=True):
             st.session_state.messages = [SystemMessage(content="Expert Marvel")]
             st.rerun()
             
+        st.divider()
+        cache_stats_box = st.empty()
+
         st.divider()
         st.caption("Documents indexés :")
         if os.path.exists(TRACKING_FILE):
@@ -162,9 +741,9 @@ def main():
     if "messages" not in st.session_state:
         st.session_state.messages = [SystemMessage(content="Expert Marvel")]
 
-    # Chargement unique de la DB
-    if "vector_db" not in st.session_state:
-        st.session_state.vector_db = load_vector_db()
+    # Version courante de l'index, lue à chaque exécution : une ingestion terminée est visible partout
+    live.refresh()
+    _, resources = live.current()
 
     # Affichage
     for msg in st.session_state.messages:
@@ -181,18 +760,22 @@ def main():
         st.session_state.messages.append(HumanMessage(content=prompt))
 
         with st.chat_message("assistant"):
-            if st.session_state.vector_db is None:
-                # Tentative de rechargement au cas où l'index vient d'être créé
-                st.session_state.vector_db = load_vector_db()
+            if resources["vector_db"] is None and os.path.exists(os.path.join(published_dir(), "index.faiss")):
+                # Index créé entre-temps (par B02a par exemple) : publication de cette version
+                live.swap()
+                _, resources = live.current()
 
-            if st.session_state.vector_db is None:
+            if resources["vector_db"] is None:
                 st.warning("La base de données vectorielle est vide. Cliquez sur 'Mettre à jour' dans la barre latérale.")
             else:
                 placeholder = st.empty()
                 full_response = ""
                 
                 llm = get_llm()
-                stream, sources = get_rag_response_stream(llm, st.session_state.vector_db, st.session_state.messages)
+                stream, sources = get_rag_response_stream(llm, resources["vector_db"], st.session_state.messages,
+                                                           resources["bm25_index"], resources["shards"], filters,
+                                                           get_answer_cache(), get_reranker() if rerank else None,
+                                                           rerank_budget_ms)
                 
                 for chunk in stream:
                     full_response += chunk.content
@@ -208,5 +791,8 @@ def main():
 
                 st.session_state.messages.append(AIMessage(content=full_response))
 
+    # Statistiques affichées après la réponse : elles incluent la question qui vient d'être traitée
+    render_cache_stats(cache_stats_box, rerank)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,290 @@
+import os
+import json
+import math
+import time
+import argparse
+import tempfile
+import statistics
+import faiss
+import numpy as np
+import psutil
+from concurrent.futures import ThreadPoolExecutor
+from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+from langchain_community.vectorstores import FAISS
+from rag_common import RERANK_BUDGET_MS, RERANK_MODEL, BM25Index, CrossEncoderReranker, load_mmap_vector_db
+
+# ==============================================================================
+# Demo LLM - Phase B : Étape 2d : Benchmark de la Recherche Vectorielle
+# ==============================================================================
+# ASPECT CLÉ : Un index approximatif (HNSW, IVF-PQ) répond plus vite qu'un index
+# plat exact, mais peut "rater" certains voisins. Ce script mesure le compromis
+# sur les vecteurs réels de la base Marvel :
+#   - recall@k : part des k voisins exacts (index plat) retrouvés
+#   - latence p50 / p99 d'une requête
+#   - taille de l'index sur disque et en mémoire
+# Mode "hybrid" : surcoût de la recherche hybride FAISS + BM25 (B02b/B02c) par
+# rapport à la recherche vectorielle seule.
+# Mode "rerank" : coût du cross-encoder selon le nombre de candidats, et qualité
+# du contexte (chunks issus des fiches attendues) avec / sans reranking.
+# Questions et fiches attendues : data/retrieval_gold_set.json, le jeu de B02g.
+# ==============================================================================
+# python B02d_benchmark_retrieval.py --k 3
+# python B02d_benchmark_retrieval.py --mode hybrid
+# python B02d_benchmark_retrieval.py --mode rerank
+
+INDEX_DIR = os.path.join("data", "faiss_index")
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+BM25_FILE = "bm25.sqlite"
+SEARCH_POOL = ThreadPoolExecutor(max_workers=2)
+RERANK_FETCH_K = 20
+# Questions de référence et fiches sources attendues (même fichier que B02g)
+GOLD_SET_FILE = os.path.join("data", "retrieval_gold_set.json")
+
+# ------------------------------------------------------------------------------
+# SECTION 1 : CONSTRUCTION ET MESURE DES INDEX
+# ------------------------------------------------------------------------------
+
+def load_corpus_vectors(index_dir):
+    """Récupère les vecteurs exacts de l'index B02a (plat ou HNSW, dont le stockage est plat)."""
+    index = faiss.read_index(os.path.join(index_dir, "index.faiss"))
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if not isinstance(index, faiss.IndexFlat):
+        raise ValueError("Index IVF-PQ compressé : reconstruisez d'abord avec B02a --index-type flat.")
+    return index.reconstruct_n(0, index.ntotal)
+
+def build_index(vectors, index_type, param=None):
+    """Mêmes réglages que B02a ; `param` = efSearch (HNSW) ou nprobe (IVF-PQ)."""
+    n, d = vectors.shape
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(d)
+        index.add(vectors)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, 32)
+        index.hnsw.efConstruction = 200
+        index.add(vectors)
+        index.hnsw.efSearch = param or 64
+    else:
+        nlist = max(1, min(4096, int(4 * math.sqrt(n))))
+        pq_m = next(m for m in (48, 32, 24, 16, 8, 4, 2, 1) if d % m == 0)
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(d), d, nlist, pq_m, 8)
+        index.train(vectors)
+        index.add(vectors)
+        index.nprobe = min(nlist, param or 16)
+    return index
+
+def measure_sizes(index):
+    """Taille sur disque (fichier écrit) et en mémoire (RSS ajouté par un chargement complet), en Mo."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.faiss")
+        faiss.write_index(index, path)
+        disk_mb = os.path.getsize(path) / (1024 * 1024)
+        process = psutil.Process()
+        rss_before = process.memory_info().rss
+        loaded = faiss.read_index(path)
+        ram_mb = (process.memory_info().rss - rss_before) / (1024 * 1024)
+        del loaded
+    return disk_mb, max(ram_mb, 0.0)
+
+def measure_search(index, queries, k, repeats):
+    """Latences (ms) d'une requête unitaire et résultats top-k."""
+    timings = []
+    for _ in range(repeats):
+        for q in queries:
+            start = time.perf_counter()
+            index.search(q.reshape(1, -1), k)
+            timings.append((time.perf_counter() - start) * 1000)
+    _, ids = index.search(queries, k)
+    return timings, ids
+
+def recall_at_k(exact_ids, approx_ids):
+    """Part moyenne des voisins exacts retrouvés par l'index approximatif."""
+    hits = [len(set(e) & set(a)) / len(e) for e, a in zip(exact_ids.tolist(), approx_ids.tolist())]
+    return statistics.mean(hits)
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+# --- Recherche hybride (copie de B02b) ---
+
+def published_dir(index_dir):
+    """Dossier de la version publiée par B02a (pointeur published.json) ; index à plat historique : la racine."""
+    path = os.path.join(index_dir, "published.json")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            marker = json.load(f)
+        if marker.get("path"):
+            return os.path.join(index_dir, marker["path"])
+    return index_dir
+
+def load_vector_db(index_dir, embeddings):
+    """Charge l'index comme le font B02b/B02c (mmap si manifeste, sinon LangChain)."""
+    if os.path.exists(os.path.join(index_dir, "manifest.json")):
+        return load_mmap_vector_db(index_dir, embeddings)
+    return FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+
+def hybrid_search(vector_db, bm25_index, query, k=3, candidates=10, rrf_k=60):
+    """FAISS et BM25 en parallèle, fusion Reciprocal Rank Fusion."""
+    vector_future = SEARCH_POOL.submit(vector_db.similarity_search, query, candidates)
+    lexical_docs = bm25_index.search(query, candidates)
+    vector_docs = vector_future.result()
+    scores, docs = {}, {}
+    for ranking in (vector_docs, lexical_docs):
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+def time_calls(fn, questions, repeats):
+    """Latences (ms) de fn(question) pour chaque question, `repeats` fois."""
+    timings = []
+    for _ in range(repeats):
+        for q in questions:
+            start = time.perf_counter()
+            fn(q)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+# ------------------------------------------------------------------------------
+# SECTION 2 : EXÉCUTION DU BENCHMARK (Terminal)
+# ------------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark recall / latence des types d'index FAISS")
+    parser.add_argument("--mode", choices=["index-types", "hybrid", "rerank"], default="index-types",
+                        help="Comparer les types d'index FAISS, le surcoût de la recherche hybride BM25 ou le reranking")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="Index B02a dont on réutilise les vecteurs")
+    parser.add_argument("--k", type=int, default=3, help="Nombre de voisins (comme similarity_search(k=3))")
+    parser.add_argument("--repeats", type=int, default=20, help="Répétitions de chaque requête pour la latence")
+    parser.add_argument("--gold-set", default=GOLD_SET_FILE, help="Questions et fiches sources attendues (JSON)")
+    return parser.parse_args()
+
+def load_gold_set(path):
+    """Jeu de référence de B02g : [{"question": ..., "expected_sources": [...]}]."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def run_hybrid_benchmark(args, questions):
+    """Vectoriel seul vs BM25 seul vs hybride (les deux en parallèle + RRF), sur l'index B02a réel."""
+    print("--- Demo LLM - B02d : Benchmark Vectoriel vs Hybride (FAISS + BM25) ---")
+    bm25_path = os.path.join(args.index_dir, BM25_FILE)
+    if not os.path.exists(bm25_path):
+        print(f"[Erreur] Index BM25 introuvable ({bm25_path}). Relancez B02a.")
+        return
+    vector_db = load_vector_db(args.index_dir, FastEmbedEmbeddings(model_name=EMBEDDING_MODEL))
+    bm25_index = BM25Index(bm25_path, read_only=True)
+    vector_db.similarity_search(questions[0], k=args.k)  # préchauffage du modèle
+
+    results = {
+        "Vectoriel": time_calls(lambda q: vector_db.similarity_search(q, k=args.k), questions, args.repeats),
+        "BM25": time_calls(lambda q: bm25_index.search(q, args.k), questions, args.repeats),
+        "Hybride": time_calls(lambda q: hybrid_search(vector_db, bm25_index, q, k=args.k), questions, args.repeats),
+    }
+    print(f"\n{'Recherche':<12}{'p50 (ms)':>10}{'p99 (ms)':>10}{'Moyenne (ms)':>14}")
+    for label, timings in results.items():
+        print(f"{label:<12}{percentile(timings, 50):>10.2f}{percentile(timings, 99):>10.2f}{statistics.mean(timings):>14.2f}")
+    added = statistics.mean(results["Hybride"]) - statistics.mean(results["Vectoriel"])
+    print(f"\n⏱️ Surcoût moyen de l'hybride : {added:+.2f} ms par question")
+
+    changed = 0
+    for q in questions:
+        vector_ids = [d.id for d in vector_db.similarity_search(q, k=args.k)]
+        hybrid_ids = [d.id for d in hybrid_search(vector_db, bm25_index, q, k=args.k)]
+        changed += len(set(hybrid_ids) - set(vector_ids))
+    print(f"🔀 {changed} chunk(s) sur {len(questions) * args.k} apportés par BM25 dans le top-{args.k}")
+
+def context_quality(questions_docs, expected_sources):
+    """Précision du contexte : part des chunks issus des fiches attendues, et part des top-1 corrects."""
+    precisions, top1 = [], []
+    for q, docs in questions_docs:
+        sources = [os.path.basename(d.metadata.get("source", (d.id or "").split("::")[0])) for d in docs]
+        precisions.append(sum(s in expected_sources[q] for s in sources) / len(sources) if sources else 0.0)
+        top1.append(bool(sources) and sources[0] in expected_sources[q])
+    return statistics.mean(precisions), statistics.mean(top1)
+
+def run_rerank_benchmark(args, gold_set):
+    """Coût du cross-encoder par nombre de candidats, puis qualité du contexte top-k avec / sans reranking."""
+    questions = [item["question"] for item in gold_set]
+    expected_sources = {item["question"]: set(item["expected_sources"]) for item in gold_set}
+    print("--- Demo LLM - B02d : Benchmark du Reranking (cross-encoder ONNX) ---")
+    vector_db = load_vector_db(args.index_dir, FastEmbedEmbeddings(model_name=EMBEDDING_MODEL))
+    bm25_path = os.path.join(args.index_dir, BM25_FILE)
+    bm25_index = BM25Index(bm25_path, read_only=True) if os.path.exists(bm25_path) else None
+    print(f"[Info] Chargement du cross-encoder {RERANK_MODEL}...")
+    reranker = CrossEncoderReranker()
+
+    def retrieve(q, k):
+        if bm25_index is None:
+            return vector_db.similarity_search(q, k=k)
+        return hybrid_search(vector_db, bm25_index, q, k=k, candidates=max(10, k))
+
+    candidates = {q: retrieve(q, 50) for q in questions}
+    print(f"\n{'Candidats':<11}{'p50 (ms)':>10}{'p99 (ms)':>10}{'ms/candidat':>13}")
+    for count in (5, 10, 20, 50):
+        timings = time_calls(lambda q: reranker.rerank(q, candidates[q][:count], args.k, budget_ms=math.inf), questions, args.repeats)
+        print(f"{count:<11}{percentile(timings, 50):>10.2f}{percentile(timings, 99):>10.2f}{statistics.mean(timings) / count:>13.3f}")
+
+    baseline = [(q, retrieve(q, args.k)) for q in questions]
+    reranked = [(q, reranker.rerank(q, candidates[q][:RERANK_FETCH_K], args.k, budget_ms=math.inf)) for q in questions]
+    reranker.skipped = 0
+    budgeted = []
+    for q in questions:
+        start = time.perf_counter()
+        docs = retrieve(q, RERANK_FETCH_K)
+        budgeted.append((q, reranker.rerank(q, docs, args.k, elapsed_ms=(time.perf_counter() - start) * 1000)))
+    print(f"\n{'Pipeline':<28}{'Précision@' + str(args.k):>13}{'Top-1 correct':>15}")
+    for label, results in ((f"Sans reranking (k={args.k})", baseline),
+                           (f"Rerank {RERANK_FETCH_K} -> {args.k}", reranked),
+                           (f"Rerank, budget {RERANK_BUDGET_MS} ms", budgeted)):
+        precision, top1 = context_quality(results, expected_sources)
+        print(f"{label:<28}{precision:>13.2f}{top1:>15.2f}")
+    print(f"\n⏱️ Avec budget : {reranker.skipped}/{len(questions)} question(s) sans reranking (budget épuisé)")
+
+def main():
+    args = parse_args()
+    args.index_dir = published_dir(args.index_dir)
+    gold_set = load_gold_set(args.gold_set)
+    questions = [item["question"] for item in gold_set]
+    if args.mode == "hybrid":
+        run_hybrid_benchmark(args, questions)
+        return
+    if args.mode == "rerank":
+        run_rerank_benchmark(args, gold_set)
+        return
+    print("--- Demo LLM - B02d : Benchmark Flat vs HNSW vs IVF-PQ ---")
+
+    vectors = load_corpus_vectors(args.index_dir)
+    print(f"[Info] {vectors.shape[0]} vecteurs de dimension {vectors.shape[1]} chargés depuis {args.index_dir}")
+
+    print(f"[Info] Embedding des {len(questions)} questions de test ({args.gold_set}, FastEmbed)...")
+    embeddings = FastEmbedEmbeddings(model_name=EMBEDDING_MODEL)
+    queries = np.asarray([embeddings.embed_query(q) for q in questions], dtype=np.float32)
+
+    # Référence exacte
+    flat = build_index(vectors, "flat")
+    _, exact_ids = flat.search(queries, args.k)
+
+    # Chaque configuration : (type, paramètre de recherche)
+    configs = [("flat", None), ("hnsw", 16), ("hnsw", 64), ("hnsw", 256)]
+    if vectors.shape[0] >= 256:
+        configs += [("ivfpq", 4), ("ivfpq", 16), ("ivfpq", 64)]
+    else:
+        print("[Attention] Moins de 256 vecteurs : IVF-PQ ignoré (entraînement impossible).")
+
+    print(f"\n{'Index':<14}{'Build (s)':>10}{'Recall@' + str(args.k):>11}{'p50 (ms)':>10}{'p99 (ms)':>10}{'Disque (Mo)':>13}{'RAM (Mo)':>10}")
+    for index_type, param in configs:
+        start = time.perf_counter()
+        index = build_index(vectors, index_type, param)
+        build_s = time.perf_counter() - start
+        timings, ids = measure_search(index, queries, args.k, args.repeats)
+        disk_mb, ram_mb = measure_sizes(index)
+        label = index_type if param is None else f"{index_type}({param})"
+        print(f"{label:<14}{build_s:>10.2f}{recall_at_k(exact_ids, ids):>11.3f}"
+              f"{percentile(timings, 50):>10.3f}{percentile(timings, 99):>10.3f}{disk_mb:>13.2f}{ram_mb:>10.2f}")
+
+    print("\n💡 hnsw(x) = efSearch, ivfpq(x) = nprobe. Plus la valeur est haute, meilleur est le recall, plus la requête est lente.")
+
+if __name__ == "__main__":
+    main()
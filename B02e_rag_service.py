@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import argparse
+import numpy as np
+from contextlib import asynccontextmanager
+from typing import Optional
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from pydantic import BaseModel
+from langchain_openai import ChatOpenAI
+from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+from langchain_community.vectorstores import FAISS
+from langchain_core.messages import HumanMessage, SystemMessage
+from rag_common import BM25Index, entity_from_filename, load_mmap_vector_db
+
+# ==============================================================================
+# Demo LLM - Phase B : Étape 2e : Service RAG avec Micro-Batching (API REST)
+# ==============================================================================
+# ASPECT CLÉ : Un seul processus garde en mémoire FastEmbed + FAISS + BM25 et
+# répond à toutes les démos (B02c, B03...). Les questions qui arrivent en même
+# temps sont regroupées : UN appel FastEmbed sur la liste des questions et UNE
+# recherche FAISS sur la matrice des vecteurs, au lieu d'un appel par question.
+# La fenêtre d'attente (--max-wait-ms) borne la latence ajoutée par le regroupement.
+# ASPECT CLÉ 2 : Le service suit le pointeur published.json de B02a / B02c : une
+# nouvelle version est chargée entre deux lots, sans redémarrage.
+# ==============================================================================
+# python B02e_rag_service.py --max-wait-ms 5 --max-batch 64
+# Puis : python B02f_rag_load_test.py
+
+INDEX_DIR = os.path.join("data", "faiss_index")
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+BM25_FILE = "bm25.sqlite"
+PUBLISHED_FILE = "published.json"
+# Candidats par question pour la fusion BM25 (et marge de post-filtrage quand un filtre est demandé)
+CANDIDATES = 10
+FILTER_FETCH_K = 200
+# Intervalle minimal entre deux lectures du pointeur published.json (secondes)
+RELOAD_CHECK_INTERVAL = 1.0
+
+# ------------------------------------------------------------------------------
+# SECTION 1 : LOGIQUE COEUR (Chargement, Recherche par lots, Micro-Batching)
+# ------------------------------------------------------------------------------
+
+def read_published_marker(index_dir):
+    """Pointeur published.json écrit par B02a / B02c en dernier (None si rien n'a été publié)."""
+    path = os.path.join(index_dir, PUBLISHED_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_vector_db(index_dir, embeddings):
+    """Même chargement que B02b : format mmap si manifeste, sinon LangChain (pickle)."""
+    if os.path.exists(os.path.join(index_dir, "manifest.json")):
+        return load_mmap_vector_db(index_dir, embeddings)
+    return FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+
+def matches(doc, filters):
+    entity_type, entity = entity_from_filename(doc.id.split("::")[0]) if doc.id else ("autre", "")
+    entity_type = doc.metadata.get("entity_type", entity_type)
+    entity = doc.metadata.get("entity", entity)
+    return filters.get("entity_type", entity_type) == entity_type and filters.get("entity", entity) == entity
+
+def rrf_merge(rankings, k, rrf_k=60):
+    """Reciprocal Rank Fusion (cf. B02b)."""
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.id or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+class RagEngine:
+    """
+    Ressources résidentes du service + recherche d'un LOT de questions.
+    ASPECT CLÉ : Entre deux lots, une nouvelle version publiée (B02a, B02c, surveillance B02h)
+    est chargée à chaud : le service suit les ingestions sans redémarrage.
+    """
+    def __init__(self, index_dir=INDEX_DIR):
+        load_dotenv()
+        print("[SERVICE] 🔢 Chargement de FastEmbed et de l'index FAISS...")
+        self.index_dir = index_dir
+        self.embeddings = FastEmbedEmbeddings(model_name=EMBEDDING_MODEL)
+        self.lock = threading.Lock()
+        self.checked_at = time.monotonic()
+        self.load(read_published_marker(index_dir))
+        self.llm = ChatOpenAI(
+            model=os.getenv("LLM_MODEL"),
+            api_key=os.getenv("LLM_API_KEY"),
+            base_url=os.getenv("LLM_BASE_URL"),
+            temperature=0
+        )
+
+    def load(self, marker):
+        """FAISS et BM25 de la version désignée par le pointeur (index à plat historique : la racine)."""
+        index_dir = os.path.join(self.index_dir, marker["path"]) if marker and marker.get("path") else self.index_dir
+        self.vector_db = load_vector_db(index_dir, self.embeddings)
+        bm25_path = os.path.join(index_dir, BM25_FILE)
+        self.bm25 = BM25Index(bm25_path, read_only=True) if os.path.exists(bm25_path) else None
+        self.published = marker["version"] if marker else None
+        print(f"[SERVICE] ✅ {self.vector_db.index.ntotal} vecteurs | BM25 : {'oui' if self.bm25 else 'non'} "
+              f"| version {self.published or 'non versionnée'}")
+
+    def current(self):
+        """(FAISS, BM25) de la version publiée ; le pointeur est relu au plus une fois par seconde."""
+        with self.lock:
+            if time.monotonic() - self.checked_at >= RELOAD_CHECK_INTERVAL:
+                self.checked_at = time.monotonic()
+                marker = read_published_marker(self.index_dir)
+                if marker and marker["version"] != self.published:
+                    print(f"[SERVICE] 🔄 Nouvelle version publiée ({marker['version']}) : rechargement...")
+                    self.load(marker)
+            return self.vector_db, self.bm25
+
+    def search_batch(self, queries, ks, filters_list):
+        """
+        ASPECT CLÉ : Recherche groupée.
+        1. UN appel FastEmbed pour toutes les questions du lot (all-MiniLM n'a pas de préfixe de requête)
+        2. UNE recherche FAISS sur la matrice (n_questions x dim)
+        3. Par question : post-filtrage éventuel, puis fusion RRF avec BM25 (filtré dans la requête)
+        Tout le lot est servi par la même version de l'index.
+        """
+        vector_db, bm25 = self.current()
+        vectors = np.asarray(self.embeddings.embed_documents(queries), dtype=np.float32)
+        fetch_k = FILTER_FETCH_K if any(filters_list) else CANDIDATES
+        _, ids = vector_db.index.search(vectors, min(max(max(ks), fetch_k), vector_db.index.ntotal))
+
+        results = []
+        for query, k, filters, row_ids in zip(queries, ks, filters_list, ids):
+            vector_docs = [vector_db.docstore.search(vector_db.index_to_docstore_id[i]) for i in row_ids if i != -1]
+            if filters:
+                vector_docs = [d for d in vector_docs if matches(d, filters)]
+            vector_docs = vector_docs[:max(k, CANDIDATES)]
+            if bm25 is None:
+                results.append(vector_docs[:k])
+                continue
+            results.append(rrf_merge([vector_docs, bm25.search(query, CANDIDATES, filters)], k))
+        return results
+
+class MicroBatcher:
+    """
+    ASPECT CLÉ : Micro-batching dynamique.
+    La première question en attente ouvre une fenêtre de `max_wait_ms` ; toutes les
+    questions arrivées pendant la fenêtre (jusqu'à `max_batch`) partent dans le même lot.
+    Seul, un utilisateur attend au plus max_wait_ms de plus ; à 100 utilisateurs, le coût
+    fixe d'un appel FastEmbed / FAISS est partagé par tout le lot.
+    """
+    def __init__(self, engine, max_batch=64, max_wait_ms=5.0):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.queries = 0
+
+    async def submit(self, query, k=3, filters=None):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, k, filters or {}, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            queries, ks, filters_list, futures = zip(*batch)
+            try:
+                # Le calcul part dans un thread : la boucle continue d'accepter des requêtes (prochain lot)
+                results = await asyncio.to_thread(self.engine.search_batch, list(queries), list(ks), list(filters_list))
+                for future, docs in zip(futures, results):
+                    future.set_result(docs)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            self.batches += 1
+            self.queries += len(batch)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else 0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000
+        }
+
+def build_rag_messages(query, docs):
+    """Même prompt que perform_rag_query (B02b)."""
+    context = "\n\n---\n\n".join([doc.page_content for doc in docs])
+    system_prompt = f"""Tu es un assistant expert Marvel MCU.
+    Réponds à la question en utilisant UNIQUEMENT le contexte ci-dessous.
+    Si l'information n'est pas dans le contexte, dis précisément : "Désolé, je ne trouve pas cette information dans ma base Marvel."
+
+    CONTEXTE :
+    {context}"""
+    return [SystemMessage(content=system_prompt), HumanMessage(content=query)]
+
+def serialize(docs):
+    return [{"id": d.id, "page_content": d.page_content, "metadata": d.metadata} for d in docs]
+
+# ------------------------------------------------------------------------------
+# SECTION 2 : API REST (FastAPI)
+# ------------------------------------------------------------------------------
+
+class SearchRequest(BaseModel):
+    query: str
+    k: int = 3
+    filters: Optional[dict] = None
+    # False : contourne le micro-batching (sert de référence au test de charge B02f)
+    batch: bool = True
+
+SERVICE_CONFIG = {"max_batch": 64, "max_wait_ms": 5.0}
+
+@asynccontextmanager
+async def lifespan(app):
+    engine = RagEngine()
+    app.state.engine = engine
+    app.state.batcher = MicroBatcher(engine, SERVICE_CONFIG["max_batch"], SERVICE_CONFIG["max_wait_ms"])
+    worker = asyncio.create_task(app.state.batcher.run())
+    yield
+    worker.cancel()
+
+app = FastAPI(
+    title="Marvel RAG Service",
+    description="Recherche RAG partagée (FastEmbed + FAISS + BM25) avec micro-batching des requêtes.",
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+async def retrieve(request):
+    if request.batch:
+        return await app.state.batcher.submit(request.query, request.k, request.filters)
+    results = await asyncio.to_thread(app.state.engine.search_batch, [request.query], [request.k], [request.filters or {}])
+    return results[0]
+
+@app.post("/search")
+async def search(request: SearchRequest):
+    """Recherche seule (sans LLM) : les chunks les plus pertinents."""
+    start = time.perf_counter()
+    docs = await retrieve(request)
+    return {"documents": serialize(docs), "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+@app.post("/query")
+async def query(request: SearchRequest):
+    """Recherche groupée + génération de la réponse (l'appel LLM, lui, reste individuel)."""
+    docs = await retrieve(request)
+    response = await app.state.engine.llm.ainvoke(build_rag_messages(request.query, docs))
+    return {"answer": response.content, "documents": serialize(docs)}
+
+@app.get("/stats")
+def stats():
+    return app.state.batcher.stats()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Service RAG partagé avec micro-batching")
+    parser.add_argument("--port", type=int, default=8020)
+    parser.add_argument("--max-batch", type=int, default=64, help="Taille maximale d'un lot de questions")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Attente maximale avant d'envoyer un lot incomplet")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    import uvicorn
+    args = parse_args()
+    SERVICE_CONFIG.update({"max_batch": args.max_batch, "max_wait_ms": args.max_wait_ms})
+    print(f"\n[SERVEUR] Lancement du service RAG sur http://127.0.0.1:{args.port}")
+    print(f"[SERVEUR] Micro-batching : lots de {args.max_batch} max, fenêtre de {args.max_wait_ms} ms")
+    print(f"[DOCS] La documentation OpenAPI est disponible sur http://127.0.0.1:{args.port}/docs")
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
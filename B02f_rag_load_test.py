@@ -0,0 +1,102 @@
+import time
+import asyncio
+import argparse
+import statistics
+import httpx
+
+# ==============================================================================
+# Demo LLM - Phase B : Étape 2f : Test de Charge du Service RAG (B02e)
+# ==============================================================================
+# ASPECT CLÉ : Simule 1, 10 puis 100 utilisateurs simultanés qui interrogent
+# /search en boucle, AVEC puis SANS micro-batching, et compare le débit
+# (questions/s) et la latence. L'appel LLM est exclu : on mesure la recherche.
+# ==============================================================================
+# 1. python B02e_rag_service.py
+# 2. python B02f_rag_load_test.py --users 1 10 100 --duration 10
+
+QUESTIONS = [
+    "Qui est Thor ?",
+    "Quelles sont les armes d'Iron Man ?",
+    "Que se passe-t-il dans Avengers: Endgame ?",
+    "Quel est le rôle du Tesseract ?",
+    "Pourquoi les Avengers se divisent-ils dans Civil War ?",
+    "Qui est Thanos et que veut-il ?",
+    "Comment Bruce Banner devient-il Hulk ?",
+    "Quel est le passé de Black Widow ?",
+    "Qui est Venom ?",
+    "Que se passe-t-il sur Sakaar dans Thor: Ragnarok ?",
+]
+
+# ------------------------------------------------------------------------------
+# SECTION 1 : SIMULATION DES UTILISATEURS
+# ------------------------------------------------------------------------------
+
+async def user_loop(client, url, user_id, batch, stop_at, latencies, errors):
+    """Un utilisateur enchaîne ses questions jusqu'à la fin du test."""
+    i = user_id
+    while time.perf_counter() < stop_at:
+        payload = {"query": QUESTIONS[i % len(QUESTIONS)], "k": 3, "batch": batch}
+        start = time.perf_counter()
+        try:
+            response = await client.post(f"{url}/search", json=payload)
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+        except httpx.HTTPError:
+            errors.append(1)
+        i += 1
+
+async def run_scenario(url, users, batch, duration):
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        stop_at = time.perf_counter() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*(user_loop(client, url, u, batch, stop_at, latencies, errors) for u in range(users)))
+        elapsed = time.perf_counter() - start
+    ordered = sorted(latencies) or [0.0]
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(ordered),
+        "p99": ordered[min(len(ordered) - 1, int(round(0.99 * (len(ordered) - 1))))],
+        "errors": len(errors)
+    }
+
+# ------------------------------------------------------------------------------
+# SECTION 2 : EXÉCUTION DU TEST (Terminal)
+# ------------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Test de charge du service RAG B02e")
+    parser.add_argument("--url", default="http://127.0.0.1:8020")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 100], help="Niveaux de concurrence à tester")
+    parser.add_argument("--duration", type=float, default=10.0, help="Durée de chaque scénario (secondes)")
+    return parser.parse_args()
+
+async def main():
+    print("--- Demo LLM - B02f : Test de charge du service RAG (micro-batching) ---")
+    args = parse_args()
+    try:
+        async with httpx.AsyncClient() as client:
+            (await client.get(f"{args.url}/stats")).raise_for_status()
+    except httpx.HTTPError:
+        print(f"[Erreur] Service injoignable sur {args.url}. Lancez d'abord B02e_rag_service.py.")
+        return
+
+    print(f"\n{'Utilisateurs':<14}{'Mode':<12}{'Débit (q/s)':>12}{'p50 (ms)':>10}{'p99 (ms)':>10}{'Erreurs':>9}")
+    for users in args.users:
+        results = {}
+        for batch in (False, True):
+            results[batch] = await run_scenario(args.url, users, batch, args.duration)
+            r = results[batch]
+            mode = "batching" if batch else "unitaire"
+            print(f"{users:<14}{mode:<12}{r['throughput']:>12.1f}{r['p50']:>10.1f}{r['p99']:>10.1f}{r['errors']:>9}")
+        if results[False]["throughput"]:
+            print(f"{'':<14}⚡ gain de débit : x{results[True]['throughput'] / results[False]['throughput']:.1f}")
+
+    async with httpx.AsyncClient() as client:
+        stats = (await client.get(f"{args.url}/stats")).json()
+    print(f"\n[Service] {stats['batches']} lots pour {stats['queries']} questions "
+          f"(taille moyenne {stats['avg_batch_size']}, fenêtre {stats['max_wait_ms']} ms)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
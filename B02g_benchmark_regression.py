@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import itertools
+import statistics
+import faiss
+import numpy as np
+import psutil
+from datetime import datetime
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+
+# ==============================================================================
+# Demo LLM - Phase B : Étape 2g : Banc d'Essai et Non-Régression de la Recherche
+# ==============================================================================
+# ASPECT CLÉ : Mesurer AVANT de changer le découpage, le modèle d'embedding ou le
+# type d'index. Le corpus (data/source_files) est ré-indexé en mémoire pour chaque
+# combinaison de paramètres, puis interrogé avec un jeu de questions "or" dont on
+# connaît les fiches sources attendues :
+#   - recall@k : part des fiches attendues présentes dans les k premiers chunks
+#   - MRR      : 1 / rang du premier chunk issu d'une fiche attendue
+#   - latences : embedding (corpus et question), recherche p50 / p95 / p99
+#   - coût     : temps de construction, taille de l'index, mémoire
+# Les résultats partent en JSON ; --baseline compare avec un run précédent et
+# échoue (code 1) si recall ou MRR reculent au-delà de --tolerance.
+# ==============================================================================
+# python B02g_benchmark_regression.py
+# python B02g_benchmark_regression.py --chunk-sizes 500 1000 1500 --chunk-overlaps 0 200 --index-types flat hnsw
+# python B02g_benchmark_regression.py --baseline data/benchmarks/retrieval_20260101_120000.json
+
+SOURCE_DIR = os.path.join("data", "source_files")
+GOLD_SET_FILE = os.path.join("data", "retrieval_gold_set.json")
+RESULTS_DIR = os.path.join("data", "benchmarks")
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# ------------------------------------------------------------------------------
+# SECTION 1 : CONSTRUCTION DES INDEX (mêmes réglages que B02a)
+# ------------------------------------------------------------------------------
+
+def load_sources(source_dir):
+    """{nom de fichier: texte} pour chaque fiche .txt du corpus."""
+    sources = {}
+    for filename in sorted(f for f in os.listdir(source_dir) if f.endswith(".txt")):
+        with open(os.path.join(source_dir, filename), "r", encoding="utf-8") as f:
+            sources[filename] = f.read()
+    return sources
+
+def split_corpus(sources, chunk_size, chunk_overlap):
+    """Découpage identique à B02a (mêmes séparateurs) ; renvoie les chunks et leur fiche d'origine."""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    chunks, chunk_sources = [], []
+    for filename, text in sources.items():
+        for chunk in text_splitter.split_text(text):
+            chunks.append(chunk)
+            chunk_sources.append(filename)
+    return chunks, chunk_sources
+
+def build_index(vectors, index_type):
+    """Mêmes paramètres que B02a (HNSW M=32, IVF-PQ nlist=4*sqrt(n)). Renvoie (index, type effectif)."""
+    n, d = vectors.shape
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, 32)
+        index.hnsw.efConstruction = 200
+        index.hnsw.efSearch = 64
+        index.add(vectors)
+        return index, "hnsw"
+    if index_type == "ivfpq" and n >= 256:
+        nlist = max(1, min(4096, int(4 * math.sqrt(n))))
+        pq_m = next(m for m in (48, 32, 24, 16, 8, 4, 2, 1) if d % m == 0)
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(d), d, nlist, pq_m, 8)
+        index.train(vectors)
+        index.add(vectors)
+        index.nprobe = min(nlist, 16)
+        return index, "ivfpq"
+    # Comme B02a : moins de 256 vecteurs ne suffisent pas à entraîner IVF-PQ, on reste à plat
+    index = faiss.IndexFlatL2(d)
+    index.add(vectors)
+    return index, "flat"
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def rss_mb():
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+# ------------------------------------------------------------------------------
+# SECTION 2 : MÉTRIQUES
+# ------------------------------------------------------------------------------
+
+def evaluate(index, query_vectors, chunk_sources, gold_set, ks, repeats):
+    """recall@k pour chaque k, MRR sur les max(ks) premiers chunks, et latences de recherche (ms)."""
+    max_k = min(max(ks), index.ntotal)
+    timings = []
+    for _ in range(repeats):
+        for vector in query_vectors:
+            start = time.perf_counter()
+            index.search(vector.reshape(1, -1), max_k)
+            timings.append((time.perf_counter() - start) * 1000)
+    _, ids = index.search(query_vectors, max_k)
+
+    recalls = {k: [] for k in ks}
+    reciprocal_ranks = []
+    for item, row in zip(gold_set, ids.tolist()):
+        expected = set(item["expected_sources"])
+        retrieved = [chunk_sources[i] for i in row if i != -1]
+        for k in ks:
+            recalls[k].append(len(expected & set(retrieved[:k])) / len(expected))
+        rank = next((r for r, source in enumerate(retrieved, start=1) if source in expected), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    return {
+        **{f"recall@{k}": round(statistics.mean(values), 4) for k, values in recalls.items()},
+        "mrr": round(statistics.mean(reciprocal_ranks), 4),
+        "search_p50_ms": round(percentile(timings, 50), 4),
+        "search_p95_ms": round(percentile(timings, 95), 4),
+        "search_p99_ms": round(percentile(timings, 99), 4),
+    }
+
+def run_key(run):
+    return (run["embedding_model"], run["chunk_size"], run["chunk_overlap"], run["index_type"])
+
+def compare_with_baseline(runs, baseline_path, tolerance):
+    """Écarts par configuration commune ; renvoie la liste des régressions de qualité."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {run_key(run): run for run in json.load(f)["runs"]}
+    regressions = []
+    print(f"\n--- Comparaison avec {baseline_path} ---")
+    for run in runs:
+        previous = baseline.get(run_key(run))
+        if previous is None:
+            continue
+        quality = [m for m in run if m.startswith("recall@") or m == "mrr"]
+        deltas = {m: run[m] - previous[m] for m in quality if m in previous}
+        label = f"{run['embedding_model'].split('/')[-1]} | {run['chunk_size']}/{run['chunk_overlap']} | {run['index_type']}"
+        changes = "  ".join(f"{m} {d:+.3f}" for m, d in deltas.items())
+        latency = run["search_p50_ms"] - previous["search_p50_ms"]
+        print(f"{label:<44}{changes}  search p50 {latency:+.3f} ms")
+        regressions.extend(f"{label} : {m} {d:+.3f}" for m, d in deltas.items() if d < -tolerance)
+    return regressions
+
+# ------------------------------------------------------------------------------
+# SECTION 3 : EXÉCUTION DU BANC D'ESSAI (Terminal)
+# ------------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Banc d'essai et non-régression de la recherche FAISS")
+    parser.add_argument("--source-dir", default=SOURCE_DIR, help="Corpus à indexer (fiches .txt)")
+    parser.add_argument("--gold-set", default=GOLD_SET_FILE, help="Questions et fiches sources attendues (JSON)")
+    parser.add_argument("--models", nargs="+", default=[EMBEDDING_MODEL], help="Modèles FastEmbed à comparer")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[1000], help="Tailles de chunk (B02a : 1000)")
+    parser.add_argument("--chunk-overlaps", type=int, nargs="+", default=[200], help="Recouvrements (B02a : 200)")
+    parser.add_argument("--index-types", nargs="+", choices=["flat", "hnsw", "ivfpq"], default=["flat", "hnsw", "ivfpq"])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5], help="Valeurs de k pour recall@k")
+    parser.add_argument("--repeats", type=int, default=20, help="Répétitions de chaque requête pour la latence")
+    parser.add_argument("--output", default=None, help="Fichier JSON des résultats (défaut : data/benchmarks/retrieval_<date>.json)")
+    parser.add_argument("--baseline", default=None, help="Run JSON précédent à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Baisse de recall / MRR tolérée avant d'échouer")
+    return parser.parse_args()
+
+def main():
+    print("--- Demo LLM - B02g : Banc d'essai de la recherche (recall, MRR, latences) ---")
+    args = parse_args()
+    sources = load_sources(args.source_dir)
+    with open(args.gold_set, "r", encoding="utf-8") as f:
+        gold_set = json.load(f)
+    questions = [item["question"] for item in gold_set]
+    print(f"[Info] {len(sources)} fiches, {len(gold_set)} questions de référence")
+
+    runs = []
+    header = (f"\n{'Modèle':<22}{'Chunk':>11}{'Index':>7}{'Chunks':>8}{'Build (s)':>11}{'Emb/chunk':>11}"
+              + "".join(f"{'R@' + str(k):>7}" for k in args.k) + f"{'MRR':>7}{'p50':>8}{'p95':>8}{'p99':>8}{'Index (Mo)':>12}")
+    for model_name in args.models:
+        embeddings = FastEmbedEmbeddings(model_name=model_name)
+        embeddings.embed_query(questions[0])  # préchauffage (chargement du modèle ONNX)
+        query_timings, query_vectors = [], []
+        for question in questions:
+            start = time.perf_counter()
+            query_vectors.append(embeddings.embed_query(question))
+            query_timings.append((time.perf_counter() - start) * 1000)
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        print(f"\n[{model_name}] Embedding d'une question : p50 {percentile(query_timings, 50):.2f} ms")
+        print(header)
+
+        for chunk_size, chunk_overlap in itertools.product(args.chunk_sizes, args.chunk_overlaps):
+            if chunk_overlap >= chunk_size:
+                continue
+            chunks, chunk_sources = split_corpus(sources, chunk_size, chunk_overlap)
+            start = time.perf_counter()
+            vectors = np.asarray(embeddings.embed_documents(chunks), dtype=np.float32)
+            embed_s = time.perf_counter() - start
+
+            for index_type in args.index_types:
+                rss_before = rss_mb()
+                start = time.perf_counter()
+                index, effective_type = build_index(vectors, index_type)
+                index_build_s = time.perf_counter() - start
+                run = {
+                    "embedding_model": model_name,
+                    "chunk_size": chunk_size,
+                    "chunk_overlap": chunk_overlap,
+                    "index_type": index_type,
+                    "effective_index_type": effective_type,
+                    "n_chunks": len(chunks),
+                    "embed_corpus_s": round(embed_s, 3),
+                    "embed_per_chunk_ms": round(embed_s * 1000 / len(chunks), 3),
+                    "embed_query_p50_ms": round(percentile(query_timings, 50), 3),
+                    "index_build_s": round(index_build_s, 4),
+                    "build_total_s": round(embed_s + index_build_s, 3),
+                    "index_size_mb": round(faiss.serialize_index(index).nbytes / (1024 * 1024), 3),
+                    "index_rss_mb": round(max(rss_mb() - rss_before, 0.0), 3),
+                    **evaluate(index, query_vectors, chunk_sources, gold_set, args.k, args.repeats),
+                }
+                runs.append(run)
+                label = index_type if effective_type == index_type else f"{index_type}*"
+                print(f"{model_name.split('/')[-1][:21]:<22}{f'{chunk_size}/{chunk_overlap}':>11}{label:>7}{len(chunks):>8}"
+                      f"{run['build_total_s']:>11.2f}{run['embed_per_chunk_ms']:>11.2f}"
+                      + "".join(f"{run[f'recall@{k}']:>7.3f}" for k in args.k)
+                      + f"{run['mrr']:>7.3f}{run['search_p50_ms']:>8.3f}{run['search_p95_ms']:>8.3f}"
+                      f"{run['search_p99_ms']:>8.3f}{run['index_size_mb']:>12.3f}")
+    print("\n💡 Chunk = taille/recouvrement ; * = IVF-PQ impossible (< 256 chunks), index plat utilisé.")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "source_dir": args.source_dir,
+            "n_files": len(sources),
+            "gold_set": args.gold_set,
+            "n_questions": len(gold_set),
+            "repeats": args.repeats,
+            "runs": runs
+        }, f, indent=2, ensure_ascii=False)
+    print(f"[Info] 💾 Résultats enregistrés dans {output}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(runs, args.baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} régression(s) au-delà de {args.tolerance} :")
+            for regression in regressions:
+                print(f"   - {regression}")
+            sys.exit(1)
+        print("\n✅ Aucune régression de recall / MRR.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+from watchdog.events import FileSystemEventHandler
+
+# ==============================================================================
+# Demo LLM - Phase B : Étape 2h : Surveillance du Dossier Source (Ingestion Auto)
+# ==============================================================================
+# ASPECT CLÉ : Un démon surveille data/source_files (inotify sous Linux, FSEvents /
+# ReadDirectoryChangesW ailleurs, scrutation périodique en repli) et lance tout
+# seul l'ingestion incrémentale de B02a quand une fiche .txt apparaît, change ou
+# disparaît.
+# ASPECT CLÉ 2 : Anti-rebond. Une rafale d'événements (copie de milliers de fichiers)
+# donne UNE seule passe d'ingestion : on attend --debounce secondes de calme, sans
+# dépasser --max-delay secondes après le premier événement (fraîcheur garantie
+# même si la copie ne s'arrête jamais). Les événements reçus pendant une passe
+# sont regroupés dans la suivante.
+# ASPECT CLÉ 3 : B02a publie la nouvelle version (marqueur published.json) une fois
+# l'index complet sur disque : B02c et B03 la chargent sans redémarrage.
+# ASPECT CLÉ 4 : Chaque passe transmet à B02a la liste des fichiers touchés (--files) :
+# B02a ne relit et ne hache que ceux-là au lieu de tout le dossier. Le rattrapage
+# initial et les très grosses rafales (> MAX_TARGETED_FILES) gardent le scan complet.
+# B02a, B02c et B02h partagent un verrou fichier (faiss_index.lock) : une seule
+# ingestion écrit l'index à la fois, les autres attendent leur tour.
+# ASPECT CLÉ 5 : Sans --format ni --index-type, B02a conserve le format (pickle / mmap)
+# et le type (flat / HNSW / IVF-PQ) de la version publiée : une passe ne convertit rien.
+# LIMITE : seuls les fichiers touchés sont relus et embeddés, mais chaque passe publie
+# une version complète (index, docstore, BM25 réécrits dans versions/<id>) : le coût
+# d'écriture reste proportionnel au corpus (quelques secondes pour quelques milliers
+# de fiches, davantage au-delà, et un réentraînement complet pour HNSW / IVF-PQ).
+# ==============================================================================
+# python B02h_watch_sources.py
+# python B02h_watch_sources.py --debounce 1 --max-delay 5 -- --workers 8
+# python B02h_watch_sources.py --polling --poll-interval 2
+
+SOURCE_DIR = os.path.join("data", "source_files")
+INDEX_DIR = os.path.join("data", "faiss_index")
+TRACKING_FILE = os.path.join("data", "processed_files.json")
+MAX_TARGETED_FILES = 500
+
+# ------------------------------------------------------------------------------
+# SECTION 1 : COLLECTE DES ÉVÉNEMENTS
+# ------------------------------------------------------------------------------
+
+class ChangeBatcher(FileSystemEventHandler):
+    """
+    Accumule les fichiers .txt touchés depuis la dernière passe.
+    ASPECT CLÉ : Le thread de l'observateur ne fait qu'enregistrer (quelques µs par
+    événement) ; la décision de lancer une passe appartient à la boucle principale.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = set()
+        self.first_event_at = None
+        self.last_event_at = None
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type in ("opened", "closed_no_write"):
+            return
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        names = [os.path.basename(p) for p in paths if p and p.endswith(".txt")]
+        if not names:
+            return
+        now = time.monotonic()
+        with self.lock:
+            self.files.update(names)
+            if self.first_event_at is None:
+                self.first_event_at = now
+            self.last_event_at = now
+
+    def take_ready(self, debounce, max_delay):
+        """Fichiers à ingérer si la rafale est terminée (ou trop ancienne), sinon None."""
+        now = time.monotonic()
+        with self.lock:
+            if self.first_event_at is None:
+                return None
+            if now - self.last_event_at < debounce and now - self.first_event_at < max_delay:
+                return None
+            files, first_event_at = self.files, self.first_event_at
+            self.files, self.first_event_at, self.last_event_at = set(), None, None
+            return files, first_event_at
+
+    def requeue(self, files):
+        """Passe en échec : ses fichiers rejoignent la prochaine rafale."""
+        now = time.monotonic()
+        with self.lock:
+            self.files.update(files)
+            if self.first_event_at is None:
+                self.first_event_at = now
+            self.last_event_at = now
+
+def start_observer(handler, source_dir, polling, poll_interval):
+    """Observateur natif (inotify sous Linux) ; scrutation si demandé ou si le natif est indisponible."""
+    if not polling:
+        try:
+            observer = Observer()
+            observer.schedule(handler, source_dir, recursive=False)
+            observer.start()
+            return observer, type(observer).__name__
+        except OSError as e:
+            # Ex. : limite fs.inotify.max_user_watches atteinte, système de fichiers réseau
+            print(f"[Attention] Observateur natif indisponible ({e}) : repli sur la scrutation.")
+    observer = PollingObserver(timeout=poll_interval)
+    observer.schedule(handler, source_dir, recursive=False)
+    observer.start()
+    return observer, f"PollingObserver ({poll_interval:g} s)"
+
+# ------------------------------------------------------------------------------
+# SECTION 2 : PASSES D'INGESTION
+# ------------------------------------------------------------------------------
+
+def run_ingestion(args, files=None):
+    """
+    Une passe incrémentale de B02a (journal, reprise, publication) dans un processus séparé.
+    files : fichiers touchés par la rafale (scan ciblé) ; None ou rafale trop grosse : scan complet.
+    """
+    command = [sys.executable, "B02a_create_vector_db.py", "--source-dir", args.source_dir,
+               "--index-dir", args.index_dir, "--tracking-file", args.tracking_file] + args.b02a_args
+    if files and len(files) <= MAX_TARGETED_FILES:
+        command += ["--files", *sorted(files)]
+    start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    for line in result.stdout.splitlines():
+        if line.startswith(("[Info]", "[Reprise]", "[Perf]", "[Attention]")):
+            print(f"   {line}")
+    if result.returncode != 0:
+        print(f"[Erreur] B02a a échoué (code {result.returncode}) :\n{result.stderr[-2000:]}")
+    return result.returncode == 0, time.perf_counter() - start
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ingestion automatique des fiches ajoutées, modifiées ou supprimées")
+    parser.add_argument("--source-dir", default=SOURCE_DIR, help="Dossier surveillé")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="Dossier de l'index FAISS")
+    parser.add_argument("--tracking-file", default=TRACKING_FILE, help="Fichier de suivi des empreintes")
+    parser.add_argument("--debounce", type=float, default=2.0, help="Secondes de calme avant de lancer une passe")
+    parser.add_argument("--max-delay", type=float, default=10.0,
+                        help="Délai maximal entre le premier événement et le lancement de la passe (secondes)")
+    parser.add_argument("--polling", action="store_true", help="Forcer la scrutation périodique (pas d'inotify)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Période de scrutation (secondes)")
+    parser.add_argument("b02a_args", nargs=argparse.REMAINDER,
+                        help="Options transmises à B02a après '--' (ex : -- --workers 8 --format mmap)")
+    args = parser.parse_args()
+    if args.b02a_args[:1] == ["--"]:
+        args.b02a_args = args.b02a_args[1:]
+    return args
+
+def main():
+    print("--- Demo LLM - B02h : Surveillance du dossier source et ingestion automatique ---")
+    args = parse_args()
+    os.makedirs(args.source_dir, exist_ok=True)
+
+    # 1. Rattrapage : les changements faits pendant que le démon était arrêté
+    print("[Info] Passe initiale (rattrapage des changements hors surveillance)...")
+    run_ingestion(args)
+
+    # 2. Surveillance
+    handler = ChangeBatcher()
+    observer, observer_name = start_observer(handler, args.source_dir, args.polling, args.poll_interval)
+    print(f"[Info] Surveillance de {args.source_dir} via {observer_name} | anti-rebond {args.debounce:g} s, "
+          f"délai max {args.max_delay:g} s. Ctrl+C pour arrêter.")
+    passes = 0
+    try:
+        while True:
+            time.sleep(0.2)
+            ready = handler.take_ready(args.debounce, args.max_delay)
+            if ready is None:
+                continue
+            files, first_event_at = ready
+            passes += 1
+            preview = ", ".join(sorted(files)[:3]) + (" ..." if len(files) > 3 else "")
+            print(f"[Passe {passes}] {len(files)} fichier(s) touché(s) : {preview}")
+            ok, duration = run_ingestion(args, files)
+            if not ok:
+                handler.requeue(files)
+            lag = time.monotonic() - first_event_at
+            status = "✅ version publiée" if ok else "❌ échec (fichiers remis en attente, B02a reprendra au dernier lot validé)"
+            print(f"[Passe {passes}] {status} | ingestion {duration:.1f} s | fraîcheur {lag:.1f} s après le premier événement")
+    except KeyboardInterrupt:
+        print("\n[Info] Arrêt de la surveillance.")
+    finally:
+        observer.stop()
+        observer.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import time
+import statistics
+
+# Ressources réellement utilisées par B03 (l'interface Streamlit n'est pas lancée à l'import)
+from B03_langgraph_routing import INDEX_DIR, SharedRagResources
+from rag_common import SqliteDocstore
+
+# ==============================================================================
+# Demo LLM - Phase B : Étape 3 (Bonus) : Benchmark "À froid" vs "À chaud"
+# ==============================================================================
+# ASPECT CLÉ : Mesurer ce que coûte une question RAG dans B03 selon que les
+# ressources (FastEmbed + index FAISS + client LLM) sont rechargées à chaque
+# question (à froid) ou résidentes en mémoire (à chaud).
+# L'appel au LLM lui-même est exclu : on mesure uniquement la partie locale.
+# ASPECT CLÉ 2 : On chronomètre le vrai conteneur de B03 (SharedRagResources) et
+# son chargeur d'index : format pickle ou mmap, selon ce que B02a a publié.
+# ==============================================================================
+# python B03_benchmark_warm_cold.py
+
+QUESTIONS = [
+    "Qui est Thor ?",
+    "Quelles sont les armes d'Iron Man ?",
+    "Que se passe-t-il dans Avengers: Endgame ?",
+    "Quel est le rôle du Tesseract ?",
+    "Pourquoi les Avengers se divisent-ils dans Civil War ?",
+    "Qui est Thanos ?",
+]
+
+# ------------------------------------------------------------------------------
+# SECTION 1 : CHEMINS "À FROID" ET "À CHAUD"
+# ------------------------------------------------------------------------------
+
+def local_search(resources, query):
+    """Partie locale de retrieve_documents (B03) : l'index est relu si une nouvelle version est publiée."""
+    return resources.get_vector_db().similarity_search(query, k=3)
+
+def cold_query(query):
+    """Chemin historique de B03 : tout est recréé pour chaque question."""
+    resources = SharedRagResources()
+    resources.get_llm()
+    return local_search(resources, query)
+
+def warm_query(resources, query):
+    """Chemin résident : un embedding de la question + une recherche FAISS."""
+    return local_search(resources, query)
+
+def measure(fn, repeats):
+    """Exécute fn() `repeats` fois et retourne les latences en millisecondes."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def summarize(label, timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    print(f"   {label:<10} moyenne={statistics.mean(timings):8.1f} ms | "
+          f"p50={statistics.median(timings):8.1f} ms | p95={p95:8.1f} ms")
+    return statistics.mean(timings)
+
+# ------------------------------------------------------------------------------
+# SECTION 2 : EXÉCUTION DU BENCHMARK (Terminal)
+# ------------------------------------------------------------------------------
+
+def main():
+    print("--- Demo LLM - B03 : Benchmark Ressources à froid / à chaud ---")
+
+    if not os.path.exists(INDEX_DIR):
+        print(f"[Erreur] Index FAISS introuvable dans {INDEX_DIR}. Lancez d'abord B02a.")
+        return
+
+    # Préchauffage : le premier chargement FastEmbed peut télécharger le modèle.
+    print("[Info] Préchauffage (téléchargement éventuel du modèle)...")
+    cold_query(QUESTIONS[0])
+
+    repeats = 3
+    cold_timings, warm_timings = [], []
+
+    print(f"[Info] Chemin À FROID ({len(QUESTIONS)} questions x {repeats})...")
+    for q in QUESTIONS:
+        cold_timings.extend(measure(lambda: cold_query(q), repeats))
+
+    print(f"[Info] Chemin À CHAUD ({len(QUESTIONS)} questions x {repeats})...")
+    resources = SharedRagResources()
+    resources.get_llm()
+    index_format = "mmap" if isinstance(resources.get_vector_db().docstore, SqliteDocstore) else "pickle"
+    for q in QUESTIONS:
+        warm_timings.extend(measure(lambda: warm_query(resources, q), repeats))
+
+    print(f"\nRÉSULTATS (hors appel LLM, index au format {index_format}) :")
+    cold_mean = summarize("À froid", cold_timings)
+    warm_mean = summarize("À chaud", warm_timings)
+    print(f"\n   ⚡ Gain : x{cold_mean / warm_mean:.1f} par question "
+          f"({cold_mean - warm_mean:.1f} ms économisées)")
+
+if __name__ == "__main__":
+    main()
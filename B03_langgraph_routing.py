@@ -1,6 +1,17 @@
 import streamlit as st
 import os
+import re
 import json
+import uuid
+import operator
+import sqlite3
+import time
+import threading
+import unicodedata
+import httpx
+import numpy as np
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from typing import Annotated, TypedDict, Literal
 from dotenv import load_dotenv
 
@@ -8,20 +19,56 @@ from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import StateGraph, START, END
+from langgraph.checkpoint.sqlite import SqliteSaver
+from rag_common import load_mmap_vector_db
 
 # ==============================================================================
 # Demo LLM - Phase B : Étape 3 : Routage Intelligent (LangGraph)
 # ==============================================================================
 # ASPECT CLÉ : Cette étape est AUTO-SUFFISANTE. Toute la logique (RAG, Graphe,
-# Routage et UI) est contenue dans ce fichier pour faciliter la compréhension.
+# Routage et UI) est contenue dans ce fichier pour faciliter la compréhension ;
+# seule la lecture de l'index au format mmap vient de rag_common.py (partagé avec B02).
+# ASPECT CLÉ 2 : Routeur rapide local (gazetteer d'entités Marvel + centroïdes
+# d'exemples FastEmbed) ; le routeur LLM n'est appelé qu'en cas de doute.
+# Mesure de l'accord avec le routeur LLM : B03b_router_eval.py
+# ASPECT CLÉ 3 : Recherche spéculative. Le nœud 'router' lance la recherche FAISS en
+# tâche de fond avant de router ; 'rag_branch' attend son résultat, 'general_branch'
+# ne l'attend jamais (la branche hors-domaine ne paie pas la recherche).
+# ASPECT CLÉ 4 : Graphe compilé une seule fois par processus, état de conversation
+# sauvegardé par un checkpointer SQLite (clé : thread_id). Chaque tour n'envoie que
+# la nouvelle question ; une conversation se reprend après redémarrage (?thread=...).
+# ASPECT CLÉ 5 : Streaming. La décision de routage s'affiche dès la fin du nœud
+# 'router', puis la réponse arrive jeton par jeton (temps au premier jeton affiché).
 # ==============================================================================
 
 # ------------------------------------------------------------------------------
 # SECTION 1 : LOGIQUE RAG ET LLM (Extraite de l'étape 5)
 # ------------------------------------------------------------------------------
 
+INDEX_DIR = os.path.join("data", "faiss_index")
+SOURCE_DIR = os.path.join("data", "source_files")
+ROUTER_EXAMPLES_FILE = os.path.join("data", "router_examples.json")
+# Écart minimal entre les similarités aux deux centroïdes pour décider sans le LLM
+ROUTER_MARGIN = 0.05
+# Conversations LangGraph (une ligne de checkpoint par étape et par thread)
+CHECKPOINT_DB = os.path.join("data", "b03_conversations.sqlite")
+# Nombre de messages précédents transmis aux nœuds (le routeur n'en lit que 2)
+HISTORY_WINDOW = 10
+# Pronoms qui renvoient au sujet du tour précédent ("Et quels sont SES pouvoirs ?")
+# Pronoms de reprise uniquement : les articles le / la / les figurent dans presque toutes les questions
+PRONOUNS = {"il", "elle", "ils", "elles", "lui", "leur", "leurs", "son", "sa", "ses"}
+# Service RAG partagé (B02e) : si défini, la recherche passe par lui (micro-batching inter-processus)
+load_dotenv()
+RAG_SERVICE_URL = os.getenv("RAG_SERVICE_URL")
+# Délai maximal d'un appel au service (s) : au-delà, repli sur la recherche locale
+RAG_SERVICE_TIMEOUT = 2.0
+# Recherches spéculatives lancées par le routeur, attendues (ou non) par les branches
+SPECULATIVE_POOL = ThreadPoolExecutor(max_workers=4)
+
 def get_llm():
     load_dotenv()
     return ChatOpenAI(
@@ -34,21 +81,234 @@ def get_llm():
 def get_embeddings():
     return FastEmbedEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
 
-def load_vector_db():
-    embeddings = get_embeddings()
-    index_dir = os.path.join("data", "faiss_index")
-    if os.path.exists(index_dir):
+def read_published_marker():
+    """
+    Pointeur published.json, basculé en dernier par B02a / B02c : il désigne un dossier
+    de version complet (jamais d'index à moitié réécrit). None si rien n'a été publié.
+    """
+    marker_path = os.path.join(INDEX_DIR, "published.json")
+    if not os.path.exists(marker_path):
+        return None
+    with open(marker_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def published_dir():
+    """Dossier de la version publiée (versions/<id>) ; index à plat antérieur au versionnement : INDEX_DIR."""
+    marker = read_published_marker()
+    if marker and marker.get("path"):
+        return os.path.join(INDEX_DIR, marker["path"])
+    return INDEX_DIR
+
+def load_vector_db(embeddings=None):
+    embeddings = embeddings or get_embeddings()
+    index_dir = published_dir()
+    if os.path.exists(os.path.join(index_dir, "manifest.json")):
+        return load_mmap_vector_db(index_dir, embeddings)
+    if os.path.exists(os.path.join(index_dir, "index.faiss")):
         return FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
     return None
 
-def get_rag_response_internal(query, history=None):
-    """Effectue une recherche RAG complète."""
-    db = load_vector_db()
-    if not db:
+def get_index_version():
+    """Version publiée de l'index (None si rien n'a été publié)."""
+    marker = read_published_marker()
+    return marker["version"] if marker else None
+
+class SharedRagResources:
+    """
+    Ressources RAG résidentes : modèle FastEmbed, index FAISS et client LLM.
+    ASPECT CLÉ : Chargées UNE SEULE FOIS par processus puis partagées par toutes
+    les sessions. Une question "à chaud" ne coûte plus qu'un embedding et une
+    recherche. L'index n'est rechargé que si une nouvelle version est publiée.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Verrou séparé pour le (re)chargement de l'index : _lock n'est jamais tenu pendant la lecture disque
+        self._index_lock = threading.Lock()
+        self._llm = None
+        self._embeddings = None
+        self._vector_db = None
+        self._index_version = None
+        self._router = None
+        self._speculative = {}  # thread_id -> Future de la recherche spéculative du tour courant
+
+    def get_llm(self):
+        with self._lock:
+            if self._llm is None:
+                print("  [RESSOURCES] 🧠 Création du client LLM partagé...")
+                self._llm = get_llm()
+            return self._llm
+
+    def get_embeddings(self):
+        with self._lock:
+            if self._embeddings is None:
+                print("  [RESSOURCES] 🔢 Chargement du modèle FastEmbed (une seule fois)...")
+                self._embeddings = get_embeddings()
+            return self._embeddings
+
+    def get_router(self):
+        embeddings = self.get_embeddings()
+        with self._lock:
+            if self._router is None:
+                print("  [RESSOURCES] 🧭 Préparation du routeur rapide (centroïdes des exemples)...")
+                self._router = FastRouter(embeddings)
+            return self._router
+
+    def router_stats(self):
+        """Compteurs de décisions du routeur rapide (None tant qu'aucune question n'a été routée)."""
+        with self._lock:
+            router = self._router
+        if router is None:
+            return None
+        with router.lock:
+            return dict(router.counts)
+
+    def start_speculative_retrieval(self, thread_id, question):
+        """Lance la recherche en tâche de fond ; le résultat est (documents, durée en ms)."""
+        future = SPECULATIVE_POOL.submit(timed_retrieval, question, self)
+        with self._lock:
+            self._speculative[thread_id] = future
+
+    def take_speculative_retrieval(self, thread_id):
+        """Future de la recherche spéculative du fil (None s'il n'y en a pas), retirée du registre."""
+        with self._lock:
+            return self._speculative.pop(thread_id, None)
+
+    def get_vector_db(self):
+        """
+        Index courant. Le chargement d'une nouvelle version se fait sous _index_lock (un seul
+        chargement à la fois), hors de _lock : LLM, embeddings, routeur et l'ancien index restent
+        servis pendant la lecture ; _lock n'est pris que pour échanger la référence.
+        """
+        version = get_index_version()
+        embeddings = self.get_embeddings()
+        with self._lock:
+            if self._vector_db is not None and version == self._index_version:
+                return self._vector_db
+        with self._index_lock:
+            with self._lock:
+                # Un autre thread a pu charger cette version pendant l'attente
+                if self._vector_db is not None and version == self._index_version:
+                    return self._vector_db
+            print("  [RESSOURCES] 📂 Chargement de l'index FAISS (nouvelle version publiée)...")
+            start = time.perf_counter()
+            vector_db = load_vector_db(embeddings)
+            with self._lock:
+                self._vector_db, self._index_version = vector_db, version
+            print(f"  [RESSOURCES] ✅ Index chargé en {(time.perf_counter() - start) * 1000:.0f} ms")
+            return vector_db
+
+def normalize_text(text):
+    """'Qu'a fait Spider-Man ?' -> 'qu a fait spider man' : minuscules, sans accents ni ponctuation."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", text))
+
+def build_gazetteer(aliases, source_dir=SOURCE_DIR):
+    """Entités des fiches indexées (hero_iron_man.txt -> 'iron man') + alias du fichier d'exemples."""
+    names = {normalize_text(alias) for alias in aliases}
+    if os.path.exists(source_dir):
+        for filename in os.listdir(source_dir):
+            entity_type, _, entity = os.path.splitext(filename)[0].partition("_")
+            if entity_type in ("hero", "movie", "vilain") and entity:
+                names.add(normalize_text(re.sub(r"_\d{4}$", "", entity)))
+    return {name for name in names if len(name) >= 3}
+
+class FastRouter:
+    """
+    ASPECT CLÉ : Routage local en quelques millisecondes, LLM seulement en cas de doute.
+    1. Gazetteer : une entité Marvel connue dans la question (ou dans la question précédente
+       si celle-ci est une relance avec pronom) -> 'rag'
+    2. Centroïdes : similarité cosinus de la question aux centres des exemples 'rag' et 'general'
+    Si l'écart entre les deux similarités est sous ROUTER_MARGIN, la décision revient au LLM.
+    """
+    def __init__(self, embeddings, examples_file=ROUTER_EXAMPLES_FILE, source_dir=SOURCE_DIR, margin=ROUTER_MARGIN):
+        with open(examples_file, "r", encoding="utf-8") as f:
+            examples = json.load(f)
+        self.embeddings = embeddings
+        self.margin = margin
+        self.gazetteer = build_gazetteer(examples.get("aliases", []), source_dir)
+        self.centroids = {label: self.centroid(examples[label]) for label in ("rag", "general")}
+        self.lock = threading.Lock()
+        self.counts = {"gazetteer": 0, "embeddings": 0, "llm": 0}
+        self.llm_ms = None  # latence moyenne (glissante) du routeur LLM, mesurée sur les repli
+
+    def centroid(self, texts):
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        center = vectors.mean(axis=0)
+        return center / np.linalg.norm(center)
+
+    def match_entity(self, text):
+        padded = f" {normalize_text(text)} "
+        return next((name for name in self.gazetteer if f" {name} " in padded), None)
+
+    def classify(self, question, history=None):
+        """(route, source, confiance) ; route None : trop incertain, la décision revient au LLM."""
+        if self.match_entity(question):
+            return "rag", "gazetteer", 1.0
+        last_user = next((m["content"] for m in reversed(history or []) if m["role"] == "user"), "")
+        if set(normalize_text(question).split()) & PRONOUNS and self.match_entity(last_user):
+            return "rag", "gazetteer", 1.0
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        vector /= np.linalg.norm(vector)
+        margin = float(vector @ self.centroids["rag"] - vector @ self.centroids["general"])
+        route = "rag" if margin > 0 else "general"
+        return (route if abs(margin) >= self.margin else None), "embeddings", abs(margin)
+
+    def record(self, source, llm_ms=None):
+        with self.lock:
+            self.counts[source] += 1
+            if llm_ms is not None:
+                self.llm_ms = llm_ms if self.llm_ms is None else 0.8 * self.llm_ms + 0.2 * llm_ms
+
+def search_rag_service(query, k=3, filters=None):
+    """Recherche déléguée au service B02e. Renvoie None si le service est injoignable."""
+    try:
+        response = httpx.post(f"{RAG_SERVICE_URL}/search", json={"query": query, "k": k, "filters": filters},
+                              timeout=RAG_SERVICE_TIMEOUT)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"  [RESSOURCES] ⚠️ Service RAG injoignable ({e}), recherche locale.")
+        return None
+    return [Document(id=d["id"], page_content=d["page_content"], metadata=d["metadata"]) for d in response.json()["documents"]]
+
+def retrieve_documents(query, resources=None, filters=None):
+    """
+    Partie "recherche" du RAG : embedding de la question + FAISS (ou service B02e).
+    `filters` (optionnel) restreint la recherche aux chunks d'un type ou d'une entité,
+    ex : {"entity_type": "vilain"} ou {"entity": "thor"} (métadonnées posées par B02a).
+    Renvoie None si l'index est introuvable.
+    """
+    relevant_docs = search_rag_service(query, 3, filters) if RAG_SERVICE_URL else None
+    if relevant_docs is None:
+        # Sans ressources partagées, on retombe sur un chargement "à froid" (comportement historique)
+        db = resources.get_vector_db() if resources else load_vector_db()
+        if not db:
+            return None
+        if filters:
+            relevant_docs = db.similarity_search(query, k=3, filter=filters, fetch_k=200)
+        else:
+            relevant_docs = db.similarity_search(query, k=3)
+    return relevant_docs
+
+def timed_retrieval(query, resources):
+    """retrieve_documents chronométré : (documents, durée en ms)."""
+    start = time.perf_counter()
+    docs = retrieve_documents(query, resources)
+    return docs, (time.perf_counter() - start) * 1000
+
+def get_rag_response_internal(query, history=None, resources=None, filters=None, relevant_docs=None):
+    """
+    Effectue une recherche RAG complète.
+    `relevant_docs` (optionnel) : documents déjà retrouvés (recherche spéculative), la
+    recherche est alors sautée. Si RAG_SERVICE_URL est défini, elle est confiée au service B02e.
+    """
+    if relevant_docs is None:
+        relevant_docs = retrieve_documents(query, resources, filters)
+    if relevant_docs is None:
         return {"answer": "Erreur : Base de données vectorielle introuvable.", "source_documents": []}
-    
-    llm = get_llm()
-    relevant_docs = db.similarity_search(query, k=3)
+
+    llm = resources.get_llm() if resources else get_llm()
     context = "\n\n---\n\n".join([d.page_content for d in relevant_docs])
     
     sys_prompt = f"""Tu es un assistant expert Marvel. 
@@ -79,28 +339,49 @@ def get_rag_response_internal(query, history=None):
 # SECTION 2 : LOGIQUE DU GRAPHE D'AGENT (LangGraph)
 # ------------------------------------------------------------------------------
 
+def merge_timings(left, right):
+    """Réducteur : les nœuds exécutés en parallèle ajoutent chacun leur chrono ; None remet à zéro (nouveau tour)."""
+    if right is None:
+        return {}
+    return {**(left or {}), **right}
+
 class AgentState(TypedDict):
     question: str
-    history: list
+    messages: Annotated[list, operator.add]  # conversation complète, conservée par le checkpointer
     route_decision: str  # 'rag' ou 'general'
+    route_source: str    # 'gazetteer', 'embeddings' ou 'llm'
+    route_ms: float
+    route_saved_ms: float
     response: str
     source_documents: list
+    timings: Annotated[dict, merge_timings]  # durée de chaque nœud (ms)
 
-def router_node(state: AgentState) -> dict:
-    """Analyse si la question concerne Marvel, en tenant compte du contexte."""
-    print(f"\n[ENTRY] Nœud 'router' - Entrée: '{state['question'][:40]}...'")
-    llm = get_llm()
-    
+def recent_history(state):
+    """Messages précédant la question courante, bornés à HISTORY_WINDOW (coût constant par tour)."""
+    return state.get("messages", [])[:-1][-HISTORY_WINDOW:]
+
+def route_summary(state):
+    """' · gazetteer · 3 ms · ~850 ms économisées' : affiché sous chaque réponse."""
+    info = f" · {state['route_source']} · {state['route_ms']:.0f} ms"
+    if state["route_saved_ms"]:
+        info += f" · ~{state['route_saved_ms']:.0f} ms économisées"
+    return info
+
+def assistant_message(state, response):
+    return {"role": "assistant", "content": response, "decision": state["route_decision"], "route_info": route_summary(state)}
+
+def llm_route(question, history, llm):
+    """Routeur LLM historique : un aller-retour complet pour obtenir 'rag' ou 'general'."""
     # ASPECT CLÉ : Prise en compte de l'historique pour résoudre le contexte (ex: "il")
     history_context = ""
-    if state['history']:
-        last_exchanges = state['history'][-2:] # On prend les 2 derniers échanges
+    if history:
+        last_exchanges = history[-2:] # On prend les 2 derniers échanges
         history_context = "Historique récent :\n" + "\n".join([f"{m['role']}: {m['content']}" for m in last_exchanges])
 
     prompt = f"""Tu es un expert en classification d'intentions.
     {history_context}
     
-    Question actuelle de l'utilisateur : "{state['question']}"
+    Question actuelle de l'utilisateur : "{question}"
     
     Tâche : Détermine si cette question (en tenant compte de l'historique si nécessaire) concerne l'univers MARVEL.
     - Si la question utilise des pronoms (il, lui, ils) faisant référence à un héros Marvel cité juste avant, c'est 'rag'.
@@ -109,40 +390,91 @@ def router_node(state: AgentState) -> dict:
     Réponds EXCLUSIVEMENT par 'rag' ou 'general'.
     Decision :"""
     
-    print("  [LLM CALL] Demande de décision au routeur...")
     resp = llm.invoke([HumanMessage(content=prompt)])
     decision = resp.content.strip().lower()
-    
-    route = "rag" if "rag" in decision else "general"
-    print(f"[EXIT] Nœud 'router' - Décision: {route}")
-    return {"route_decision": route}
+    return "rag" if "rag" in decision else "general"
 
-def rag_branch_node(state: AgentState) -> dict:
-    """Exécute la recherche sémantique."""
+def router_node(state: AgentState, config: RunnableConfig, resources: SharedRagResources, speculative=False) -> dict:
+    """
+    Analyse si la question concerne Marvel : routeur local d'abord, LLM en cas de doute.
+    ASPECT CLÉ : Avec `speculative`, la recherche part en tâche de fond AVANT le routage ;
+    seule la branche 'rag' attend son résultat, la branche 'general' démarre sans elle.
+    """
+    print(f"\n[ENTRY] Nœud 'router' - Entrée: '{state['question'][:40]}...'")
+    thread_id = config["configurable"]["thread_id"]
+    if speculative:
+        resources.start_speculative_retrieval(thread_id, state['question'])
+    router = resources.get_router()
+    start = time.perf_counter()
+    history = recent_history(state)
+    route, source, confidence = router.classify(state['question'], history)
+    local_ms = (time.perf_counter() - start) * 1000
+
+    if route is None:
+        print(f"  [LLM CALL] Confiance locale insuffisante ({confidence:.3f}), demande de décision au routeur LLM...")
+        llm_start = time.perf_counter()
+        route, source = llm_route(state['question'], history, resources.get_llm()), "llm"
+        router.record(source, llm_ms=(time.perf_counter() - llm_start) * 1000)
+    else:
+        router.record(source)
+    if route != "rag" and resources.take_speculative_retrieval(thread_id) is not None:
+        print("  [ACTION] Recherche spéculative abandonnée (question hors-domaine, non attendue).")
+    route_ms = (time.perf_counter() - start) * 1000
+    # Gain estimé : latence moyenne du routeur LLM (mesurée sur les replis) - coût local
+    saved_ms = router.llm_ms - local_ms if source != "llm" and router.llm_ms else 0.0
+    print(f"[EXIT] Nœud 'router' - Décision: {route} via {source} ({route_ms:.0f} ms, ~{saved_ms:.0f} ms économisées)")
+    return {"route_decision": route, "route_source": source, "route_ms": route_ms, "route_saved_ms": saved_ms,
+            "timings": {"router": route_ms}}
+
+def rag_branch_node(state: AgentState, config: RunnableConfig, resources: SharedRagResources) -> dict:
+    """Exécute la recherche sémantique (sauf si la recherche spéculative l'a déjà lancée)."""
     print(f"\n[ENTRY] Nœud 'rag_branch' - Question: '{state['question'][:40]}...'")
-    print("  [ACTION] Interrogation de la base FAISS et du LLM (RAG)...")
-    result = get_rag_response_internal(state['question'], state['history'])
+    future = resources.take_speculative_retrieval(config["configurable"]["thread_id"])
+    if future is None:
+        print("  [ACTION] Interrogation de la base FAISS...")
+        docs, retrieval_ms = timed_retrieval(state['question'], resources)
+    else:
+        print("  [ACTION] Attente de la recherche spéculative lancée pendant le routage...")
+        docs, retrieval_ms = future.result()
+    timings = {"retrieval": retrieval_ms}
+    print("  [LLM CALL] Génération de la réponse (RAG)...")
+    start = time.perf_counter()
+    result = get_rag_response_internal(state['question'], recent_history(state), resources, relevant_docs=docs)
+    timings["generation"] = (time.perf_counter() - start) * 1000
     print("[EXIT] Nœud 'rag_branch' - Réponse générée.")
-    return {"response": result["answer"], "source_documents": result["source_documents"]}
+    return {"response": result["answer"], "source_documents": result["source_documents"], "timings": timings,
+            "messages": [assistant_message(state, result["answer"])]}
 
-def general_branch_node(state: AgentState) -> dict:
+def general_branch_node(state: AgentState, resources: SharedRagResources) -> dict:
     """Réponse polie de désengagement."""
     print(f"\n[ENTRY] Nœud 'general_branch' - Question: '{state['question'][:40]}...'")
-    llm = get_llm()
+    llm = resources.get_llm()
     prompt = f"Explique poliment que tu es un expert Marvel et que tu ne réponds pas à : {state['question']}"
     
     print("  [LLM CALL] Demande de réponse polie (Désengagement)...")
+    start = time.perf_counter()
     resp = llm.invoke([HumanMessage(content=prompt)])
+    elapsed = (time.perf_counter() - start) * 1000
     print("[EXIT] Nœud 'general_branch' - Réponse polie envoyée.")
-    return {"response": resp.content, "source_documents": []}
+    return {"response": resp.content, "source_documents": [], "timings": {"generation": elapsed},
+            "messages": [assistant_message(state, resp.content)]}
+
+def get_checkpointer():
+    """Checkpointer SQLite partagé par les sessions : les conversations survivent au redémarrage."""
+    return SqliteSaver(sqlite3.connect(CHECKPOINT_DB, check_same_thread=False))
 
-def create_marvel_agent():
+def create_marvel_agent(resources: SharedRagResources, speculative=True, checkpointer=None):
+    # ASPECT CLÉ : Les nœuds reçoivent les ressources résidentes (partial) au lieu
+    # de recréer LLM, embeddings et index FAISS à chaque appel.
     workflow = StateGraph(AgentState)
-    workflow.add_node("router", router_node)
-    workflow.add_node("rag_branch", rag_branch_node)
-    workflow.add_node("general_branch", general_branch_node)
+    workflow.add_node("router", partial(router_node, resources=resources, speculative=speculative))
+    workflow.add_node("rag_branch", partial(rag_branch_node, resources=resources))
+    workflow.add_node("general_branch", partial(general_branch_node, resources=resources))
     
-    workflow.set_entry_point("router")
+    # Mode spéculatif : pas de nœud parallèle (une super-étape LangGraph attend tous ses
+    # nœuds, la branche 'general' attendrait la recherche) mais une tâche de fond lancée
+    # par 'router' et attendue par 'rag_branch' seulement.
+    workflow.add_edge(START, "router")
     workflow.add_conditional_edges(
         "router",
         lambda x: x["route_decision"],
@@ -150,72 +482,134 @@ def create_marvel_agent():
     )
     workflow.add_edge("rag_branch", END)
     workflow.add_edge("general_branch", END)
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
 
 # ------------------------------------------------------------------------------
 # SECTION 3 : INTERFACE UTILISATEUR (Streamlit)
 # ------------------------------------------------------------------------------
 
-st.set_page_config(page_title="Demo LLM - Étape 6", page_icon="🧭", layout="wide")
-
-# TITRE UNIFIÉ
-st.subheader("🦸 Demo LLM - Assistant Marvel")
-
-# L'encart d'information a été déplacé dans le Cockpit principal (onglet Concept).
-st.markdown("---")
-
-# Sidebar
-with st.sidebar:
-    st.header("⚙️ Contrôles")
-    if st.button("🆕 Nouvelle Conversation", use_container_width=True):
-        st.session_state.messages_06 = []
-        st.rerun()
-
-# État de la session
-if "messages_06" not in st.session_state:
-    st.session_state.messages_06 = []
-
-# Affichage des messages
-for msg in st.session_state.messages_06:
-    with st.chat_message(msg["role"]):
-        st.markdown(msg["content"])
-        if "decision" in msg:
-            st.caption(f"🧭 Décision Agent : **{msg['decision'].upper()}**")
-
-# Interaction
-if prompt := st.chat_input("Défiez l'agent Marvel !"):
-    st.chat_message("user").markdown(prompt)
-    st.session_state.messages_06.append({"role": "user", "content": prompt})
-
-    with st.chat_message("assistant"):
-        with st.spinner("L'agent analyse le graphe..."):
-            agent = create_marvel_agent()
-            initial_state = {
+@st.cache_resource(show_spinner=False)
+def get_shared_resources():
+    """Une seule instance par processus Streamlit, partagée par toutes les sessions."""
+    return SharedRagResources()
+
+@st.cache_resource(show_spinner=False)
+def get_shared_checkpointer():
+    return get_checkpointer()
+
+@st.cache_resource(show_spinner=False)
+def get_marvel_agent(speculative):
+    """
+    ASPECT CLÉ : Graphe compilé UNE fois par processus (et par mode), pas à chaque question.
+    Les deux variantes partagent le checkpointer : on peut changer de mode en cours de conversation.
+    """
+    print(f"  [RESSOURCES] 🧩 Compilation du graphe (spéculatif={speculative})...")
+    return create_marvel_agent(get_shared_resources(), speculative, get_shared_checkpointer())
+
+def main():
+    st.set_page_config(page_title="Demo LLM - Étape 6", page_icon="🧭", layout="wide")
+
+    # TITRE UNIFIÉ
+    st.subheader("🦸 Demo LLM - Assistant Marvel")
+
+    # L'encart d'information a été déplacé dans le Cockpit principal (onglet Concept).
+    st.markdown("---")
+
+    # Fil de conversation : repris depuis l'URL (?thread=...) s'il existe, sinon nouveau
+    if "thread_06" not in st.session_state:
+        st.session_state.thread_06 = st.query_params.get("thread") or uuid.uuid4().hex
+    st.query_params["thread"] = st.session_state.thread_06
+    config = {"configurable": {"thread_id": st.session_state.thread_06}}
+
+    # Sidebar
+    with st.sidebar:
+        st.header("⚙️ Contrôles")
+        if st.button("🆕 Nouvelle Conversation", use_container_width=True):
+            st.session_state.thread_06 = uuid.uuid4().hex
+            st.rerun()
+        speculative = st.toggle("⚡ Recherche spéculative", value=True,
+                                help="Lancer la recherche FAISS pendant le routage (résultat ignoré si la question est hors-domaine)")
+        st.caption(f"🧵 Conversation `{st.session_state.thread_06[:8]}` (reprise possible via l'URL)")
+        router_stats_box = st.empty()
+
+    agent = get_marvel_agent(speculative)
+
+    # Affichage des messages : relus depuis le dernier checkpoint du fil
+    for msg in agent.get_state(config).values.get("messages", []):
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+            if "decision" in msg:
+                st.caption(f"🧭 Décision Agent : **{msg['decision'].upper()}**{msg.get('route_info', '')}")
+
+    # Interaction
+    if prompt := st.chat_input("Défiez l'agent Marvel !"):
+        st.chat_message("user").markdown(prompt)
+
+        with st.chat_message("assistant"):
+            # Seule la nouvelle question est envoyée : le reste de l'état vient du checkpoint
+            turn = {
                 "question": prompt,
-                "history": st.session_state.messages_06[:-1],
-                "route_decision": "",
-                "response": "",
-                "source_documents": []
+                "messages": [{"role": "user", "content": prompt}],
+                "timings": None
             }
-            final_state = agent.invoke(initial_state)
-            
+            # ASPECT CLÉ : agent.stream au lieu de agent.invoke. Mode "updates" : fin de chaque
+            # nœud (la décision s'affiche dès que le routeur a tranché) ; mode "messages" : jetons
+            # émis par les appels LLM des nœuds (LangGraph bascule leurs llm.invoke en streaming).
+            answer_box = st.empty()
+            answer_box.caption("L'agent analyse le graphe...")
+            answer, first_token_ms = "", None
+            start = time.perf_counter()
+            for mode, chunk in agent.stream(turn, config, stream_mode=["updates", "messages"]):
+                if mode == "updates" and "router" in chunk:
+                    update = chunk["router"]
+                    answer_box.empty()
+                    st.caption(f"🧭 Routage{route_summary(update)}")
+                    if update["route_decision"] == "rag":
+                        st.success("🎯 Sujet Marvel identifié. Utilisation de la base de connaissances.")
+                    else:
+                        st.warning("👋 Sujet hors-domaine identifié. Branche de politesse activée.")
+                    answer_box = st.empty()
+                elif mode == "messages":
+                    token, metadata = chunk
+                    # Les jetons du routeur LLM (repli) ne font pas partie de la réponse
+                    if metadata.get("langgraph_node") in ("rag_branch", "general_branch") and token.content:
+                        if first_token_ms is None:
+                            first_token_ms = (time.perf_counter() - start) * 1000
+                        answer += token.content
+                        answer_box.markdown(answer + "▌")
+            total_ms = (time.perf_counter() - start) * 1000
+
+            final_state = agent.get_state(config).values
             decision = final_state["route_decision"]
-            response = final_state["response"]
-            
-            if decision == "rag":
-                st.success("🎯 Sujet Marvel identifié. Utilisation de la base de connaissances.")
-            else:
-                st.warning("👋 Sujet hors-domaine identifié. Branche de politesse activée.")
-            
-            st.markdown(response)
-            
+            answer_box.markdown(final_state["response"])
+
+            # Chrono par nœud : en mode spéculatif, routage et recherche se recouvrent,
+            # le total est inférieur à leur somme (le gain est le recouvrement).
+            timings = final_state["timings"]
+            timing_info = " · ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items())
+            overlap_ms = sum(timings.values()) - total_ms
+            if speculative and decision == "rag":
+                timing_info += f" · recherche spéculative utilisée, ~{max(overlap_ms, 0):.0f} ms recouverts"
+            elif speculative:
+                timing_info += " · recherche spéculative ignorée (non attendue)"
+            if first_token_ms is not None:
+                timing_info += f" · premier jeton {first_token_ms:.0f} ms"
+            st.caption(f"⏱️ {timing_info} · total {total_ms:.0f} ms")
+
             if final_state["source_documents"]:
                 with st.expander("📚 Sources"):
                     for d in final_state["source_documents"]:
                         st.write(f"- {os.path.basename(d.metadata.get('source', 'Index'))}")
 
-    st.session_state.messages_06.append({
-        "role": "assistant", 
-        "content": response,
-        "decision": decision
-    })
+    # Part des décisions prises sans le LLM (toutes sessions confondues)
+    counts = get_shared_resources().router_stats()
+    if counts is not None:
+        total = sum(counts.values())
+        local = counts["gazetteer"] + counts["embeddings"]
+        with router_stats_box.container():
+            st.caption("🧭 Routeur :")
+            st.markdown(f"**Décisions locales** : {local}/{total} ({local / total:.0%})" if total else "Aucune décision")
+            st.caption(f"gazetteer {counts['gazetteer']} · embeddings {counts['embeddings']} · LLM {counts['llm']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import time
+import argparse
+import statistics
+import unicodedata
+import numpy as np
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+from langchain_core.messages import HumanMessage
+
+# ==============================================================================
+# Demo LLM - Phase B : Étape 3 (Bonus) : Évaluation du Routeur Rapide
+# ==============================================================================
+# ASPECT CLÉ : Le routeur local de B03 (gazetteer + centroïdes FastEmbed) ne vaut
+# que s'il décide comme le routeur LLM. On rejoue un jeu de questions étiquetées
+# et on mesure :
+#   - l'accord avec le routeur LLM sur les questions décidées localement,
+#   - la justesse par rapport aux étiquettes (routeur rapide seul, hybride, LLM),
+#   - la couverture (part des questions décidées sans LLM) et les latences.
+# ASPECT CLÉ 2 : Le routeur est dupliqué depuis B03 (scripts auto-suffisants) :
+# toute modification de l'un doit être reportée dans l'autre.
+# ==============================================================================
+# python B03b_router_eval.py
+# python B03b_router_eval.py --margin 0.03
+# python B03b_router_eval.py --no-llm
+
+SOURCE_DIR = os.path.join("data", "source_files")
+ROUTER_EXAMPLES_FILE = os.path.join("data", "router_examples.json")
+EVAL_SET_FILE = os.path.join("data", "router_eval_set.json")
+ROUTER_MARGIN = 0.05
+# Pronoms de reprise uniquement : les articles le / la / les figurent dans presque toutes les questions
+PRONOUNS = {"il", "elle", "ils", "elles", "lui", "leur", "leurs", "son", "sa", "ses"}
+
+# ------------------------------------------------------------------------------
+# SECTION 1 : ROUTEURS (identiques à B03)
+# ------------------------------------------------------------------------------
+
+def get_llm():
+    load_dotenv()
+    return ChatOpenAI(
+        model=os.getenv("LLM_MODEL"),
+        api_key=os.getenv("LLM_API_KEY"),
+        base_url=os.getenv("LLM_BASE_URL"),
+        temperature=0
+    )
+
+def get_embeddings():
+    return FastEmbedEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", text))
+
+def build_gazetteer(aliases, source_dir=SOURCE_DIR):
+    names = {normalize_text(alias) for alias in aliases}
+    if os.path.exists(source_dir):
+        for filename in os.listdir(source_dir):
+            entity_type, _, entity = os.path.splitext(filename)[0].partition("_")
+            if entity_type in ("hero", "movie", "vilain") and entity:
+                names.add(normalize_text(re.sub(r"_\d{4}$", "", entity)))
+    return {name for name in names if len(name) >= 3}
+
+class FastRouter:
+    def __init__(self, embeddings, examples_file=ROUTER_EXAMPLES_FILE, source_dir=SOURCE_DIR, margin=ROUTER_MARGIN):
+        with open(examples_file, "r", encoding="utf-8") as f:
+            examples = json.load(f)
+        self.embeddings = embeddings
+        self.margin = margin
+        self.gazetteer = build_gazetteer(examples.get("aliases", []), source_dir)
+        self.centroids = {label: self.centroid(examples[label]) for label in ("rag", "general")}
+
+    def centroid(self, texts):
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        center = vectors.mean(axis=0)
+        return center / np.linalg.norm(center)
+
+    def match_entity(self, text):
+        padded = f" {normalize_text(text)} "
+        return next((name for name in self.gazetteer if f" {name} " in padded), None)
+
+    def classify(self, question, history=None):
+        """(route, source, confiance, route la plus probable) ; route None : décision laissée au LLM."""
+        if self.match_entity(question):
+            return "rag", "gazetteer", 1.0, "rag"
+        last_user = next((m["content"] for m in reversed(history or []) if m["role"] == "user"), "")
+        if set(normalize_text(question).split()) & PRONOUNS and self.match_entity(last_user):
+            return "rag", "gazetteer", 1.0, "rag"
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        vector /= np.linalg.norm(vector)
+        margin = float(vector @ self.centroids["rag"] - vector @ self.centroids["general"])
+        best = "rag" if margin > 0 else "general"
+        return (best if abs(margin) >= self.margin else None), "embeddings", abs(margin), best
+
+def llm_route(question, history, llm):
+    history_context = ""
+    if history:
+        last_exchanges = history[-2:]
+        history_context = "Historique récent :\n" + "\n".join([f"{m['role']}: {m['content']}" for m in last_exchanges])
+
+    prompt = f"""Tu es un expert en classification d'intentions.
+    {history_context}
+
+    Question actuelle de l'utilisateur : "{question}"
+
+    Tâche : Détermine si cette question (en tenant compte de l'historique si nécessaire) concerne l'univers MARVEL.
+    - Si la question utilise des pronoms (il, lui, ils) faisant référence à un héros Marvel cité juste avant, c'est 'rag'.
+    - Si la question est une salutation ou un sujet totalement différent, c'est 'general'.
+
+    Réponds EXCLUSIVEMENT par 'rag' ou 'general'.
+    Decision :"""
+
+    resp = llm.invoke([HumanMessage(content=prompt)])
+    decision = resp.content.strip().lower()
+    return "rag" if "rag" in decision else "general"
+
+# ------------------------------------------------------------------------------
+# SECTION 2 : ÉVALUATION (Terminal)
+# ------------------------------------------------------------------------------
+
+def ratio(hits, total):
+    return f"{hits}/{total} ({hits / total:.0%})" if total else "n/a"
+
+def latency(label, timings):
+    if timings:
+        print(f"   {label:<16} moyenne={statistics.mean(timings):8.1f} ms | p50={statistics.median(timings):8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Accord du routeur rapide de B03 avec le routeur LLM")
+    parser.add_argument("--eval-set", default=EVAL_SET_FILE, help="Questions étiquetées (JSON)")
+    parser.add_argument("--margin", type=float, default=ROUTER_MARGIN, help="Écart minimal pour décider sans LLM")
+    parser.add_argument("--no-llm", action="store_true", help="Évaluer le routeur rapide seul (sans appel LLM)")
+    args = parser.parse_args()
+
+    print("--- Demo LLM - B03b : Évaluation du routeur rapide ---")
+    with open(args.eval_set, "r", encoding="utf-8") as f:
+        items = json.load(f)
+
+    print("[Info] Préparation du routeur rapide (centroïdes des exemples)...")
+    router = FastRouter(get_embeddings(), margin=args.margin)
+    llm = None if args.no_llm else get_llm()
+
+    local_ms, llm_ms = [], []
+    sources = {"gazetteer": 0, "embeddings": 0, "llm": 0}
+    fast_ok = hybrid_ok = llm_ok = agree = decided = 0
+    for item in items:
+        question, history, label = item["question"], item.get("history", []), item["label"]
+        start = time.perf_counter()
+        route, source, confidence, best = router.classify(question, history)
+        local_ms.append((time.perf_counter() - start) * 1000)
+        fast_ok += best == label
+
+        llm_decision = None
+        if llm is not None:
+            start = time.perf_counter()
+            llm_decision = llm_route(question, history, llm)
+            llm_ms.append((time.perf_counter() - start) * 1000)
+            llm_ok += llm_decision == label
+
+        if route is not None:
+            decided += 1
+            sources[source] += 1
+            agree += llm_decision == route
+            hybrid = route
+        else:
+            sources["llm"] += 1
+            hybrid = llm_decision if llm_decision is not None else best
+        hybrid_ok += hybrid == label
+        mark = "✅" if hybrid == label else "❌"
+        print(f"   {mark} [{label:<7}] {source if route else 'llm':<10} conf={confidence:.3f} "
+              f"rapide={best:<7} llm={llm_decision or '-':<7} | {question}")
+
+    total = len(items)
+    print("\nRÉSULTATS :")
+    print(f"   Couverture locale : {ratio(decided, total)} "
+          f"(gazetteer {sources['gazetteer']}, embeddings {sources['embeddings']}, repli LLM {sources['llm']})")
+    print(f"   Justesse routeur rapide seul : {ratio(fast_ok, total)}")
+    if llm is not None:
+        print(f"   Justesse routeur LLM        : {ratio(llm_ok, total)}")
+        print(f"   Justesse hybride (B03)      : {ratio(hybrid_ok, total)}")
+        print(f"   Accord avec le LLM sur les décisions locales : {ratio(agree, decided)}")
+    latency("Routeur rapide", local_ms)
+    latency("Routeur LLM", llm_ms)
+    if llm_ms:
+        saved = decided * (statistics.mean(llm_ms) - statistics.mean(local_ms))
+        print(f"\n   ⚡ ~{saved / total:.0f} ms économisées par question en moyenne ({saved / 1000:.1f} s sur le jeu)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import threading
+import tiktoken
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+# ==============================================================================
+# Demo LLM - Phase A : Mémoire de conversation bornée (A02, A03)
+# ==============================================================================
+# ASPECT CLÉ : Message système + résumé glissant + derniers tours mot pour mot, sous
+# budget de jetons. Une seule implémentation, importée par le chat terminal (A02) et
+# l'interface Streamlit (A03).
+# ASPECT CLÉ 2 : Les tours en attente de résumé restent dans le prompt, mais leur
+# nombre est plafonné (MAX_PENDING_TURNS) : si le LLM de résumé échoue durablement,
+# les plus anciens sont abandonnés et la taille du prompt reste bornée.
+# ==============================================================================
+
+# Nombre de tours (question + réponse) conservés mot pour mot
+KEEP_TURNS = 4
+# Budget de jetons de ces tours (au-delà, les plus anciens partent au résumé)
+HISTORY_TOKEN_BUDGET = 1500
+SUMMARY_MAX_WORDS = 150
+# Tours en attente de résumé gardés dans le prompt (au-delà, les plus anciens sont abandonnés)
+MAX_PENDING_TURNS = 8
+
+class ConversationMemory:
+    """
+    Mémoire de session : message système + résumé glissant + fenêtre des derniers tours.
+    ASPECT CLÉ : Les tours qui sortent de la fenêtre sont résumés par le LLM dans un
+    thread d'arrière-plan : l'utilisateur n'attend jamais le résumé.
+    """
+    def __init__(self, llm, system_prompt, model_name, keep_turns=KEEP_TURNS, token_budget=HISTORY_TOKEN_BUDGET,
+                 max_pending=MAX_PENDING_TURNS):
+        self.llm = llm
+        self.system_prompt = system_prompt
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.max_pending = max_pending
+        try:
+            self.encoding = tiktoken.encoding_for_model(model_name or "")
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.lock = threading.Lock()
+        self.summary = ""
+        self.turns = []      # [(question, réponse)] conservés mot pour mot
+        self.pending = []    # tours sortis de la fenêtre, envoyés tels quels jusqu'à leur résumé
+        self.summarized_turns = 0
+        self.dropped_turns = 0
+        self.worker = None
+
+    def count_tokens(self, texts):
+        # ~4 jetons d'enveloppe par message (rôle, séparateurs)
+        return sum(len(self.encoding.encode(text)) + 4 for text in texts)
+
+    def build_messages(self, user_input):
+        """Liste envoyée au LLM pour ce tour."""
+        with self.lock:
+            system = self.system_prompt
+            if self.summary:
+                system += f"\n\nRésumé de la conversation jusqu'ici :\n{self.summary}"
+            messages = [SystemMessage(content=system)]
+            # Les tours en attente restent dans le prompt tant que leur résumé n'est pas prêt
+            for question, answer in self.pending + self.turns:
+                messages += [HumanMessage(content=question), AIMessage(content=answer)]
+        messages.append(HumanMessage(content=user_input))
+        return messages
+
+    def add_turn(self, question, answer):
+        """Mémorise un tour ; les plus anciens sortent de la fenêtre et partent au résumé."""
+        with self.lock:
+            self.turns.append((question, answer))
+            while len(self.turns) > 1 and (len(self.turns) > self.keep_turns or
+                                           self.count_tokens([t for turn in self.turns for t in turn]) > self.token_budget):
+                self.pending.append(self.turns.pop(0))
+            # Résumé en échec ou en retard : on abandonne les plus anciens plutôt que de laisser le prompt grossir
+            while len(self.pending) > self.max_pending:
+                self.pending.pop(0)
+                self.dropped_turns += 1
+            if self.pending and self.worker is None:
+                self.worker = threading.Thread(target=self.summarize_pending, daemon=True)
+                self.worker.start()
+
+    def summarize_pending(self):
+        """Thread d'arrière-plan : intègre les tours en attente au résumé (mise à jour incrémentale)."""
+        while True:
+            with self.lock:
+                batch, summary = list(self.pending), self.summary
+                if not batch:
+                    self.worker = None
+                    return
+            transcript = "\n".join(f"Utilisateur : {q}\nAssistant : {a}" for q, a in batch)
+            prompt = (f"Résumé actuel de la conversation :\n{summary or '(vide)'}\n\n"
+                      f"Nouveaux échanges :\n{transcript}\n\n"
+                      f"Mets à jour le résumé en y intégrant ces échanges. Garde les faits, noms et préférences "
+                      f"utiles pour la suite, en {SUMMARY_MAX_WORDS} mots maximum. Réponds uniquement par le résumé.")
+            try:
+                new_summary = self.llm.invoke([HumanMessage(content=prompt)]).content.strip()
+            except Exception as e:
+                # Les tours restent en attente : nouvel essai au prochain tour
+                with self.lock:
+                    self.worker = None
+                print(f"\n[Mémoire] Résumé impossible ({e}), nouvel essai au prochain tour.")
+                return
+            with self.lock:
+                # Retirés de l'attente seulement maintenant : ils sont dans le résumé stocké
+                # (par identité : add_turn a pu abandonner des tours du lot entre-temps)
+                self.summary = new_summary
+                summarized = {id(turn) for turn in batch}
+                self.pending = [turn for turn in self.pending if id(turn) not in summarized]
+                self.summarized_turns += len(batch)
+
+    def stats(self, messages):
+        with self.lock:
+            status = " | résumé en cours..." if self.worker else ""
+            if self.dropped_turns:
+                status += f" | {self.dropped_turns} tour(s) abandonné(s)"
+            return (f"prompt {self.count_tokens([m.content for m in messages])} jetons | "
+                    f"{len(self.turns)} tour(s) mot pour mot | {self.summarized_turns} tour(s) résumé(s){status}")
@@ -53,24 +53,30 @@ with tab_demo:
 
 with tab_code:
     st.header("Aperçu du Code Source")
-    st.write("Voici les extraits clés qui gèrent l'accumulation de l'historique (lignes 35, 56 et 69) :")
+    st.write("Voici les extraits clés qui gèrent l'accumulation de l'historique (lignes 39, 61 et 75), la mémoire bornée vivant dans `chat_memory.py` :")
     try:
         root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         file_path = os.path.join(root_dir, "A02_chat_terminal.py")
         
         with open(file_path, "r", encoding="utf-8") as f:
             lines = f.readlines()
+        with open(os.path.join(root_dir, "chat_memory.py"), "r", encoding="utf-8") as f:
+            memory_lines = f.readlines()
         
         st.markdown("**1. Initialisation de la mémoire avec le contexte système :**")
-        snippet1 = "".join(lines[33:39])
+        snippet1 = "".join(lines[37:44])
         st.code(snippet1, language="python")
 
         st.markdown("**2. Ajout des messages Utilisateur et IA dans la boucle :**")
-        snippet2 = "".join(lines[53:70])
+        snippet2 = "".join(lines[59:76])
         st.code(snippet2, language="python")
 
+        st.markdown("**3. Mémoire bornée : les tours anciens partent au résumé (arrière-plan) :**")
+        snippet3 = "".join(memory_lines[65:80])
+        st.code(snippet3, language="python")
+
     except FileNotFoundError:
-        st.error("Fichier A02_chat_terminal.py introuvable.")
+        st.error("Fichier A02_chat_terminal.py ou chat_memory.py introuvable.")
 
 with tab_conclusion:
     st.header("Ouverture SI d'Entreprise")
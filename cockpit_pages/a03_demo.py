@@ -94,7 +94,7 @@ Elle tourne de manière totalement isolée sur le port `8502`.
 
 with tab_code:
     st.header("Aperçu du Code Source")
-    st.write("Voici les extraits clés qui gèrent l'historique et le streaming (lignes 36 à 47) :")
+    st.write("Voici les extraits clés qui gèrent l'historique et le streaming (lignes 128 à 143) :")
     try:
         root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         file_path = os.path.join(root_dir, "A03_streamlit_chat.py")
@@ -104,7 +104,7 @@ with tab_code:
         
         # Gestion historique et stream
         st.markdown("**Gestion de l'historique et appel en streaming :**")
-        snippet = "".join(lines[35:48])
+        snippet = "".join(lines[39:55])
         st.code(snippet, language="python")
 
     except FileNotFoundError:
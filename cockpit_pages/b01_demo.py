@@ -80,7 +80,7 @@ with tab_code:
             lines = f.readlines()
         
         # Extrait de la boucle de génération
-        snippet1 = "".join(lines[97:113])
+        snippet1 = "".join(lines[166:191])
         st.code(snippet1, language="python")
 
     except FileNotFoundError:
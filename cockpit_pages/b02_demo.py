@@ -148,11 +148,11 @@ with tab_code:
             
         st.subheader("1. L'Indexation dans la base FAISS (B02a)")
         st.markdown("**Le découpage (Chunking) et la Vectorisation :**")
-        snippet_a1 = "".join(lines_a[51:67])
+        snippet_a1 = "".join(lines_a[598:622])
         st.code(snippet_a1, language="python")
         
         st.markdown("**La sauvegarde dans FAISS :**")
-        snippet_a2 = "".join(lines_a[71:79])
+        snippet_a2 = "".join(lines_a[559:596])
         st.code(snippet_a2, language="python")
 
         # Extrait B02c (Recherche)
@@ -163,7 +163,7 @@ with tab_code:
             
         st.subheader("2. La Recherche et Génération (RAG) (B02c)")
         st.markdown("**La récupération sémantique et la construction du contexte :**")
-        snippet_c = "".join(lines_c[101:114])
+        snippet_c = "".join(lines_c[607:629])
         st.code(snippet_c, language="python")
 
     except FileNotFoundError:
@@ -90,11 +90,11 @@ with tab_code:
             lines = f.readlines()
         
         st.markdown("**La définition du Routeur Intelligent :**")
-        snippet1 = "".join(lines[88:117])
+        snippet1 = "".join(lines[372:427])
         st.code(snippet1, language="python")
 
         st.markdown("**L'Assemblage du Graphe :**")
-        snippet2 = "".join(lines[138:152])
+        snippet2 = "".join(lines[465:485])
         st.code(snippet2, language="python")
 
     except FileNotFoundError:
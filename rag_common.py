@@ -0,0 +1,797 @@
+import os
+import re
+import json
+import time
+import zlib
+import math
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+import faiss
+import tiktoken
+import numpy as np
+from datetime import datetime
+from collections import OrderedDict
+from fastembed.rerank.cross_encoder import TextCrossEncoder
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.base import Docstore
+
+# ==============================================================================
+# Demo LLM - Phase B : Briques RAG partagées
+# ==============================================================================
+# ASPECT CLÉ : Les scripts B02a, B02b, B02c, B02d, B02e et B03 lisent et écrivent les
+# MÊMES fichiers (journal d'ingestion, index BM25, table des quasi-doublons, cache
+# d'embeddings...). Les classes qui définissent ces formats vivent ici, en un seul
+# exemplaire : un changement (tokenizer, schéma SQLite) s'applique à tous les scripts
+# à la fois, les écrivains et les lecteurs ne peuvent plus diverger. Le reranking
+# (cross-encoder) y est aussi partagé, pour que B02d mesure le code exécuté par B02b/B02c,
+# ainsi que l'assemblage du contexte et les caches de questions / réponses de B02b et B02c.
+# ==============================================================================
+
+EMBEDDING_CACHE_DIR = os.path.join("data", "embedding_cache")
+ENTITY_TYPES = ("hero", "movie", "vilain")
+# Reranking : modèle cross-encoder (ONNX, FastEmbed) et budget de latence par question (ms)
+RERANK_MODEL = "Xenova/ms-marco-MiniLM-L-6-v2"
+RERANK_BUDGET_MS = 150
+# Assemblage du contexte : recouvrement du découpage (B02a) et budget de tokens du contexte
+CHUNK_OVERLAP = 200
+CONTEXT_TOKEN_BUDGET = 1000
+TOKENIZER = None
+# Cache des questions : nombre d'embeddings de questions gardés en mémoire (LRU)
+QUERY_CACHE_SIZE = 1024
+# Cache sémantique : similarité cosinus minimale, nombre de réponses, durée de vie (s)
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_SIZE = 256
+ANSWER_CACHE_TTL = 3600
+# Quasi-doublons : 128 fonctions MinHash en 16 bandes LSH de 8 (candidats dès ~70 % de
+# similarité), doublon confirmé au-delà de 85 % de similarité de Jaccard estimée
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 16
+SHINGLE_SIZE = 5
+DEDUP_THRESHOLD = 0.85
+MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.default_rng(42)  # graine fixe : signatures identiques d'une exécution à l'autre
+MINHASH_A = _rng.integers(1, 1 << 31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+MINHASH_B = _rng.integers(0, 1 << 31, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+# ------------------------------------------------------------------------------
+# SECTION 1 : JOURNAL D'INGESTION (B02a, B02c)
+# ------------------------------------------------------------------------------
+
+class IngestionJournal:
+    """
+    ASPECT CLÉ : Journal d'ingestion en écriture anticipée (SQLite, une transaction par étape).
+    - files       : état PUBLIÉ de chaque fichier (empreinte, IDs des chunks), source de processed_files.json
+    - runs        : une exécution d'ingestion, 'running' tant que l'index n'est pas publié
+    - batches     : lots déclarés 'pending' AVANT l'embedding, 'committed' une fois le point de reprise écrit
+    - batch_files : fichiers couverts par chaque lot
+    """
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (filename TEXT PRIMARY KEY, hash TEXT NOT NULL, chunks TEXT NOT NULL, indexed_at TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, state TEXT NOT NULL, rebuild INTEGER NOT NULL, "
+                          "started_at TEXT, finished_at TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS batches (id INTEGER PRIMARY KEY, run INTEGER NOT NULL, state TEXT NOT NULL, "
+                          "chunks INTEGER NOT NULL, created_at TEXT, committed_at TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS batch_files (batch INTEGER NOT NULL, filename TEXT NOT NULL, hash TEXT NOT NULL, "
+                          "chunks TEXT NOT NULL, indexed_at TEXT, PRIMARY KEY (batch, filename))")
+        self.conn.commit()
+
+    @staticmethod
+    def now():
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def import_tracking(self, processed_files):
+        """Migration : un journal neuf reprend processed_files.json (sauf format historique nom -> date)."""
+        if self.conn.execute("SELECT 1 FROM files UNION ALL SELECT 1 FROM runs LIMIT 1").fetchone():
+            return
+        if any(not isinstance(entry, dict) for entry in processed_files.values()):
+            return
+        with self.conn:
+            self.conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", [
+                (name, entry["hash"], json.dumps(entry.get("chunks", [])), entry.get("indexed_at"))
+                for name, entry in processed_files.items()
+            ])
+
+    def published_files(self):
+        """État publié, au format de processed_files.json."""
+        rows = self.conn.execute("SELECT filename, hash, chunks, indexed_at FROM files ORDER BY filename")
+        return {name: {"hash": h, "chunks": json.loads(chunks), "indexed_at": at} for name, h, chunks, at in rows}
+
+    def resume(self, checkpoint_batch):
+        """
+        Exécution interrompue : les lots contenus dans le point de reprise sont validés (crash entre
+        l'écriture de l'index et celle du journal), les lots suivants sont abandonnés.
+        Retourne (id, rebuild, fichiers déjà validés) ou None si aucune exécution n'est en cours.
+        """
+        row = self.conn.execute("SELECT id, rebuild FROM runs WHERE state = 'running' ORDER BY id DESC LIMIT 1").fetchone()
+        if row is None:
+            return None
+        run_id, rebuild = row
+        with self.conn:
+            self.conn.execute("UPDATE batches SET state = 'committed', committed_at = ? WHERE run = ? AND state = 'pending' AND id <= ?",
+                              (self.now(), run_id, checkpoint_batch))
+            self.conn.execute("DELETE FROM batch_files WHERE batch IN (SELECT id FROM batches WHERE run = ? AND id > ?)",
+                              (run_id, checkpoint_batch))
+            self.conn.execute("DELETE FROM batches WHERE run = ? AND id > ?", (run_id, checkpoint_batch))
+        files = {}
+        for name, h, chunks, at in self.conn.execute(
+                "SELECT f.filename, f.hash, f.chunks, f.indexed_at FROM batch_files f JOIN batches b ON b.id = f.batch "
+                "WHERE b.run = ? ORDER BY b.id", (run_id,)):
+            files[name] = {"hash": h, "chunks": json.loads(chunks), "indexed_at": at}
+        return run_id, bool(rebuild), files
+
+    def start_run(self, rebuild):
+        with self.conn:
+            return self.conn.execute("INSERT INTO runs (state, rebuild, started_at) VALUES ('running', ?, ?)",
+                                     (int(rebuild), self.now())).lastrowid
+
+    def begin_batch(self, run_id, files, chunk_count):
+        """Écriture anticipée : le lot et ses fichiers sont journalisés AVANT l'embedding."""
+        with self.conn:
+            batch_id = self.conn.execute("INSERT INTO batches (run, state, chunks, created_at) VALUES (?, 'pending', ?, ?)",
+                                         (run_id, chunk_count, self.now())).lastrowid
+            self.conn.executemany("INSERT INTO batch_files VALUES (?, ?, ?, ?, ?)", [
+                (batch_id, name, entry["hash"], json.dumps(entry["chunks"]), entry["indexed_at"]) for name, entry in files.items()
+            ])
+        return batch_id
+
+    def commit_batches(self, run_id, last_batch):
+        """Validation des lots jusqu'à last_batch, appelée APRÈS l'écriture du point de reprise."""
+        with self.conn:
+            self.conn.execute("UPDATE batches SET state = 'committed', committed_at = ? WHERE run = ? AND state = 'pending' AND id <= ?",
+                              (self.now(), run_id, last_batch))
+
+    def publish(self, run_id, processed_files):
+        """Une seule transaction : nouvel état publié, exécution close, fichiers des lots purgés."""
+        with self.conn:
+            self.conn.execute("DELETE FROM files")
+            self.conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", [
+                (name, entry["hash"], json.dumps(entry["chunks"]), entry.get("indexed_at"))
+                for name, entry in processed_files.items()
+            ])
+            self.conn.execute("UPDATE runs SET state = 'published', finished_at = ? WHERE id = ?", (self.now(), run_id))
+            self.conn.execute("DELETE FROM batch_files WHERE batch IN (SELECT id FROM batches WHERE run = ?)", (run_id,))
+
+    def close(self):
+        self.conn.close()
+
+# ------------------------------------------------------------------------------
+# SECTION 2 : ENTITÉS ET INDEX LEXICAL BM25 (B02a, B02b, B02c, B02d, B02e)
+# ------------------------------------------------------------------------------
+
+def entity_from_filename(filename):
+    """'hero_iron_man.txt' -> ('hero', 'iron_man'). Préfixe inconnu : type 'autre'."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    entity_type, _, entity = stem.partition("_")
+    if entity_type not in ENTITY_TYPES or not entity:
+        return "autre", stem
+    return entity_type, entity
+
+def chunk_matches(chunk_id, filters):
+    """Un chunk respecte-t-il les filtres ? (l'ID commence par le nom du fichier source)"""
+    entity_type, entity = entity_from_filename(chunk_id.split("::")[0])
+    return filters.get("entity_type", entity_type) == entity_type and filters.get("entity", entity) == entity
+
+STOPWORDS = {
+    "le", "la", "les", "de", "des", "du", "un", "une", "et", "ou", "en", "est", "au", "aux",
+    "dans", "pour", "par", "sur", "avec", "qui", "que", "quoi", "quel", "quelle", "quels", "quelles",
+    "il", "elle", "ils", "elles", "ce", "cet", "cette", "ces", "se", "sa", "son", "ses", "leur",
+    "leurs", "ne", "pas", "plus", "comment", "pourquoi", "the", "of", "and", "to", "in", "is"
+}
+
+def tokenize(text):
+    """
+    Minuscules, accents retirés, mots d'au moins 2 caractères hors mots vides.
+    ASPECT CLÉ : Le MÊME découpage sert à l'indexation (B02a, B02c) et aux questions
+    (B02b, B02c, B02d, B02e) : sinon les termes cherchés ne sont pas ceux indexés.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in re.findall(r"\w+", text) if len(t) > 1 and t not in STOPWORDS]
+
+class BM25Index:
+    """
+    Index inversé BM25 persistant (SQLite), un fichier bm25.sqlite par version publiée :
+    - chunks   : id du chunk (le même que dans FAISS), longueur en mots, texte, métadonnées
+    - postings : terme -> (id du chunk, fréquence du terme dans le chunk)
+    Les statistiques globales (N, longueur moyenne, df) se déduisent des tables à la requête.
+    read_only=True : ouverture en lecture seule (lecteurs), la version publiée n'est jamais modifiée.
+    """
+    def __init__(self, path, k1=1.5, b=0.75, read_only=False):
+        self.k1 = k1
+        self.b = b
+        if read_only:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, length INTEGER NOT NULL, page_content TEXT, metadata TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL, "
+                          "PRIMARY KEY (term, chunk_id)) WITHOUT ROWID")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id)")
+
+    def clear(self):
+        self.conn.execute("DELETE FROM postings")
+        self.conn.execute("DELETE FROM chunks")
+
+    def add_documents(self, docs, ids):
+        for doc, chunk_id in zip(docs, ids):
+            terms = tokenize(doc.page_content)
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            self.conn.execute("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                              (chunk_id, len(terms), doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)))
+            self.conn.executemany("INSERT OR REPLACE INTO postings VALUES (?, ?, ?)",
+                                  [(term, chunk_id, tf) for term, tf in counts.items()])
+
+    def delete(self, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), 500):  # limite SQLite sur le nombre de paramètres
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            self.conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", batch)
+            self.conn.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", batch)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def search(self, query, k=3, filters=None):
+        n, avg_length = self.conn.execute("SELECT COUNT(*), AVG(length) FROM chunks").fetchone()
+        if not n:
+            return []
+        scores = {}
+        for term in set(tokenize(query)):
+            rows = self.conn.execute("SELECT p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.chunk_id "
+                                     "WHERE p.term = ?", (term,)).fetchall()
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            for chunk_id, tf, length in rows:
+                norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        if filters:
+            # Filtre appliqué AVANT la coupure top-k : pas de résultat filtré perdu
+            scores = {chunk_id: score for chunk_id, score in scores.items() if chunk_matches(chunk_id, filters)}
+        docs = []
+        for chunk_id in sorted(scores, key=scores.get, reverse=True)[:k]:
+            content, metadata = self.conn.execute("SELECT page_content, metadata FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+            docs.append(Document(id=chunk_id, page_content=content, metadata=json.loads(metadata)))
+        return docs
+
+# ------------------------------------------------------------------------------
+# SECTION 3 : QUASI-DOUBLONS, MINHASH + LSH (B02a, B02c)
+# ------------------------------------------------------------------------------
+
+def minhash_signature(text):
+    """
+    Signature MinHash des 5-grammes de mots (mêmes mots que BM25) : pour chaque permutation
+    (a * h + b) mod p, on garde le minimum. Deux textes partagent une valeur avec une
+    probabilité égale à leur similarité de Jaccard. None pour un texte sans mot utile.
+    """
+    terms = tokenize(text)
+    if not terms:
+        return None
+    shingles = {" ".join(terms[i:i + SHINGLE_SIZE]) for i in range(max(1, len(terms) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    return ((MINHASH_A[:, None] * hashes[None, :] + MINHASH_B[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+class NearDuplicateIndex:
+    """
+    Index LSH persistant (SQLite) des chunks indexés, consulté avant chaque embedding :
+    - signatures : signature MinHash des chunks conservés (les "représentants")
+    - buckets    : une clé par bande LSH ; deux chunks qui partagent une bande sont candidats
+    - duplicates : chunk écarté -> représentant, avec la source du chunk écarté
+    Un candidat n'est retenu que si la similarité estimée atteint DEDUP_THRESHOLD et s'il
+    vient de la même entité (entity_type, entity) : un passage de hero_thor.txt n'est jamais
+    remplacé par celui de movie_thor_2011.txt, les filtres et shards par entité le retrouvent.
+    """
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS signatures (chunk_id TEXT PRIMARY KEY, signature BLOB NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS buckets (band INTEGER NOT NULL, bucket INTEGER NOT NULL, chunk_id TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets (band, bucket)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS buckets_chunk ON buckets (chunk_id)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS duplicates (chunk_id TEXT PRIMARY KEY, canonical_id TEXT NOT NULL, source TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates (canonical_id)")
+        self.checked = 0
+        self.dropped = 0
+
+    def clear(self):
+        for table in ("signatures", "buckets", "duplicates"):
+            self.conn.execute(f"DELETE FROM {table}")
+
+    @staticmethod
+    def scope(chunk_id):
+        """Entité du chunk (d'après son fichier source) : la déduplication ne franchit pas cette limite."""
+        return entity_from_filename(chunk_id.split("::")[0])
+
+    @staticmethod
+    def band_keys(signature):
+        rows = MINHASH_PERMUTATIONS // LSH_BANDS
+        return [(band, int.from_bytes(hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8).digest(),
+                                      "big", signed=True)) for band in range(LSH_BANDS)]
+
+    def register(self, chunk_id, signature):
+        self.conn.execute("INSERT OR REPLACE INTO signatures VALUES (?, ?)", (chunk_id, signature.tobytes()))
+        self.conn.execute("DELETE FROM buckets WHERE chunk_id = ?", (chunk_id,))
+        self.conn.executemany("INSERT INTO buckets VALUES (?, ?, ?)", [(band, key, chunk_id) for band, key in self.band_keys(signature)])
+
+    def find_canonical(self, chunk_id, signature):
+        """Représentant le plus proche parmi les candidats LSH (une seule requête), ou None."""
+        keys = self.band_keys(signature)
+        values = ",".join("(?, ?)" for _ in keys)
+        rows = self.conn.execute(
+            f"SELECT DISTINCT s.chunk_id, s.signature FROM buckets b JOIN signatures s ON s.chunk_id = b.chunk_id "
+            f"WHERE (b.band, b.bucket) IN (VALUES {values})", [v for key in keys for v in key]).fetchall()
+        best_id, best_similarity = None, DEDUP_THRESHOLD
+        scope = self.scope(chunk_id)
+        for candidate_id, blob in rows:
+            if self.scope(candidate_id) != scope:
+                continue
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint64) == signature))
+            if candidate_id != chunk_id and similarity >= best_similarity:
+                best_id, best_similarity = candidate_id, similarity
+        return best_id
+
+    def filter(self, docs, ids):
+        """
+        ASPECT CLÉ : Appelé sur chaque lot AVANT l'embedding. Un chunk déjà écarté le reste,
+        un représentant déjà connu est gardé (rejeu idempotent après une reprise).
+        """
+        kept_docs, kept_ids = [], []
+        for doc, chunk_id in zip(docs, ids):
+            self.checked += 1
+            if self.conn.execute("SELECT 1 FROM duplicates WHERE chunk_id = ?", (chunk_id,)).fetchone():
+                self.dropped += 1
+                continue
+            if not self.conn.execute("SELECT 1 FROM signatures WHERE chunk_id = ?", (chunk_id,)).fetchone():
+                signature = minhash_signature(doc.page_content)
+                canonical_id = self.find_canonical(chunk_id, signature) if signature is not None else None
+                if canonical_id is not None:
+                    self.conn.execute("INSERT OR REPLACE INTO duplicates VALUES (?, ?, ?)",
+                                      (chunk_id, canonical_id, doc.metadata.get("source", chunk_id.split("::")[0])))
+                    self.dropped += 1
+                    continue
+                if signature is not None:
+                    self.register(chunk_id, signature)
+            kept_docs.append(doc)
+            kept_ids.append(chunk_id)
+        return kept_docs, kept_ids
+
+    def register_existing(self, vector_db):
+        """Index créé avant la déduplication : ses chunks deviennent des représentants (rien n'est retiré)."""
+        for doc_id in vector_db.index_to_docstore_id.values():
+            signature = minhash_signature(vector_db.docstore.search(doc_id).page_content)
+            if signature is not None:
+                self.register(doc_id, signature)
+
+    def forget(self, ids):
+        """Chunks supprimés de l'index ou disparus des fichiers sources."""
+        for i in range(0, len(ids), 500):  # limite SQLite sur le nombre de paramètres
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            for table in ("signatures", "buckets", "duplicates"):
+                self.conn.execute(f"DELETE FROM {table} WHERE chunk_id IN ({placeholders})", batch)
+
+    def cross_scope(self):
+        """Chunks écartés au profit d'une autre entité (base dédupliquée avant le cloisonnement par entité)."""
+        return [c for c, canonical in self.conn.execute("SELECT chunk_id, canonical_id FROM duplicates")
+                if self.scope(c) != self.scope(canonical)]
+
+    def orphans(self, live_ids):
+        """
+        Chunks écartés dont le représentant n'est plus dans l'index (ou appartient à une autre
+        entité) : retirés de la table, ils sont à réintégrer. Les signatures de chunks absents
+        de l'index sont purgées.
+        """
+        orphan_ids = [c for c, canonical in self.conn.execute("SELECT chunk_id, canonical_id FROM duplicates")
+                      if canonical not in live_ids or self.scope(c) != self.scope(canonical)]
+        stale_ids = [c for (c,) in self.conn.execute("SELECT chunk_id FROM signatures") if c not in live_ids]
+        self.forget(orphan_ids + stale_ids)
+        return orphan_ids
+
+    def all_duplicates(self):
+        return [c for (c,) in self.conn.execute("SELECT chunk_id FROM duplicates")]
+
+    def sources(self):
+        """Représentant -> autres sources où son passage apparaît."""
+        sources = {}
+        for canonical_id, source in self.conn.execute("SELECT canonical_id, source FROM duplicates ORDER BY source"):
+            if source not in sources.setdefault(canonical_id, []):
+                sources[canonical_id].append(source)
+        return sources
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+def tag_duplicate_sources(vector_db, sources):
+    """Métadonnée also_in des représentants (retirée des chunks qui n'ont plus de doublon)."""
+    for doc_id in vector_db.index_to_docstore_id.values():
+        doc = vector_db.docstore.search(doc_id)
+        if doc_id in sources:
+            doc.metadata["also_in"] = sources[doc_id]
+        else:
+            doc.metadata.pop("also_in", None)
+
+# ------------------------------------------------------------------------------
+# SECTION 4 : CACHE D'EMBEDDINGS SUR DISQUE (B02a, B02c)
+# ------------------------------------------------------------------------------
+
+def compute_hash(content):
+    """Empreinte SHA-256 d'un contenu (texte ou octets)."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Enveloppe un modèle d'embeddings avec un cache persistant clé (modèle, empreinte du chunk).
+    - vectors.f32 : matrice float32 brute, lue via np.memmap (pas de chargement complet en RAM)
+    - index.sqlite : table empreinte -> numéro de ligne dans la matrice
+    Seuls les textes absents du cache (les "miss") sont envoyés au modèle.
+    """
+    def __init__(self, model_name, cache_root=EMBEDDING_CACHE_DIR, batch_size=256, parallel=None):
+        self.model_kwargs = {"model_name": model_name, "batch_size": batch_size, "parallel": parallel}
+        self._model = None
+        self.cache_dir = os.path.join(cache_root, model_name.replace("/", "__"))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        # timeout : attente du verrou d'écriture si un autre processus ajoute des vecteurs
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"), timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS cache (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        self.dim = int(row[0]) if row else None
+        self.hits = 0
+        self.misses = 0
+
+    def _read_rows(self, rows):
+        matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r").reshape(-1, self.dim)
+        return matrix[rows].tolist()
+
+    @property
+    def model(self):
+        """Modèle chargé au premier texte absent du cache : une passe servie par le cache ne paie pas ONNX."""
+        if self._model is None:
+            self._model = FastEmbedEmbeddings(**self.model_kwargs)
+        return self._model
+
+    def _lookup(self, hashes):
+        """Empreinte -> numéro de ligne, pour les empreintes déjà en cache."""
+        known = {}
+        for i in range(0, len(hashes), 500):  # limite SQLite sur le nombre de paramètres
+            batch = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            known.update(self.db.execute(f"SELECT hash, row FROM cache WHERE hash IN ({placeholders})", batch).fetchall())
+        return known
+
+    def _store(self, hashes, vectors):
+        """
+        Ajoute les vecteurs en fin de matrice puis enregistre leurs lignes (vecteurs écrits AVANT l'index).
+        ASPECT CLÉ : BEGIN IMMEDIATE prend le verrou d'écriture SQLite AVANT de lire la taille de
+        la matrice : deux processus (B02a, B02c) ne peuvent pas s'attribuer les mêmes lignes.
+        """
+        row_bytes = 4 * vectors.shape[1]
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute("INSERT OR IGNORE INTO meta VALUES ('dim', ?)", (str(vectors.shape[1]),))
+            size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+            first_row = -(-size // row_bytes)  # une ligne incomplète (écriture interrompue) est sautée
+            with open(self.vectors_path, "r+b" if size else "wb") as f:
+                f.seek(first_row * row_bytes)
+                f.write(vectors.tobytes())
+            # INSERT OR IGNORE : un texte ajouté entre-temps par un autre processus garde sa ligne
+            self.db.executemany("INSERT OR IGNORE INTO cache VALUES (?, ?)",
+                                [(h, first_row + i) for i, h in enumerate(hashes)])
+            self.db.commit()
+        except BaseException:
+            self.db.rollback()
+            raise
+        return self._lookup(hashes)
+
+    def embed_documents(self, texts):
+        hashes = [compute_hash(t) for t in texts]
+        known = self._lookup(hashes)
+
+        # 1. Calcul des seuls textes manquants (dédupliqués) en un appel au modèle
+        missing = {}
+        for text, h in zip(texts, hashes):
+            if h not in known and h not in missing:
+                missing[h] = text
+        self.hits += sum(1 for h in hashes if h in known)
+        self.misses += len(missing)
+
+        if missing:
+            new_vectors = np.asarray(self.model.embed_documents(list(missing.values())), dtype=np.float32)
+            if self.dim is None:
+                self.dim = new_vectors.shape[1]
+            known.update(self._store(list(missing), new_vectors))
+
+        return self._read_rows([known[h] for h in hashes]) if hashes else []
+
+    def embed_query(self, text):
+        return self.model.embed_query(text)
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return f"{self.hits} hit(s) / {self.misses} miss(es) ({rate:.0f}% servis par le cache)"
+
+# ------------------------------------------------------------------------------
+# SECTION 5 : LECTURE DU FORMAT MMAP (B02b, B02c, B02d, B02e, B03)
+# ------------------------------------------------------------------------------
+
+class SqliteDocstore(Docstore):
+    """Docstore en lecture seule (format mmap) : un document n'est lu dans SQLite que lorsque FAISS le renvoie."""
+    def __init__(self, path):
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def search(self, search):
+        row = self.conn.execute("SELECT id, page_content, metadata FROM docs WHERE row = ?", (int(search),)).fetchone()
+        if row is None:
+            return f"Document {search} introuvable."
+        return Document(id=row[0], page_content=row[1], metadata=json.loads(row[2]))
+
+class RowIdentityMapping:
+    """index_to_docstore_id paresseux : la position dans FAISS sert directement de clé SQLite."""
+    def __init__(self, ntotal):
+        self.ntotal = ntotal
+
+    def __getitem__(self, i):
+        return int(i)
+
+    def __len__(self):
+        return self.ntotal
+
+def load_mmap_vector_db(index_dir, embeddings):
+    """
+    ASPECT CLÉ : Format mmap (B02a --format mmap) : pas de pickle, démarrage en millisecondes.
+    L'index est mappé en mémoire (pages partagées entre processus via le cache de l'OS).
+    """
+    # IO_FLAG_MMAP_IFC : les codes des index plats (Flat, stockage HNSW) restent sur disque.
+    # Fonctionne aussi pour les index IVF-PQ, quel que soit le type choisi dans B02a.
+    flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+    index = faiss.read_index(os.path.join(index_dir, "index.faiss"), flags)
+    docstore = SqliteDocstore(os.path.join(index_dir, "docstore.sqlite"))
+    return FAISS(embeddings, index, docstore, RowIdentityMapping(index.ntotal))
+
+# ------------------------------------------------------------------------------
+# SECTION 6 : RERANKING PAR CROSS-ENCODER (B02b, B02c, B02d)
+# ------------------------------------------------------------------------------
+
+class CrossEncoderReranker:
+    """
+    Reranking par un petit cross-encoder ONNX local (FastEmbed) : chaque paire (question, chunk)
+    est notée par le modèle, tous les candidats en UN seul appel d'inférence.
+    ASPECT CLÉ : Budget de latence par question. Si la recherche a déjà consommé le budget, on
+    garde l'ordre de la fusion RRF ; sinon on ne note que les candidats que le budget restant
+    permet, d'après le coût par candidat mesuré sur les appels précédents.
+    """
+    def __init__(self, model_name=RERANK_MODEL, budget_ms=RERANK_BUDGET_MS):
+        self.model = TextCrossEncoder(model_name=model_name)
+        self.budget_ms = budget_ms
+        self.ms_per_candidate = None
+        self.reranked = 0
+        self.skipped = 0
+        list(self.model.rerank("warmup", ["warmup"]))  # chargement de la session ONNX hors budget
+
+    def rerank(self, query, docs, top_n=3, elapsed_ms=0.0, budget_ms=None):
+        if len(docs) <= top_n:
+            return docs
+        remaining = (self.budget_ms if budget_ms is None else budget_ms) - elapsed_ms
+        n = len(docs)
+        if self.ms_per_candidate and remaining < n * self.ms_per_candidate:
+            n = int(max(remaining, 0) / self.ms_per_candidate)
+        if remaining <= 0 or n <= top_n:
+            # Budget épuisé : les top-n de la fusion, sans reranking
+            self.skipped += 1
+            return docs[:top_n]
+        start = time.perf_counter()
+        scores = list(self.model.rerank(query, [d.page_content for d in docs[:n]], batch_size=n))
+        cost = (time.perf_counter() - start) * 1000 / n
+        self.ms_per_candidate = cost if self.ms_per_candidate is None else 0.8 * self.ms_per_candidate + 0.2 * cost
+        self.reranked += 1
+        order = sorted(range(n), key=lambda i: scores[i], reverse=True)
+        return [docs[i] for i in order[:top_n]]
+
+# ------------------------------------------------------------------------------
+# SECTION 7 : ASSEMBLAGE DU CONTEXTE SOUS BUDGET DE TOKENS (B02b, B02c)
+# ------------------------------------------------------------------------------
+
+def get_tokenizer():
+    """Tokenizer tiktoken du modèle LLM configuré (cl100k_base si le modèle est inconnu de tiktoken)."""
+    global TOKENIZER
+    if TOKENIZER is None:
+        try:
+            TOKENIZER = tiktoken.encoding_for_model(os.getenv("LLM_MODEL") or "")
+        except KeyError:
+            TOKENIZER = tiktoken.get_encoding("cl100k_base")
+    return TOKENIZER
+
+def overlap_length(head, tail, min_overlap=20, max_overlap=CHUNK_OVERLAP):
+    """Longueur du plus long suffixe de `head` qui est aussi un préfixe de `tail` (0 si aucun)."""
+    for size in range(min(len(head), len(tail), max_overlap), min_overlap - 1, -1):
+        if head.endswith(tail[:size]):
+            return size
+    return 0
+
+def join_overlapping(a, b):
+    """Texte fusionné si `a` et `b` se recouvrent ou si l'un contient l'autre, sinon None."""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    size = overlap_length(a, b)
+    if size:
+        return a + b[size:]
+    size = overlap_length(b, a)
+    if size:
+        return b + a[size:]
+    return None
+
+def merge_chunks(docs):
+    """
+    Regroupe les chunks voisins d'une même fiche : le recouvrement du découpage (chunk_overlap)
+    n'apparaît plus qu'une fois. Renvoie des segments [source, texte], classés selon le chunk
+    le plus pertinent de chacun ; un chunk qui relie deux segments les fusionne.
+    """
+    segments = []
+    for doc in docs:
+        source = doc.metadata.get("source", (doc.id or "").split("::")[0])
+        text, kept, position = doc.page_content, [], None
+        for segment in segments:
+            merged = join_overlapping(segment[1], text) if segment[0] == source else None
+            if merged is None:
+                kept.append(segment)
+                continue
+            text = merged
+            if position is None:
+                position = len(kept)
+                kept.append(None)
+        if position is None:
+            kept.append([source, text])
+        else:
+            kept[position] = [source, text]
+        segments = kept
+    return segments
+
+def pack_context(docs, max_tokens=CONTEXT_TOKEN_BUDGET, separator="\n\n---\n\n"):
+    """
+    ASPECT CLÉ : Assemblage du contexte sous budget de tokens (mesuré avec le tokenizer du LLM).
+    Chunks voisins fusionnés sans leur recouvrement, puis segments ajoutés par pertinence
+    décroissante jusqu'au budget (le dernier est tronqué s'il reste au moins 50 tokens).
+    Renvoie (contexte, tokens de la concaténation brute, tokens du contexte assemblé).
+    """
+    tokenizer = get_tokenizer()
+    naive_tokens = len(tokenizer.encode(separator.join(doc.page_content for doc in docs)))
+    separator_tokens = len(tokenizer.encode(separator))
+    parts, used = [], 0
+    for _, text in merge_chunks(docs):
+        cost = separator_tokens if parts else 0
+        tokens = tokenizer.encode(text)
+        if used + cost + len(tokens) <= max_tokens:
+            parts.append(text)
+            used += cost + len(tokens)
+        elif max_tokens - used - cost >= 50:
+            parts.append(tokenizer.decode(tokens[:max_tokens - used - cost]))
+            break
+        else:
+            break
+    context = separator.join(parts)
+    return context, naive_tokens, len(tokenizer.encode(context))
+
+# ------------------------------------------------------------------------------
+# SECTION 8 : CACHES DES QUESTIONS ET DES RÉPONSES (B02b, B02c)
+# ------------------------------------------------------------------------------
+
+def normalize_query(text):
+    """'Qui est Thor ?' -> 'qui est thor' : minuscules, sans accents ni ponctuation."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", text))
+
+class QueryEmbeddingCache(Embeddings):
+    """
+    Couche 1 : LRU en mémoire des embeddings de questions, indexé par le texte normalisé.
+    Les documents (ingestion) ne passent pas par ce cache.
+    """
+    def __init__(self, model, max_size=QUERY_CACHE_SIZE):
+        self.model = model
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        vector = self.model.embed_query(text)
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = vector
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return vector
+
+class SemanticAnswerCache:
+    """
+    Couche 2 : cache sémantique des réponses. Une question est servie sans appel LLM si son
+    embedding est à une similarité cosinus >= threshold d'une question déjà traitée ET si la
+    version de l'index, les filtres et les IDs des chunks récupérés sont identiques.
+    Éviction : durée de vie (ttl, en secondes), puis la moins récemment utilisée au-delà de max_size.
+    """
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(index_version, chunk_ids, filters):
+        return (index_version, tuple(chunk_ids), tuple(sorted((filters or {}).items())))
+
+    def _expire(self):
+        limit = time.time() - self.ttl
+        for entry_id in [i for i, e in self.entries.items() if e["created_at"] < limit]:
+            del self.entries[entry_id]
+            self.evictions += 1
+
+    def get(self, embedding, index_version, chunk_ids, filters=None):
+        """(réponse, sources) si une question équivalente est en cache, sinon None."""
+        vector = np.array(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        key = self._key(index_version, chunk_ids, filters)
+        with self.lock:
+            self._expire()
+            best_id, best_score = None, self.threshold
+            for entry_id, entry in self.entries.items():
+                if entry["key"] == key:
+                    score = float(np.dot(entry["vector"], vector))
+                    if score >= best_score:
+                        best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_id)
+            self.hits += 1
+            return self.entries[best_id]["answer"], self.entries[best_id]["sources"]
+
+    def put(self, embedding, index_version, chunk_ids, filters, answer, sources):
+        vector = np.array(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self.lock:
+            self.entries[self.next_id] = {"key": self._key(index_version, chunk_ids, filters), "vector": vector,
+                                          "answer": answer, "sources": sources, "created_at": time.time()}
+            self.next_id += 1
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "size": len(self.entries), "evictions": self.evictions}